@@ -1,12 +1,13 @@
 import os
 from datetime import datetime
 
-from llm_magnet_connector.image_generator import ResponseToImage
+from llm_magnet_connector.image_generator import ResponseToImage, EvaluationCache
 from llm_magnet_connector.llm_interface import (
     AnthropicConversationManager,
     get_system_prompt,
     get_initial_prompt,
     OptimizerParameters,
+    ImagePreprocessingConfig,
 )
 from llm_magnet_connector.orchestrator import MainOrchestrator
 from llm_magnet_connector.utils import create_logger
@@ -40,11 +41,19 @@ llm_manager = AnthropicConversationManager(
     max_prompts=100,
     context_window_limit=60000,
     system_prompt=get_system_prompt(),
+    image_preprocessing=ImagePreprocessingConfig(colors=64),
+)
+scenario = "assets/test_scenario2"
+# curves already evaluated for the scenario in earlier runs are reused
+image_generator = ResponseToImage(
+    logger,
+    output_dir,
+    scenario=scenario,
+    evaluation_cache=EvaluationCache(os.path.join("runs", "evaluation_cache")),
 )
-image_generator = ResponseToImage(logger, output_dir)
 
 max_iterations = 100
 orchestrator = MainOrchestrator(llm_manager, image_generator, max_iterations, logger)
 orchestrator.run(
-    get_initial_prompt(OptimizerParameters(9, 80, 20, -8)), "assets/test_scenario2"
+    get_initial_prompt(OptimizerParameters(9, 80, 20, -8)), scenario
 )
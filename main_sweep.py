@@ -0,0 +1,54 @@
+import os
+from datetime import datetime
+
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    get_system_prompt,
+    OptimizerParameters,
+    ImagePreprocessingConfig,
+)
+from llm_magnet_connector.image_generator import EvaluationCache
+from llm_magnet_connector.orchestrator import ScenarioSweep
+from llm_magnet_connector.utils import create_logger
+
+
+def create_llm_manager(logger):
+    """
+    Creates the LLM conversation manager for one run of the sweep.
+
+    Args:
+        logger: The logger of the run.
+
+    Returns:
+        The LLM conversation manager.
+    """
+    return AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        max_prompts=100,
+        context_window_limit=60000,
+        system_prompt=get_system_prompt(),
+        image_preprocessing=ImagePreprocessingConfig(colors=64),
+    )
+
+
+logger = create_logger()
+
+output_dir = os.path.join(
+    "runs", "sweep_" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+)
+
+sweep = ScenarioSweep(
+    logger,
+    create_llm_manager,
+    output_dir,
+    max_iterations=100,
+    max_concurrent_runs=4,
+    evaluation_cache=EvaluationCache(os.path.join("runs", "evaluation_cache")),
+)
+runs = ScenarioSweep.grid(
+    ["assets/Scenario1", "assets/Scenario2"],
+    [OptimizerParameters(9, 80, 20, -8), OptimizerParameters(7, 100, 15, -8)],
+)
+sweep.run(runs)
@@ -0,0 +1,2 @@
+from .iteration_benchmark import run_iteration_benchmark, run_benchmark_suite
+from .annotation_benchmark import run_annotation_benchmark
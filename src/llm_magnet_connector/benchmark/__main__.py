@@ -0,0 +1,53 @@
+import argparse
+import json
+import os
+
+from .iteration_benchmark import run_benchmark_suite, format_results
+from .annotation_benchmark import run_annotation_benchmark, format_annotation_results
+
+# assets/Scenario2 of the repository, independent of the working directory
+_DEFAULT_SCENARIO = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, "assets", "Scenario2")
+)
+
+parser = argparse.ArgumentParser(
+    description="Measures the time per stage of the orchestrator loop against a fake LLM and a fake curve generator."
+)
+parser.add_argument("--scenario", default=_DEFAULT_SCENARIO, help="Directory with the scenario images (Z, 0a, 0b, 0c). Defaults to assets/Scenario2 of the repository.")
+parser.add_argument("--iterations", type=int, nargs="+", default=[10, 50, 100], help="Iteration counts to run.")
+parser.add_argument("--context-window-limit", type=int, default=60000, help="Context window limit of the conversation manager.")
+parser.add_argument("--model-latency", type=float, default=0.0, help="Simulated latency per LLM request [s].")
+parser.add_argument("--generation-latency", type=float, default=0.0, help="Simulated latency per curve generation [s].")
+parser.add_argument("--generator", choices=["copy", "numpy"], default="copy", help="Curve generator: copy the scenario images, or render curves with the NumpyCurveGenerator.")
+parser.add_argument("--in-memory", action="store_true", help="Pass the generated images to the requests in memory, saving them in the background.")
+parser.add_argument("--pipelined", action="store_true", help="Prepare the context for the next re-prompt while the images are being generated.")
+parser.add_argument("--async-logging", action="store_true", help="Format and write the log records in a background thread.")
+parser.add_argument("--metrics", default=None, help="JSONL file for the metrics records of the runs (per iteration and per API call); a Prometheus textfile is written next to it.")
+parser.add_argument("--annotation", action="store_true", help="Measure the annotation throughput [images/s] on copies of the scenario images instead of the orchestrator loop.")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 0], help="Worker counts of the annotation benchmark (0 for the default).")
+parser.add_argument("--output", default="benchmark_results.json", help="Path of the JSON results file.")
+args = parser.parse_args()
+
+if args.annotation:
+    results = run_annotation_benchmark(
+        args.scenario, worker_counts=[workers or None for workers in args.workers]
+    )
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(format_annotation_results(results))
+else:
+    results = run_benchmark_suite(
+        args.scenario,
+        iteration_counts=args.iterations,
+        output_path=args.output,
+        context_window_limit=args.context_window_limit,
+        model_latency=args.model_latency,
+        generation_latency=args.generation_latency,
+        curve_generator=args.generator,
+        in_memory=args.in_memory,
+        pipelined=args.pipelined,
+        metrics_path=args.metrics,
+        async_logging=args.async_logging,
+    )
+    print(format_results(results))
+print(f"Results written to {args.output}")
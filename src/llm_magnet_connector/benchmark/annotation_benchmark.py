@@ -0,0 +1,76 @@
+from llm_magnet_connector.image_generator._annotate_imgs import annotate_images
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+
+def run_annotation_benchmark(
+    images_dir: str,
+    copies=8,
+    repetitions=3,
+    worker_counts=(1, None),
+) -> dict:
+    """
+    Measures the throughput of annotate_images on a directory of copies of the given images.
+
+    Args:
+        images_dir (str): Directory with the PNG images to annotate (e.g., the images of a scenario).
+        copies (int): The number of copies of each image in the annotated directory, e.g., for the images of several candidates.
+        repetitions (int): The number of repetitions per worker count. The best repetition counts.
+        worker_counts ([int]): The worker counts (max_workers of annotate_images) to measure. None uses the default.
+
+    Returns:
+        A dict with the number of images, the CPU count and, per worker count, the best wall time [s] and the throughput [images/s].
+    """
+    sources = sorted(glob.glob(os.path.join(images_dir, "*.png")))
+    if not sources:
+        raise ValueError(f"No PNG images in {images_dir}")
+    work_dir = tempfile.mkdtemp(prefix="llm_magnet_connector_annotation_benchmark_")
+    input_dir = os.path.join(work_dir, "input")
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(input_dir)
+    try:
+        for copy in range(copies):
+            for source in sources:
+                shutil.copyfile(source, os.path.join(input_dir, f"{copy}_{os.path.basename(source)}"))
+        images = copies * len(sources)
+
+        runs = []
+        for workers in worker_counts:
+            wall_time = float("inf")
+            for _ in range(repetitions):
+                start_time = time.perf_counter()
+                annotate_images(input_dir, output_dir, max_workers=workers)
+                wall_time = min(wall_time, time.perf_counter() - start_time)
+            runs.append(
+                {
+                    "workers": workers,
+                    "wall_time": wall_time,
+                    "images_per_second": images / wall_time,
+                }
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {"images": images, "cpu_count": os.cpu_count(), "runs": runs}
+
+
+def format_annotation_results(results: dict) -> str:
+    """
+    Formats the results of run_annotation_benchmark as one line per worker count.
+
+    Args:
+        results (dict): The results of run_annotation_benchmark.
+
+    Returns:
+        The formatted results.
+    """
+    lines = [f"Annotation of {results['images']} images ({results['cpu_count']} CPUs):"]
+    for run in results["runs"]:
+        workers = run["workers"] if run["workers"] is not None else "default"
+        lines.append(
+            f"  workers={workers}: {run['images_per_second']:.1f} images/s ({run['wall_time'] * 1000:.0f} ms)"
+        )
+    return "\n".join(lines)
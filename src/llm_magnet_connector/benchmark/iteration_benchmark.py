@@ -0,0 +1,321 @@
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    OptimizerParameters,
+    RequestScheduler,
+    get_initial_prompt,
+    get_system_prompt,
+)
+from llm_magnet_connector.image_generator import CurveGenerator, NumpyCurveGenerator, ResponseToImage
+from llm_magnet_connector.orchestrator import MainOrchestrator
+from llm_magnet_connector.utils import MetricsRecorder, StageTimer, run_sync, timed
+from llm_magnet_connector.utils.logger import SanitizingFormatter, create_queue_handler
+import anthropic
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+# prose preceding the parameters in each fake response, roughly the length of a real answer
+_FAKE_ANSWER_PROSE = (
+    "We state that we are now going to assess the \"goodness\" of the curve. "
+    "We analyse each criterion for a \"bad\" curve. " * 40
+)
+
+# the logger of the Anthropic client, which logs the options of every request at DEBUG level
+_CLIENT_LOGGER = logging.getLogger("anthropic._base_client")
+
+
+class _FakeConversationManager(AnthropicConversationManager):
+    """
+    AnthropicConversationManager answering every prompt with new optimizer parameters without calling the API.
+    The request is JSON-encoded and logged like the Anthropic client would, to measure the request serialization and logging.
+    """
+
+    def __init__(self, logger, model_latency: float, **kwargs):
+        super().__init__(
+            logger,
+            cost_1M_input_tokens=3,
+            cost_1M_output_tokens=15,
+            scheduler=RequestScheduler(max_retries=0),
+            **kwargs,
+        )
+        self._model_latency = model_latency
+        self._answers = 0
+
+    async def _request_message(self, request: dict, on_content_block=None):
+        if _CLIENT_LOGGER.isEnabledFor(logging.DEBUG):
+            _CLIENT_LOGGER.debug("Request options: %s", {"method": "post", "url": "/v1/messages", "json_data": request})
+        with timed("request_serialization"):
+            body = json.dumps(
+                {key: value for key, value in request.items() if value is not anthropic.NOT_GIVEN},
+                default=lambda value: value.model_dump(exclude_none=True),
+            )
+        if self._model_latency:
+            await asyncio.sleep(self._model_latency)
+        self._answers += 1
+        text = f"{_FAKE_ANSWER_PROSE}\nThe new optimizer parameters are [9, {80 + self._answers}, 20, -8]"
+        return anthropic.types.Message.model_validate(
+            {
+                "id": f"msg_benchmark_{self._answers}",
+                "type": "message",
+                "role": "assistant",
+                "model": self._model,
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {
+                    "input_tokens": self._token_accountant.estimate(),
+                    "output_tokens": len(text) // 4,
+                },
+            }
+        )
+
+    async def _count_tokens(self, messages: list) -> int:
+        return self._token_accountant.estimate()
+
+
+class _FakeCurveImageGenerator(CurveGenerator):
+    """
+    Curve image generator copying the three images of a scenario (0a, 0b, 0c) instead of waiting for a human.
+    """
+
+    def __init__(self, images_dir: str, generation_latency: float):
+        self._images = {
+            suffix: os.path.join(images_dir, file_name)
+            for file_name in os.listdir(images_dir)
+            for suffix in "abc"
+            if os.path.splitext(file_name)[0] == f"0{suffix}"
+        }
+        self._generation_latency = generation_latency
+
+    async def agenerate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+        if self._generation_latency:
+            await asyncio.sleep(self._generation_latency)
+        for suffix, path in self._images.items():
+            shutil.copyfile(path, os.path.join(dir, f"{index}{suffix}.png"))
+
+
+class _LatentNumpyCurveGenerator(NumpyCurveGenerator):
+    """
+    NumpyCurveGenerator with additional simulated latency per generation.
+    """
+
+    def __init__(self, logger, generation_latency: float, **kwargs):
+        super().__init__(logger, **kwargs)
+        self._generation_latency = generation_latency
+
+    async def agenerate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+        if self._generation_latency:
+            await asyncio.sleep(self._generation_latency)
+        await super().agenerate_images(dir, optimizer_params, index)
+
+    async def agenerate_image_buffers(self, dir, optimizer_params: OptimizerParameters, index: int):
+        if self._generation_latency:
+            await asyncio.sleep(self._generation_latency)
+        return await super().agenerate_image_buffers(dir, optimizer_params, index)
+
+
+def _create_curve_generator(name: str, logger, scenario_dir: str, generation_latency: float) -> CurveGenerator:
+    if name == "copy":
+        return _FakeCurveImageGenerator(scenario_dir, generation_latency)
+    if name == "numpy":
+        return _LatentNumpyCurveGenerator(logger, generation_latency)
+    raise ValueError(f"Unknown curve generator '{name}'")
+
+
+class _TimedHandler(logging.Handler):
+    """
+    Logging handler forwarding records to another handler and recording the time spent as stage "logging".
+    """
+
+    def __init__(self, handler: logging.Handler):
+        super().__init__(handler.level)
+        self._handler = handler
+
+    def handle(self, record):
+        with timed("logging"):
+            return self._handler.handle(record)
+
+    def close(self):
+        self._handler.close()
+        super().close()
+
+
+def run_iteration_benchmark(
+    iterations: int,
+    scenario_dir: str,
+    context_window_limit=60000,
+    model_latency=0.0,
+    generation_latency=0.0,
+    manager_options: dict | None = None,
+    curve_generator="copy",
+    in_memory=False,
+    pipelined=False,
+    metrics_path: str | None = None,
+    async_logging=False,
+) -> dict:
+    """
+    Runs the orchestrator loop for a fixed number of iterations against a fake LLM and a fake curve generator and measures the time per stage.
+
+    Args:
+        iterations (int): The number of re-prompt iterations.
+        scenario_dir (str): Directory with the images of a scenario (Z, 0a, 0b, 0c). Used for the initial prompt and as generated images.
+        context_window_limit (int): The context window limit of the conversation manager.
+        model_latency (float): Simulated latency of each LLM request [s].
+        generation_latency (float): Simulated latency of each curve generation [s].
+        manager_options (dict): Further arguments of AnthropicConversationManager.
+        curve_generator (str): "copy" to copy the scenario images as generated images, or "numpy" to render the curves with the NumpyCurveGenerator (generation_latency is added in both cases).
+        in_memory (bool): Whether the images are passed from the generator to the request in memory (see ResponseToImage).
+        pipelined (bool): Whether the orchestrator prepares the context while the images are being generated (see MainOrchestrator).
+        metrics_path (str): If given, the metrics records of the run (see MetricsRecorder) are appended to this JSONL file, and the aggregates are written to a Prometheus textfile next to it (.prom).
+        async_logging (bool): Whether the log records are formatted and written in a background thread (see create_queue_handler). The stage "logging" is the time spent logging in the loop in both cases.
+
+    Returns:
+        A dict with the configuration, the wall time, the mean critical path time per iteration [s] (see RunResult) and the stages (total, count, mean and per-iteration time [s]).
+    """
+    work_dir = tempfile.mkdtemp(prefix="llm_magnet_connector_benchmark_")
+    logger = logging.getLogger(f"benchmark.{iterations}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    file_handler = logging.FileHandler(os.path.join(work_dir, "benchmark.log"))
+    file_handler.setFormatter(
+        SanitizingFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s", max_message_length=20_000)
+    )
+    listener = None
+    if async_logging:
+        queue_handler, listener = create_queue_handler(file_handler)
+        handler = _TimedHandler(queue_handler)
+    else:
+        handler = _TimedHandler(file_handler)
+    logger.addHandler(handler)
+    client_level = _CLIENT_LOGGER.level
+    _CLIENT_LOGGER.setLevel(logging.DEBUG)
+    _CLIENT_LOGGER.addHandler(handler)
+
+    try:
+        llm_manager = _FakeConversationManager(
+            logger,
+            model_latency,
+            system_prompt=get_system_prompt(),
+            max_prompts=iterations + 1,
+            context_window_limit=context_window_limit,
+            **(manager_options or {}),
+        )
+        image_generator = ResponseToImage(
+            logger,
+            os.path.join(work_dir, "images"),
+            curve_generator=_create_curve_generator(curve_generator, logger, scenario_dir, generation_latency),
+            in_memory=in_memory,
+        )
+        orchestrator = MainOrchestrator(llm_manager, image_generator, iterations, logger, pipelined=pipelined)
+
+        timer = StageTimer()
+        metrics = (
+            MetricsRecorder(metrics_path, os.path.splitext(metrics_path)[0] + ".prom", labels={"benchmark": str(iterations)})
+            if metrics_path is not None
+            else None
+        )
+        with timer.activate(), metrics.activate() if metrics is not None else contextlib.nullcontext():
+            start_time = time.perf_counter()
+            run_result = run_sync(
+                orchestrator.arun(
+                    get_initial_prompt(OptimizerParameters(9, 80, 20, -8)), scenario_dir
+                )
+            )
+            wall_time = time.perf_counter() - start_time
+        if metrics is not None:
+            metrics.close()
+    finally:
+        logger.removeHandler(handler)
+        _CLIENT_LOGGER.removeHandler(handler)
+        _CLIENT_LOGGER.setLevel(client_level)
+        if listener is not None:
+            listener.stop()
+        handler.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stages = timer.summary()
+    for stage in stages.values():
+        stage["per_iteration"] = stage["total"] / iterations
+    return {
+        "iterations": iterations,
+        "context_window_limit": context_window_limit,
+        "model_latency": model_latency,
+        "generation_latency": generation_latency,
+        "curve_generator": curve_generator,
+        "in_memory": in_memory,
+        "pipelined": pipelined,
+        "async_logging": async_logging,
+        "wall_time": wall_time,
+        "critical_path": run_result.critical_path_time,
+        "stages": stages,
+    }
+
+
+def run_benchmark_suite(
+    scenario_dir: str,
+    iteration_counts=(10, 50, 100),
+    output_path: str | None = None,
+    **kwargs,
+) -> dict:
+    """
+    Runs run_iteration_benchmark for several iteration counts to expose super-linear costs, and optionally writes the results as JSON.
+
+    Args:
+        scenario_dir (str): Directory with the images of a scenario (Z, 0a, 0b, 0c).
+        iteration_counts ([int]): The iteration counts to run.
+        output_path (str): Path of the JSON results file. If None, the results are not written.
+        **kwargs: Further arguments of run_iteration_benchmark.
+
+    Returns:
+        A dict with metadata (commit, timestamp, platform) and the results of all runs.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    results = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": [run_iteration_benchmark(iterations, scenario_dir, **kwargs) for iterations in iteration_counts],
+    }
+    if output_path is not None:
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+def format_results(results: dict) -> str:
+    """
+    Formats the results of run_benchmark_suite as a table of the time per iteration [ms] of each stage and run.
+
+    Args:
+        results (dict): The results of run_benchmark_suite.
+
+    Returns:
+        The table.
+    """
+    runs = results["runs"]
+    stages = sorted({stage for run in runs for stage in run["stages"]})
+    header = ["stage [ms/iteration]"] + [f"{run['iterations']} it." for run in runs]
+    rows = [
+        [stage] + [f"{run['stages'].get(stage, {}).get('per_iteration', 0) * 1000:.2f}" for run in runs]
+        for stage in stages
+    ]
+    rows.append(["critical path"] + [f"{run['critical_path'] * 1000:.2f}" for run in runs])
+    rows.append(["wall time"] + [f"{run['wall_time'] / run['iterations'] * 1000:.2f}" for run in runs])
+    table = [header] + rows
+    widths = [max(len(row[column]) for row in table) for column in range(len(header))]
+    return "\n".join("  ".join(value.rjust(width) if column else value.ljust(width) for column, (value, width) in enumerate(zip(row, widths))) for row in table)
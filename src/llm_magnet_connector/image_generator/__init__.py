@@ -1 +1,5 @@
-from .response_to_image import ResponseToImage
\ No newline at end of file
+from .response_to_image import ResponseToImage
+from .evaluation_cache import EvaluationCache, normalize_parameters
+from ._generate_curve_images import CurveGenerator, CurveImageGenerator
+from ._numpy_curve_generator import NumpyCurveGenerator, ConnectorGeometry
+from ._image_watcher import ImageWatcher, is_complete_png
@@ -1,153 +1,202 @@
-from PIL import Image, ImageDraw, ImageFont
-import numpy as np
-import os
-import glob
-import time
-
-
-def _add_text_to_image(
-    input_path, output_path, text, font_family, font_size, color, location
-):
-    """Adds text to an image at a specified location and saves the annotated image.
-    This function opens an image file, draws the specified text on it using the provided
-    font settings, and saves the resulting image to the specified output path.
-        input_path (str): Path to the input image file.
-        text (str): The text to be added to the image.
-        font_family (str): Path to the TrueType font file to use for the text.
-        font_size (int): Size of the font to be used for the text.
-        color (tuple): Color of the text in RGB format, e.g., (255, 255, 255) for white.
-        location (tuple): Coordinates (x, y) specifying where to place the text on the image.
-    Raises:
-        IOError: If the input image file cannot be opened or the font file is not found.
-    """
-    # Open image and create a drawing context.
-    image = Image.open(input_path)
-    draw = ImageDraw.Draw(image)
-
-    # Try to load the specified TrueType font.
-    try:
-        font = ImageFont.truetype(font_family, font_size)
-    except IOError:
-        # Fallback if the font file is not found.
-        font = ImageFont.load_default(font_size=font_size)
-
-    # Draw the text at the given location.
-    draw.text(location, text, font=font, fill=color)
-    image.save(output_path)
-
-
-def _annotate_img(input_path, output_path, text):
-    """Annotates the image at the given path with the given text.
-    Text will be added in one of the 4 corners, depending on the available amount of white space in each corner.
-    Text is added in red color with font family 'Arial' and size 120.
-    If 'arial.ttf' is not available, a fallback font is chosen.
-
-    Args:
-        input_path (str): Path to the image file.
-        output_path (str): Path to save the annotated image.
-        text (str): Text to label the image.
-    """
-    # Open the image and ensure it's in RGB mode.
-    image = Image.open(input_path).convert("RGB")
-    width, height = image.size
-
-    # Set font properties.
-    font_size = 120
-    font_family = "arial.ttf"
-
-    # Create a drawing context.
-    draw = ImageDraw.Draw(image)
-    try:
-        font = ImageFont.truetype(font_family, font_size)
-    except IOError:
-        # Fallback if the font file is not found.
-        font = ImageFont.load_default(font_size=font_size)
-
-    # Measure the text bounding box.
-    # textbbox returns (x0, y0, x1, y1) relative to the anchor (0,0)
-    bbox = draw.textbbox((0, 0), text, font=font)
-    x0, y0, x1, y1 = bbox
-    text_width = x1 - x0
-    text_height = y1 - y0
-
-    # Define candidate regions (bounding boxes) for each corner.
-    # Each box is defined as (left, top, right, bottom).
-    candidates = {
-        "top_left": (0, 0, text_width, text_height),
-        "top_right": (width - text_width, 0, width, text_height),
-        "bottom_left": (0, height - text_height, text_width, height),
-        "bottom_right": (width - text_width, height - text_height, width, height),
-    }
-
-    # Count white pixels in each candidate area.
-    white_counts = {}
-    for corner, box in candidates.items():
-        region = image.crop(box).convert("RGB")
-        region_array = np.array(region)
-        # Count pixels that are exactly white (255, 255, 255)
-        count_white = np.sum(np.all(region_array == [255, 255, 255], axis=-1))
-        white_counts[corner] = count_white
-
-    # Determine which corner has the most white pixels.
-    max_white = max(white_counts.values())
-    max_candidates = [
-        corner for corner, count in white_counts.items() if count == max_white
-    ]
-
-    if len(max_candidates) == 1:
-        chosen_corner = max_candidates[0]
-    else:
-        # If there is no unique maximum, default to the bottom right.
-        chosen_corner = "bottom_right"
-
-    # Compute the adjusted drawing location based on the bounding box offsets.
-    # This ensures that the drawn text's bounding box is flush with the chosen image corner
-    if chosen_corner == "top_left":
-        location = (-x0, -y0)
-    elif chosen_corner == "top_right":
-        location = (width - x1, -y0)
-    elif chosen_corner == "bottom_left":
-        location = (-x0, height - y1)
-    else:  # bottom_right
-        location = (width - x1, height - y1)
-
-    # Define text color (red) as an RGB tuple.
-    color = (255, 0, 0)
-
-    # Call the helper function to add text to the image.
-    _add_text_to_image(
-        input_path, output_path, text, font_family, font_size, color, location
-    )
-
-def annotate_images(input_dir, output_dir):
-    """Annotates all PNG images in the input directory with their file name (without file extension).
-    The annotated images are saved in the output directory.
-    The output directory will be created if non-existent.
-
-    Args:
-        input_dir (str): Path to the directory containing input PNG images.
-        output_dir (str): Path to the directory to save annotated images.
-    """
-    # Create the output directory 
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Get list of all PNG files in the input directory.
-    png_files = glob.glob(os.path.join(input_dir, "*.png"))
-    
-    for input_path in png_files:
-        # Extract the base filename (without extension) to use as the annotation text.
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        output_path = os.path.join(output_dir, os.path.basename(input_path))
-        
-        # Annotate the image using the annotate_img function. Try 3 times as the image may be in use for a short time.
-        for attempt in range(3):
-            try:
-                _annotate_img(input_path, output_path, base_name)
-                break
-            except Exception as ex:
-                if attempt < 2:  # Retry for the first 2 attempts
-                    time.sleep(0.3)
-                else:
-                    raise ex  # Raise the exception after 3 failed attempts
-
-
+from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import functools
+import os
+import glob
+import asyncio
+
+# Text is added in red color with font family 'Arial' and size 120.
+_FONT_FAMILY = "arial.ttf"
+_FONT_SIZE = 120
+_TEXT_COLOR = (255, 0, 0)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_font(font_family, font_size):
+    """Returns the font for the given family and size. Fonts are loaded once per process and shared by all threads.
+
+    Args:
+        font_family (str): Path to the TrueType font file to use for the text.
+        font_size (int): Size of the font to be used for the text.
+    """
+    # Try to load the specified TrueType font.
+    try:
+        return ImageFont.truetype(font_family, font_size)
+    except IOError:
+        # Fallback if the font file is not found.
+        return ImageFont.load_default(size=font_size)
+
+
+def _white_pixel_counts(image, boxes):
+    """Counts the exactly white (255, 255, 255) pixels in each of the given boxes.
+    A single white-pixel mask of the rows covered by the boxes is reduced to a summed-area table, so each box is counted in constant time. Parts of a box outside the image count as not white.
+
+    Args:
+        image (PIL.Image.Image): The image.
+        boxes (dict): The boxes (left, top, right, bottom) by name.
+
+    Returns:
+        The number of white pixels by box name.
+    """
+    width, height = image.size
+    clipped = {
+        name: (
+            min(max(left, 0), width),
+            min(max(top, 0), height),
+            min(max(right, 0), width),
+            min(max(bottom, 0), height),
+        )
+        for name, (left, top, right, bottom) in boxes.items()
+    }
+    # only the rows covered by a box are part of the mask (for corner boxes, a strip at the top and at the bottom)
+    covered = np.zeros(height, dtype=bool)
+    for _, top, _, bottom in clipped.values():
+        covered[top:bottom] = True
+    rows = np.flatnonzero(covered)
+    # row index in the image -> row index in the mask
+    mask_row = np.concatenate([[0], np.cumsum(covered)])
+
+    pixels = np.asarray(image)[rows]
+    if pixels.ndim == 2:
+        white = pixels == 255
+    else:
+        white = np.all(pixels[..., :3] == 255, axis=-1)
+    # summed-area table with a leading row and column of zeros: table[y, x] = white pixels above and left of (x, y)
+    table = np.zeros((len(rows) + 1, width + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(white, axis=0, dtype=np.int32), axis=1, out=table[1:, 1:])
+
+    counts = {}
+    for name, (left, top, right, bottom) in clipped.items():
+        top, bottom = mask_row[top], mask_row[bottom]
+        counts[name] = int(table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left])
+    return counts
+
+
+def annotate_image(image, text):
+    """Annotates an image with the given text, in memory.
+    Text will be added in one of the 4 corners, depending on the available amount of white space in each corner.
+    Text is added in red color with font family 'Arial' and size 120.
+    If 'arial.ttf' is not available, a fallback font is chosen.
+
+    Args:
+        image (PIL.Image.Image): The image to annotate. Palette and grayscale images are converted to RGB(A), the image is not modified otherwise.
+        text (str): Text to label the image.
+
+    Returns:
+        The annotated image.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+    else:
+        image = image.copy()
+    width, height = image.size
+
+    # Measure the text bounding box.
+    # textbbox returns (x0, y0, x1, y1) relative to the anchor (0,0)
+    draw = ImageDraw.Draw(image)
+    font = _get_font(_FONT_FAMILY, _FONT_SIZE)
+    x0, y0, x1, y1 = draw.textbbox((0, 0), text, font=font)
+    text_width = x1 - x0
+    text_height = y1 - y0
+
+    # Define candidate regions (bounding boxes) for each corner.
+    # Each box is defined as (left, top, right, bottom).
+    candidates = {
+        "top_left": (0, 0, text_width, text_height),
+        "top_right": (width - text_width, 0, width, text_height),
+        "bottom_left": (0, height - text_height, text_width, height),
+        "bottom_right": (width - text_width, height - text_height, width, height),
+    }
+
+    # Determine which corner has the most white pixels.
+    white_counts = _white_pixel_counts(image, candidates)
+    max_white = max(white_counts.values())
+    max_candidates = [
+        corner for corner, count in white_counts.items() if count == max_white
+    ]
+
+    if len(max_candidates) == 1:
+        chosen_corner = max_candidates[0]
+    else:
+        # If there is no unique maximum, default to the bottom right.
+        chosen_corner = "bottom_right"
+
+    # Compute the adjusted drawing location based on the bounding box offsets.
+    # This ensures that the drawn text's bounding box is flush with the chosen image corner
+    if chosen_corner == "top_left":
+        location = (-x0, -y0)
+    elif chosen_corner == "top_right":
+        location = (width - x1, -y0)
+    elif chosen_corner == "bottom_left":
+        location = (-x0, height - y1)
+    else:  # bottom_right
+        location = (width - x1, height - y1)
+
+    draw.text(location, text, font=font, fill=_TEXT_COLOR)
+    return image
+
+
+def _annotate_img(input_path, output_path, text):
+    """Annotates the image at the given path with the given text (see annotate_image).
+    The image is decoded and written once.
+
+    Args:
+        input_path (str): Path to the image file.
+        output_path (str): Path to save the annotated image.
+        text (str): Text to label the image.
+    """
+    with Image.open(input_path) as image:
+        image.load()
+        annotated = annotate_image(image, text)
+    annotated.save(output_path)
+
+
+def _annotation_jobs(input_dir, output_dir):
+    """Returns (input_path, output_path, text) for all PNG images in the input directory, the text being the file name without extension.
+    The output directory will be created if non-existent.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    return [
+        (
+            input_path,
+            os.path.join(output_dir, os.path.basename(input_path)),
+            os.path.splitext(os.path.basename(input_path))[0],
+        )
+        for input_path in sorted(glob.glob(os.path.join(input_dir, "*.png")))
+    ]
+
+
+def annotate_images(input_dir, output_dir, max_workers=None):
+    """Annotates all PNG images in the input directory with their file name (without file extension).
+    The annotated images are saved in the output directory.
+    The output directory will be created if non-existent.
+    The images are annotated in parallel threads (decoding, drawing and encoding release the GIL).
+
+    Args:
+        input_dir (str): Path to the directory containing input PNG images.
+        output_dir (str): Path to the directory to save annotated images.
+        max_workers (int): The maximum number of images annotated at the same time. Defaults to one per image, at most the number of CPUs.
+    """
+    jobs = _annotation_jobs(input_dir, output_dir)
+    if not jobs:
+        return
+    workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    if workers == 1:
+        for job in jobs:
+            _annotate_img(*job)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() raises the first exception of the jobs
+        list(executor.map(lambda job: _annotate_img(*job), jobs))
+
+
+async def aannotate_images(input_dir, output_dir):
+    """Asynchronous variant of annotate_images. The images are annotated in parallel in worker threads, so the event loop is not blocked.
+
+    Args:
+        input_dir (str): Path to the directory containing input PNG images.
+        output_dir (str): Path to the directory to save annotated images.
+    """
+    jobs = await asyncio.to_thread(_annotation_jobs, input_dir, output_dir)
+    await asyncio.gather(*(asyncio.to_thread(_annotate_img, *job) for job in jobs))
@@ -1,41 +1,109 @@
-from pathlib import Path
-import time
+from abc import ABC, abstractmethod
+from PIL import Image
+import asyncio
+import os
 from llm_magnet_connector.llm_interface import OptimizerParameters
+from llm_magnet_connector.utils import run_sync
+from ._image_watcher import ImageWatcher
 
-class CurveImageGenerator:
+
+def _load_images(dir, index: int) -> dict[str, Image.Image]:
+    """
+    Decodes the images {index}*.png in the directory.
+
+    returns:
+        The images by name (file name without extension).
+    """
+    images = {}
+    for file_name in sorted(os.listdir(dir)):
+        name, extension = os.path.splitext(file_name)
+        if extension == ".png" and name.startswith(str(index)):
+            with Image.open(os.path.join(dir, file_name)) as image:
+                image.load()
+                images[name] = image
+    return images
+
+
+class CurveGenerator(ABC):
+    """
+    This class is the interface of the backends that take a set of optimizer parameters and generate the images of the curve created by those optimizer params (see ResponseToImage).
+    """
+
+    @abstractmethod
+    async def agenerate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+        """
+        Generates the images of the curve for the given optimizer parameters. The images must be saved as {index}a.png (overview), {index}b.png and {index}c.png (close-ups of the two ends) in dir.
+
+        args:
+            dir: The directory for the output images
+            optimizer_params: Optimizer parameters to use
+            index: Index for the image names.
+        """
+        pass
+
+    async def agenerate_image_buffers(self, dir, optimizer_params: OptimizerParameters, index: int) -> dict[str, Image.Image]:
+        """
+        Generates the images of the curve in memory (see agenerate_images), e.g., to annotate and encode them without writing and reading them first.
+        By default, the images are generated in dir and decoded once. Backends rendering in memory override this method and do not write to dir.
+
+        args:
+            dir: The directory for the output images (if written by the backend)
+            optimizer_params: Optimizer parameters to use
+            index: Index for the image names.
+
+        returns:
+            The decoded images by name (e.g., "3a").
+        """
+        await self.agenerate_images(dir, optimizer_params, index)
+        return await asyncio.to_thread(_load_images, dir, index)
+
+    def generate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+        """
+        Synchronous wrapper around agenerate_images.
+
+        args:
+            dir: The directory for the output images
+            optimizer_params: Optimizer parameters to use
+            index: Index for the image names.
+        """
+        run_sync(self.agenerate_images(dir, optimizer_params, index))
+
+
+class CurveImageGenerator(CurveGenerator):
     """
     This class is used to take a set of optimizer parameters and generate images from the curve created by those optimizer params.
+    The images are created manually: the parameters are logged and the generator waits for the user to put the images into the directory.
     """
-    def __init__(self, logger):
+    def __init__(self, logger, watcher: ImageWatcher | None = None, timeout: float | None = None):
         """
         Initializes the CurveImageGenerator.
         
         args:
             logger: The logger to use.
+            watcher: The ImageWatcher detecting the arrival of the images. Can be shared by the generators of parallel runs. Defaults to a new ImageWatcher.
+            timeout: The maximum time to wait for the images of one curve [s]. If None, waits indefinitely.
         """
         self.logger = logger
-        pass
+        self._watcher = watcher if watcher is not None else ImageWatcher(logger)
+        self._timeout = timeout
     
-    def _wait_for_images(self, dir, image_names: list):
+    async def _wait_for_images(self, dir, image_names: list):
         """
-        Waits for the user to manually create the images. Images must be .png.
+        Waits for the user to manually create the images. Images must be .png and are only accepted once completely written.
         
         args:
             dir: The directory the user should put the images in
             image_names: List of expected image files (without .png extension).
+
+        raises:
+            TimeoutError: If the images did not arrive within the timeout.
         """
-        dir_path = Path(dir)
-        images_found = False
         self.logger.info(f"Waiting for images {image_names} in directory {dir}")
-        while not images_found:
-            # check if images are there
-            images_found = all((dir_path / f"{name}.png").exists() for name in image_names)
-            if not images_found:
-                time.sleep(0.01)
+        await self._watcher.wait_for_images(dir, [f"{name}.png" for name in image_names], self._timeout)
         self.logger.info("Images found.")
             
     
-    def generate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+    async def agenerate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
         """
         Optimizes the curve using the given optimizer parameters and creates images from the curve.
         
@@ -46,4 +114,4 @@ class CurveImageGenerator:
         """
         # TODO stub implementation
         self.logger.info(f"Please apply optimizer params: {optimizer_params}")
-        self._wait_for_images(dir, [f"{index}a", f"{index}b", f"{index}c"])
\ No newline at end of file
+        await self._wait_for_images(dir, [f"{index}a", f"{index}b", f"{index}c"])
\ No newline at end of file
@@ -0,0 +1,237 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+# inotify constants (see <sys/inotify.h>)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+_EVENT_HEADER = struct.Struct("iIII")
+
+# the last chunk of every PNG file: length 0, type IEND, CRC
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_IEND_CHUNK = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+def is_complete_png(path: str) -> bool:
+    """
+    Checks if a PNG file is completely written, i.e., starts with the PNG signature and ends with the IEND chunk.
+
+    args:
+        path: The path to the file.
+
+    returns:
+        True if the file exists and is a complete PNG file.
+    """
+    try:
+        with open(path, "rb") as file:
+            if file.read(len(_PNG_SIGNATURE)) != _PNG_SIGNATURE:
+                return False
+            file.seek(-len(_PNG_IEND_CHUNK), os.SEEK_END)
+            return file.read() == _PNG_IEND_CHUNK
+    except OSError:
+        # missing, or shorter than signature and IEND chunk
+        return False
+
+
+class _Inotify:
+    """
+    One inotify instance registered as reader on an event loop. Directories are watched for close-after-write and moved-to events, reference counted per directory, and the events are dispatched to the callbacks of the directory.
+    """
+
+    def __init__(self, libc, loop: asyncio.AbstractEventLoop):
+        self._libc = libc
+        self.loop = loop
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1 failed: {os.strerror(error)}")
+        # directory -> watch descriptor, watch descriptor -> callbacks
+        self._watches = {}
+        self._callbacks = {}
+        loop.add_reader(self._fd, self._read_events)
+
+    def add(self, directory: str, callback) -> int:
+        """
+        Calls callback(name) for every file closed after writing in (or moved to) the directory. None as name means that events were lost.
+
+        returns:
+            The watch descriptor, to be passed to remove.
+        """
+        wd = self._watches.get(directory)
+        if wd is None:
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_TO)
+            if wd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, f"inotify_add_watch failed for {directory}: {os.strerror(error)}")
+            self._watches[directory] = wd
+        self._callbacks.setdefault(wd, set()).add(callback)
+        return wd
+
+    def remove(self, directory: str, wd: int, callback):
+        callbacks = self._callbacks.get(wd)
+        if callbacks is None:
+            return
+        callbacks.discard(callback)
+        if not callbacks:
+            del self._callbacks[wd]
+            if self._watches.get(directory) == wd:
+                del self._watches[directory]
+                # fails if the directory was deleted (the watch is gone already)
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self):
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            except OSError as ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                name = buffer[offset + _EVENT_HEADER.size : offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += _EVENT_HEADER.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    # events were lost, every waiter has to check its files again
+                    for callbacks in list(self._callbacks.values()):
+                        for callback in list(callbacks):
+                            callback(None)
+                    continue
+                if mask & _IN_IGNORED:
+                    # the watch was removed, e.g., because the directory was deleted
+                    for directory, watched in list(self._watches.items()):
+                        if watched == wd:
+                            del self._watches[directory]
+                    continue
+                for callback in list(self._callbacks.get(wd, ())):
+                    callback(os.fsdecode(name))
+
+    def close(self):
+        if not self.loop.is_closed():
+            self.loop.remove_reader(self._fd)
+        os.close(self._fd)
+
+
+class ImageWatcher:
+    """
+    This class waits for image files to arrive in directories, e.g., images created by an external tool or by hand.
+    On Linux, the watcher is woken only by inotify close-after-write (and moved-to) events; elsewhere, or if inotify is not available, the directories are polled.
+    A file only counts as arrived once it is a complete PNG file (see is_complete_png), so readers never see partially written images.
+    Any number of directories can be waited on concurrently (e.g., by parallel runs); all waits of an event loop share one inotify instance.
+
+    args:
+        logger: The logger to use.
+        poll_interval: The interval of the polling fallback [s].
+        use_inotify: Whether to use inotify if available. If False, the directories are polled.
+    """
+
+    def __init__(self, logger, poll_interval=0.05, use_inotify=True):
+        self.logger = logger
+        self._poll_interval = poll_interval
+        self._libc = self._load_libc() if use_inotify else None
+        self._inotify = None
+
+    @staticmethod
+    def _load_libc():
+        """
+        Returns the C library if it provides inotify, None otherwise.
+        """
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        except (OSError, AttributeError):
+            return None
+        return libc
+
+    @property
+    def uses_inotify(self) -> bool:
+        """
+        Whether the watcher uses inotify (as opposed to polling).
+        """
+        return self._libc is not None
+
+    def _get_inotify(self) -> _Inotify | None:
+        """
+        Returns the inotify instance of the running event loop. Falls back to polling permanently if inotify cannot be initialized.
+        """
+        if self._libc is None:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._inotify is None or self._inotify.loop is not loop:
+            if self._inotify is not None:
+                self._inotify.close()
+            try:
+                self._inotify = _Inotify(self._libc, loop)
+            except OSError as ex:
+                self.logger.warning(f"inotify not available ({ex}). Polling for images instead.")
+                self._libc = None
+                self._inotify = None
+        return self._inotify
+
+    async def wait_for_images(self, dir, file_names: list[str], timeout: float | None = None):
+        """
+        Waits until all given files exist in the directory and are complete PNG files. Returns immediately if they are already there.
+        Cancelling the waiting task stops the wait and releases the watch.
+
+        args:
+            dir: The directory to watch.
+            file_names: The expected file names (with extension).
+            timeout: The maximum time to wait [s]. If None, waits indefinitely.
+
+        raises:
+            TimeoutError: If the files did not arrive within the timeout.
+        """
+        try:
+            await asyncio.wait_for(self._wait(os.path.abspath(dir), list(file_names)), timeout)
+        except asyncio.TimeoutError:
+            missing = [name for name in file_names if not is_complete_png(os.path.join(dir, name))]
+            raise TimeoutError(f"Images {missing} did not arrive in {dir} within {timeout} s.") from None
+
+    async def _wait(self, dir: str, file_names: list[str]):
+        pending = set(file_names)
+        changed = asyncio.Event()
+
+        def on_event(name):
+            if name is None or name in pending:
+                changed.set()
+
+        inotify = self._get_inotify()
+        # the watch is added before checking the files, so no file written in between is missed
+        wd = inotify.add(dir, on_event) if inotify is not None else None
+        try:
+            while True:
+                changed.clear()
+                pending = {name for name in pending if not is_complete_png(os.path.join(dir, name))}
+                if not pending:
+                    return
+                if inotify is not None:
+                    await changed.wait()
+                else:
+                    await asyncio.sleep(self._poll_interval)
+        finally:
+            if inotify is not None:
+                inotify.remove(dir, wd, on_event)
+
+    def close(self):
+        """
+        Releases the inotify instance. Must not be called while a wait is in progress; later waits create a new instance.
+        """
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
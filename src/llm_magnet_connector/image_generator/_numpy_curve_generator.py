@@ -0,0 +1,302 @@
+from dataclasses import dataclass, asdict
+from PIL import Image
+import asyncio
+import json
+import math
+import os
+import numpy as np
+from llm_magnet_connector.llm_interface import OptimizerParameters
+from ._generate_curve_images import CurveGenerator
+
+# colors (RGB) of the rendered conductors: center and edge of the connector and of the two parts, background
+_CONNECTOR_COLORS = ((200, 215, 255), (40, 70, 235))
+_PART_COLORS = ((175, 185, 215), (70, 85, 150))
+_BACKGROUND_COLOR = (255, 255, 255)
+
+
+@dataclass
+class ConnectorGeometry:
+    """
+    This class describes the connector problem rendered by the NumpyCurveGenerator: the two endpoint frames the curve has to connect [mm].
+
+    Attributes:
+        start_point: The end of the first part, where the curve starts.
+        start_direction: The direction of the first part at start_point, i.e., the direction the curve has to leave it in.
+        end_point: The start of the second part, where the curve ends.
+        end_direction: The direction of the second part at end_point, i.e., the direction the curve has to arrive in.
+        part_length: The length of the parts drawn in front of start_point and behind end_point.
+        width: The width of the conductor.
+    """
+    start_point: tuple[float, float, float] = (0.0, 0.0, 0.0)
+    start_direction: tuple[float, float, float] = (1.0, 0.0, 0.0)
+    end_point: tuple[float, float, float] = (60.0, 40.0, 0.0)
+    end_direction: tuple[float, float, float] = (1.0, 0.0, 0.0)
+    part_length: float = 40.0
+    width: float = 6.0
+
+    @staticmethod
+    def load(path: str) -> "ConnectorGeometry":
+        """
+        Loads the geometry from a JSON file with the attributes of ConnectorGeometry (missing attributes keep their defaults).
+
+        args:
+            path: The path to the JSON file.
+        """
+        with open(path) as file:
+            return ConnectorGeometry(**json.load(file))
+
+    def save(self, path: str):
+        """
+        Saves the geometry as JSON file (see load).
+
+        args:
+            path: The path to the JSON file.
+        """
+        with open(path, "w") as file:
+            json.dump(asdict(self), file, indent=2)
+
+
+class NumpyCurveGenerator(CurveGenerator):
+    """
+    This class generates the curve images offline, without the optimizer and without a human in the loop.
+    The curve is a Bezier curve of degree order between the endpoint frames of a ConnectorGeometry, tangential to both parts. Its tangent length is chosen so that the curve length matches ell, penalizing bending radii below rbendmin and regressions behind the end planes beyond t1 (all candidate lengths are evaluated at once).
+    The overview (a) and the close-up views of the two ends (b, c) are rasterized with vectorized NumPy operations.
+
+    args:
+        logger: The logger to use.
+        geometry: The connector problem. Defaults to ConnectorGeometry().
+        image_size: The size (width, height) of the images [px].
+        closeup_fraction: The size of the close-up views relative to the overview.
+        samples: The number of points the curve is evaluated at.
+    """
+
+    def __init__(self, logger, geometry: ConnectorGeometry | None = None, image_size=(960, 960), closeup_fraction=0.25, samples=512):
+        self.logger = logger
+        self.geometry = geometry if geometry is not None else ConnectorGeometry()
+        self._image_size = image_size
+        self._closeup_fraction = closeup_fraction
+        self._samples = samples
+        self._start = np.asarray(self.geometry.start_point, dtype=float)
+        self._end = np.asarray(self.geometry.end_point, dtype=float)
+        self._start_direction = _normalize(np.asarray(self.geometry.start_direction, dtype=float))
+        self._end_direction = _normalize(np.asarray(self.geometry.end_direction, dtype=float))
+        self._view = self._view_basis()
+
+    @staticmethod
+    def from_scenario(logger, scenario_dir: str, **kwargs) -> "NumpyCurveGenerator":
+        """
+        Creates the generator for a scenario. The geometry is read from geometry.json in the scenario directory, if it exists. Only the image files of the scenario directory are sent with the initial prompt, so the geometry can be stored next to them.
+
+        args:
+            logger: The logger to use.
+            scenario_dir: The directory of the scenario.
+            **kwargs: Further arguments of NumpyCurveGenerator.
+        """
+        path = os.path.join(scenario_dir, "geometry.json")
+        geometry = ConnectorGeometry.load(path) if os.path.exists(path) else None
+        return NumpyCurveGenerator(logger, geometry, **kwargs)
+
+    async def agenerate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+        """
+        Computes the curve for the given optimizer parameters and renders its images ({index}a.png, {index}b.png, {index}c.png).
+        The computation runs in a worker thread.
+
+        args:
+            dir: The directory for the output images
+            optimizer_params: Optimizer parameters to use
+            index: Index for the image names.
+        """
+        await asyncio.to_thread(self._generate_images, dir, optimizer_params, index)
+
+    async def agenerate_image_buffers(self, dir, optimizer_params: OptimizerParameters, index: int) -> dict[str, Image.Image]:
+        """
+        Computes the curve for the given optimizer parameters and renders its images in memory, without writing them to dir.
+
+        args:
+            dir: Not used, the images are not written.
+            optimizer_params: Optimizer parameters to use
+            index: Index for the image names.
+
+        returns:
+            The images by name ({index}a, {index}b, {index}c).
+        """
+        return await asyncio.to_thread(self._render_images, optimizer_params, index)
+
+    def _generate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+        for name, image in self._render_images(optimizer_params, index).items():
+            image.save(os.path.join(dir, f"{name}.png"))
+
+    def _render_images(self, optimizer_params: OptimizerParameters, index: int) -> dict[str, Image.Image]:
+        curve = self.compute_curve(optimizer_params)
+        parts = [
+            np.stack([self._start - self._start_direction * self.geometry.part_length, self._start]),
+            np.stack([self._end, self._end + self._end_direction * self.geometry.part_length]),
+        ]
+        points = np.concatenate([curve] + parts) @ self._view.T
+        lower, upper = points.min(axis=0), points.max(axis=0)
+        center = (lower + upper) / 2
+        extent = max(upper - lower) * 1.1
+        closeup_extent = extent * self._closeup_fraction
+        views = {
+            "a": (center, extent),
+            "b": (self._start @ self._view.T, closeup_extent),
+            "c": (self._end @ self._view.T, closeup_extent),
+        }
+        images = {
+            f"{index}{suffix}": Image.fromarray(self._render(curve, parts, view_center, view_extent))
+            for suffix, (view_center, view_extent) in views.items()
+        }
+        self.logger.info(f"Generated images for optimizer params {optimizer_params} (length {_length(curve):.1f} mm).")
+        return images
+
+    def compute_curve(self, optimizer_params: OptimizerParameters) -> np.ndarray:
+        """
+        Computes the curve for the given optimizer parameters.
+
+        args:
+            optimizer_params: The optimizer parameters.
+
+        returns:
+            The points of the curve, shape (samples, 3).
+        """
+        order = max(1, int(optimizer_params.order))
+        ell = max(float(optimizer_params.ell), 1e-6)
+        rbendmin = max(float(optimizer_params.rbendmin), 0.0)
+        t1 = float(optimizer_params.t1)
+        chord = np.linalg.norm(self._end - self._start)
+
+        # candidate tangent lengths, evaluated at once: shape (scales, samples, 3)
+        scales = np.geomspace(0.02, 4.0, 256) * max(chord, ell)
+        curves = self._bezier_curves(order, scales)
+
+        lengths = _length(curves)
+        cost = ((lengths - ell) / ell) ** 2
+        if rbendmin > 0:
+            radii = _bending_radii(curves)
+            cost += np.mean(np.maximum(0.0, 1 - radii / rbendmin) ** 2, axis=-1)
+        # regression behind the end planes, tolerated up to -t1
+        behind_start = (curves - self._start) @ self._start_direction
+        behind_end = (self._end - curves) @ self._end_direction
+        tolerance = max(-t1, 0.0)
+        regression = np.maximum(0.0, -np.minimum(behind_start, behind_end) - tolerance)
+        cost += np.mean((regression / max(ell, 1.0)) ** 2, axis=-1)
+        return curves[np.argmin(cost)]
+
+    def _bezier_curves(self, order: int, scales: np.ndarray) -> np.ndarray:
+        """
+        Evaluates the Bezier curves of degree order for all tangent lengths.
+        The inner control points lie on the tangents of the two parts, so the curve leaves and enters the parts smoothly.
+
+        returns:
+            The points of the curves, shape (len(scales), samples, 3).
+        """
+        i = np.arange(order + 1)
+        s = scales[:, None, None]
+        # control points of the first half along the start tangent, of the second half along the end tangent
+        from_start = self._start + s * (i / order)[None, :, None] * self._start_direction
+        from_end = self._end - s * ((order - i) / order)[None, :, None] * self._end_direction
+        controls = np.where((i < order / 2)[None, :, None], from_start, from_end)
+        # the middle control point of even degrees lies between both tangents
+        middle = i == order / 2
+        controls[:, middle] = (from_start[:, middle] + from_end[:, middle]) / 2
+        t = np.linspace(0.0, 1.0, self._samples)[:, None]
+        binomials = np.array([math.comb(order, k) for k in i], dtype=float)
+        basis = binomials * t**i * (1 - t) ** (order - i)
+        return np.einsum("tk,skd->std", basis, controls)
+
+    def _view_basis(self) -> np.ndarray:
+        """
+        Returns the orthonormal basis (2, 3) of the image plane. The plane contains the chord of the connector and, if possible, the start direction.
+        """
+        chord = self._end - self._start
+        if np.linalg.norm(chord) < 1e-9:
+            chord = self._start_direction
+        u = _normalize(chord)
+        for candidate in (self._start_direction, self._end_direction, np.array([0.0, 1.0, 0.0]), np.array([0.0, 0.0, 1.0])):
+            v = candidate - (candidate @ u) * u
+            if np.linalg.norm(v) > 1e-6:
+                return np.stack([u, _normalize(v)])
+        return np.stack([u, _normalize(np.cross(u, [1.0, 0.0, 0.0]))])
+
+    def _render(self, curve: np.ndarray, parts: list[np.ndarray], center: np.ndarray, extent: float) -> np.ndarray:
+        """
+        Rasterizes the parts and the curve as shaded tubes for the view of the given (projected) center and extent [mm].
+
+        returns:
+            The image as RGB array (height, width, 3).
+        """
+        width, height = self._image_size
+        scale = min(width, height) / extent
+        radius = max(1.0, self.geometry.width / 2 * scale)
+
+        def to_pixels(points):
+            projected = (points @ self._view.T - center) * scale
+            return np.stack([width / 2 + projected[:, 0], height / 2 - projected[:, 1]], axis=-1)
+
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = _BACKGROUND_COLOR
+        for polyline, colors in [(part, _PART_COLORS) for part in parts] + [(curve, _CONNECTOR_COLORS)]:
+            distance = _distance_field(to_pixels(polyline), radius, width, height)
+            covered = distance <= 1.0
+            # lighter at the center of the tube, darker at its edges
+            shade = distance[covered, None] ** 2
+            image[covered] = (np.asarray(colors[0]) * (1 - shade) + np.asarray(colors[1]) * shade).astype(np.uint8)
+        return image
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    return vector / np.linalg.norm(vector)
+
+
+def _length(curves: np.ndarray) -> np.ndarray:
+    """
+    Returns the length of polylines of shape (..., samples, dimensions).
+    """
+    return np.linalg.norm(np.diff(curves, axis=-2), axis=-1).sum(axis=-1)
+
+
+def _bending_radii(curves: np.ndarray) -> np.ndarray:
+    """
+    Returns the bending radius at the inner points of polylines of shape (..., samples, 3): the radius of the circle through each point and its neighbours.
+    """
+    a = curves[..., 1:-1, :] - curves[..., :-2, :]
+    b = curves[..., 2:, :] - curves[..., 1:-1, :]
+    c = curves[..., 2:, :] - curves[..., :-2, :]
+    twice_area = np.linalg.norm(np.cross(a, b), axis=-1)
+    product = np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1) * np.linalg.norm(c, axis=-1)
+    return np.where(twice_area > 1e-12, product / np.maximum(2 * twice_area, 1e-12), np.inf)
+
+
+def _distance_field(polyline: np.ndarray, radius: float, width: int, height: int) -> np.ndarray:
+    """
+    Returns the distance of each pixel to a polyline [px] relative to radius, clipped to values > 1 outside the tube.
+    The polyline is resampled densely and a disk is stamped at every sample (scatter minimum), so only pixels near the polyline are touched.
+    """
+    distance = np.full(height * width, np.inf)
+    segment_lengths = np.linalg.norm(np.diff(polyline, axis=0), axis=-1)
+    cumulative = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    # the disks overlap enough that the distance to the nearest sample approximates the distance to the polyline
+    spacing = max(0.5, radius / 4)
+    positions = np.linspace(0.0, cumulative[-1], max(2, math.ceil(cumulative[-1] / spacing) + 1))
+    samples = np.stack([np.interp(positions, cumulative, polyline[:, k]) for k in range(2)], axis=-1)
+    inside = (
+        (samples[:, 0] > -radius) & (samples[:, 0] < width + radius)
+        & (samples[:, 1] > -radius) & (samples[:, 1] < height + radius)
+    )
+    samples = samples[inside]
+    if len(samples) == 0:
+        return distance.reshape(height, width)
+
+    r = math.ceil(radius)
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    dx, dy = dx.ravel(), dy.ravel()
+    centers = np.round(samples).astype(np.int64)
+    # chunked to bound the memory of (samples x disk pixels)
+    chunk = max(1, 4_000_000 // len(dx))
+    for begin in range(0, len(centers), chunk):
+        x = centers[begin:begin + chunk, 0, None] + dx
+        y = centers[begin:begin + chunk, 1, None] + dy
+        d = np.hypot(x - samples[begin:begin + chunk, 0, None], y - samples[begin:begin + chunk, 1, None]) / radius
+        valid = (d <= 1.0) & (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        np.minimum.at(distance, y[valid] * width + x[valid], d[valid])
+    return distance.reshape(height, width)
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from llm_magnet_connector.llm_interface import OptimizerParameters
+
+
+def normalize_parameters(optimizer_params: OptimizerParameters) -> tuple:
+    """
+    Normalizes optimizer parameters for comparison, e.g., [9, 80, 20, -8] and [9.0, 80.0, 20.0, -8.0] are equal.
+
+    args:
+        optimizer_params: The optimizer parameters.
+
+    returns:
+        The parameters as tuple (order, ell, rbendmin, t1) with the floats rounded to 6 decimals.
+    """
+    # + 0.0 turns -0.0 into 0.0
+    return (
+        int(optimizer_params.order),
+        round(float(optimizer_params.ell), 6) + 0.0,
+        round(float(optimizer_params.rbendmin), 6) + 0.0,
+        round(float(optimizer_params.t1), 6) + 0.0,
+    )
+
+
+class EvaluationCache:
+    """
+    This class stores the (unannotated) curve images generated for a scenario and a set of optimizer parameters on disk, so that a repeated set of parameters does not have to be evaluated again, also across runs.
+    The images of an evaluation are stored without index in their file names (e.g., "a.png" for "3a.png") and copied to the new index on a hit.
+    Hits and misses are counted (see stats).
+
+    args:
+        directory: The directory of the cache. Will be created if it does not exist.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # key -> entry (scenario, parameters, image suffixes, directory)
+        self._entries = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as file:
+                self._entries = json.load(file)
+
+    def _key(self, scenario: str, optimizer_params: OptimizerParameters) -> str:
+        return hashlib.sha256(
+            json.dumps([scenario, normalize_parameters(optimizer_params)]).encode()
+        ).hexdigest()
+
+    def _lookup(self, key: str) -> dict | None:
+        """
+        Returns the entry of a key if all of its images are cached, None otherwise. Counts the hit or miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not all(
+                os.path.exists(os.path.join(self.directory, key, f"{suffix}.png"))
+                for suffix in entry["suffixes"]
+            ):
+                # images removed from the cache directory
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def restore(self, scenario: str, optimizer_params: OptimizerParameters, dir: str, index: int) -> bool:
+        """
+        Copies the cached images of an evaluation to a directory, named for the given index (e.g., "a.png" -> "{index}a.png").
+
+        args:
+            scenario: The identifier of the scenario (e.g., the directory of its initial images).
+            optimizer_params: The optimizer parameters.
+            dir: The directory to copy the images to.
+            index: The index for the image names.
+
+        returns:
+            True if the evaluation was cached and the images were copied, False otherwise.
+        """
+        key = self._key(scenario, optimizer_params)
+        entry = self._lookup(key)
+        if entry is None:
+            return False
+        for suffix in entry["suffixes"]:
+            shutil.copyfile(
+                os.path.join(self.directory, key, f"{suffix}.png"),
+                os.path.join(dir, f"{index}{suffix}.png"),
+            )
+        return True
+
+    def load(self, scenario: str, optimizer_params: OptimizerParameters) -> dict[str, bytes] | None:
+        """
+        Reads the cached images of an evaluation into memory.
+
+        args:
+            scenario: The identifier of the scenario (e.g., the directory of its initial images).
+            optimizer_params: The optimizer parameters.
+
+        returns:
+            The encoded PNG images by suffix (e.g., "a"), or None if the evaluation is not cached.
+        """
+        key = self._key(scenario, optimizer_params)
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        images = {}
+        for suffix in entry["suffixes"]:
+            with open(os.path.join(self.directory, key, f"{suffix}.png"), "rb") as file:
+                images[suffix] = file.read()
+        return images
+
+    def store(self, scenario: str, optimizer_params: OptimizerParameters, dir: str, index: int):
+        """
+        Stores the images of an evaluation, i.e., the PNG images named "{index}*.png" in the directory.
+        Must be called before the images are annotated.
+
+        args:
+            scenario: The identifier of the scenario (e.g., the directory of its initial images).
+            optimizer_params: The optimizer parameters.
+            dir: The directory containing the generated images.
+            index: The index of the image names.
+        """
+        key = self._key(scenario, optimizer_params)
+        prefix = str(index)
+        suffixes = sorted(
+            os.path.splitext(file_name)[0][len(prefix) :]
+            for file_name in os.listdir(dir)
+            if file_name.startswith(prefix) and file_name.endswith(".png")
+        )
+        entry_dir = os.path.join(self.directory, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        for suffix in suffixes:
+            shutil.copyfile(
+                os.path.join(dir, f"{prefix}{suffix}.png"), os.path.join(entry_dir, f"{suffix}.png")
+            )
+        self._add_entry(key, scenario, optimizer_params, suffixes)
+
+    def store_images(self, scenario: str, optimizer_params: OptimizerParameters, images: dict[str, bytes]):
+        """
+        Stores the (unannotated) images of an evaluation from memory.
+
+        args:
+            scenario: The identifier of the scenario (e.g., the directory of its initial images).
+            optimizer_params: The optimizer parameters.
+            images: The encoded PNG images by suffix (e.g., "a").
+        """
+        key = self._key(scenario, optimizer_params)
+        entry_dir = os.path.join(self.directory, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        for suffix, data in images.items():
+            with open(os.path.join(entry_dir, f"{suffix}.png"), "wb") as file:
+                file.write(data)
+        self._add_entry(key, scenario, optimizer_params, sorted(images))
+
+    def _add_entry(self, key: str, scenario: str, optimizer_params: OptimizerParameters, suffixes: list[str]):
+        """
+        Adds the entry of a stored evaluation to the index.
+        """
+        with self._lock:
+            self._entries[key] = {
+                "scenario": scenario,
+                "parameters": list(normalize_parameters(optimizer_params)),
+                "suffixes": suffixes,
+                "created": time.time(),
+            }
+            # write to a temporary file first, so that the index is never partially written
+            temporary_path = self._index_path + ".tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(self._entries, file, indent=2)
+            os.replace(temporary_path, self._index_path)
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the cache.
+
+        returns:
+            A dict with the number of hits and misses, the hit rate, and the number of cached evaluations.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
@@ -1,8 +1,14 @@
 
+from PIL import Image
+import asyncio
+import io
 import os
-from llm_magnet_connector.llm_interface import LLMResponse
-from ._annotate_imgs import annotate_images 
-from ._generate_curve_images import CurveImageGenerator
+import shutil
+from llm_magnet_connector.llm_interface import ImageBuffer, LLMResponse, OptimizerParameters
+from llm_magnet_connector.utils import run_sync, timed
+from ._annotate_imgs import aannotate_images, annotate_image
+from ._generate_curve_images import CurveGenerator, CurveImageGenerator
+from .evaluation_cache import EvaluationCache, normalize_parameters
 
 
 class ResponseToImage:
@@ -12,39 +18,345 @@ class ResponseToImage:
     args:
         logger: The logger to use.
         output_dir: The directory where the images will be saved. Dir will be created if it does not exist. The images corresponding to one curve will be saved in a folder named by the image index. Each image will be saved as a PNG file.
+        curve_generator: The CurveGenerator creating the curve images, e.g., NumpyCurveGenerator for automated runs. Defaults to a CurveImageGenerator (manual).
+        scenario: The identifier of the connector problem (e.g., the directory of its initial images). Used as part of the key of the evaluation cache.
+        evaluation_cache: If given, the images of already evaluated optimizer parameters (of the same scenario) are taken from the cache instead of being generated again.
+        max_parallel_evaluations: The maximum number of candidates of one response generated and annotated at the same time (see aresponse_to_images).
+        in_memory: Whether the images are passed on in memory: the generated images are annotated and encoded once, and returned as ImageBuffers (one list per candidate) instead of directory paths. They are still saved to output_dir, in the background (see aflush). Images are added to the evaluation cache once saved.
     """
-    def __init__(self, logger, output_dir: str):
+    def __init__(self, logger, output_dir: str, curve_generator: CurveGenerator | None = None, scenario: str = "", evaluation_cache: EvaluationCache | None = None, max_parallel_evaluations: int = 4, in_memory: bool = False):
         self.logger = logger
+        self._curve_generator = curve_generator if curve_generator is not None else CurveImageGenerator(logger)
         # Ascending index for the image names (0a, 1a, ...); 1-indexed, will be incremented before use
         self.image_index = 0 
         self._output_dir = output_dir
+        self._scenario = scenario
+        self._evaluation_cache = evaluation_cache
+        # worker pool: limits the number of candidates generated and annotated at the same time
+        self._evaluation_slots = asyncio.Semaphore(max_parallel_evaluations)
+        # normalized optimizer parameters -> first image index evaluated with them in this run
+        self._evaluated_indices = {}
+        # image indices of the candidates of the latest response
+        self.candidate_indices = []
+        # per candidate of the latest response: image index of the earlier evaluation if its optimizer parameters are a repeat within this run, None otherwise
+        self.repeated_indices = []
+        # repeated index of the first candidate of the latest response
+        self.repeated_index = None
+        self.evaluation_cache_hits = 0
+        self._in_memory = in_memory
+        # background tasks saving images generated in memory
+        self._persistence_tasks = set()
+        # indices of complete image directories found on resume, reused instead of generated again (see restore_state)
+        self._resumed_indices = set()
         # Create the output directory if it does not exist
         os.makedirs(output_dir, exist_ok=True)
         
-    def response_to_image(self, response: LLMResponse) -> str:
+    async def aresponse_to_image(self, response: LLMResponse) -> str | list[ImageBuffer]:
         """
-        This function converts a LLM response to the images used for the next re-prompt
+        This function converts a LLM response to the images used for the next re-prompt. Only the first candidate (the optimizer parameters of the response) is evaluated.
         
         args:
             response: The response from the LLM model
             
+        Returns:
+            The path to the directory containing the generated images, or the images in memory if in_memory is set.
+        """
+        images_dirs = await self._aevaluate_candidates([response.optimizer_parameters])
+        return images_dirs[0]
+
+    async def aresponse_to_images(self, response: LLMResponse) -> list[str] | list[list[ImageBuffer]]:
+        """
+        This function converts all candidates of a LLM response to the images used for the next re-prompt. The candidates are generated and annotated concurrently (at most max_parallel_evaluations at a time), each with its own image index.
+        
+        args:
+            response: The response from the LLM model
+            
+        Returns:
+            The paths to the directories containing the generated images (or the images in memory if in_memory is set), in the order of the candidates.
+        """
+        return await self._aevaluate_candidates(response.candidates)
+
+    async def _aevaluate_candidates(self, candidates: list[OptimizerParameters]) -> list:
+        """
+        Assigns the image indices to the candidates and evaluates them concurrently.
+        
+        args:
+            candidates: The optimizer parameters to evaluate.
+            
+        Returns:
+            The results of _aevaluate (or _aevaluate_in_memory), in the order of the candidates.
+        """
+        # indices are assigned up front, so that they do not depend on the order of completion
+        evaluations = []
+        self.candidate_indices = []
+        self.repeated_indices = []
+        for optimizer_params in candidates:
+            self.image_index += 1
+            key = normalize_parameters(optimizer_params)
+            self.repeated_indices.append(self._evaluated_indices.get(key))
+            self._evaluated_indices.setdefault(key, self.image_index)
+            self.candidate_indices.append(self.image_index)
+            evaluate = self._aevaluate_in_memory if self._in_memory else self._aevaluate
+            evaluations.append(evaluate(optimizer_params, self.image_index))
+        self.repeated_index = self.repeated_indices[0] if self.repeated_indices else None
+        return list(await asyncio.gather(*evaluations))
+
+    async def _aevaluate(self, optimizer_params: OptimizerParameters, index: int) -> str:
+        """
+        Generates (or restores from the evaluation cache) and annotates the images of one candidate.
+        
+        args:
+            optimizer_params: The optimizer parameters of the curve.
+            index: The image index of the curve.
+            
         Returns:
             The path to the directory containing the generated images.
         """
-        self.image_index += 1
         # create the output directory
-        new_dir_path = os.path.join(self._output_dir, str(self.image_index))
+        new_dir_path = os.path.join(self._output_dir, str(index))
+        if index in self._resumed_indices:
+            self._resumed_indices.discard(index)
+            self.logger.info(f"Reusing the images in {new_dir_path} from before the run was resumed.")
+            return new_dir_path
+        self._remove_complete_marker(index)
         
         if os.path.exists(new_dir_path):
             self.logger.warning(f"Output directory {new_dir_path} already exists.");
         else:
             os.makedirs(new_dir_path)
+
+        async with self._evaluation_slots:
+            # generate images, or take them from the evaluation cache
+            with timed("image_generation"):
+                if self._evaluation_cache is not None and await asyncio.to_thread(self._evaluation_cache.restore, self._scenario, optimizer_params, new_dir_path, index):
+                    self.evaluation_cache_hits += 1
+                    self.logger.info(f"Images for optimizer params {optimizer_params} taken from the evaluation cache.")
+                else:
+                    await self._curve_generator.agenerate_images(new_dir_path, optimizer_params=optimizer_params, index=index)
+                    if self._evaluation_cache is not None:
+                        await asyncio.to_thread(self._evaluation_cache.store, self._scenario, optimizer_params, new_dir_path, index)
+            
+            # annotate images
+            with timed("annotation"):
+                await aannotate_images(new_dir_path,  new_dir_path)
+            self._write_complete_marker(index)
         
-        # generate images
-        CurveImageGenerator(self.logger).generate_images(new_dir_path, optimizer_params=response.optimizer_parameters, index=self.image_index)
+        # return path
+        return new_dir_path
+
+    async def _aevaluate_in_memory(self, optimizer_params: OptimizerParameters, index: int) -> list[ImageBuffer]:
+        """
+        Generates (or restores from the evaluation cache) and annotates the images of one candidate in memory. The images are saved in the background.
         
-        # annotate images
-        annotate_images(new_dir_path,  new_dir_path)
+        args:
+            optimizer_params: The optimizer parameters of the curve.
+            index: The image index of the curve.
+            
+        Returns:
+            The annotated images, sorted by name.
+        """
+        new_dir_path = os.path.join(self._output_dir, str(index))
+        if index in self._resumed_indices:
+            self._resumed_indices.discard(index)
+            self.logger.info(f"Reusing the images in {new_dir_path} from before the run was resumed.")
+            return await asyncio.to_thread(self._load_buffers, new_dir_path)
+        self._remove_complete_marker(index)
         
-        # return path
-        return new_dir_path
\ No newline at end of file
+        if os.path.exists(new_dir_path):
+            self.logger.warning(f"Output directory {new_dir_path} already exists.");
+        else:
+            os.makedirs(new_dir_path)
+
+        async with self._evaluation_slots:
+            # generate images, or take them from the evaluation cache
+            with timed("image_generation"):
+                cached = None
+                if self._evaluation_cache is not None:
+                    cached = await asyncio.to_thread(self._evaluation_cache.load, self._scenario, optimizer_params)
+                if cached is not None:
+                    self.evaluation_cache_hits += 1
+                    self.logger.info(f"Images for optimizer params {optimizer_params} taken from the evaluation cache.")
+                    images = await asyncio.to_thread(
+                        lambda: {f"{index}{suffix}": Image.open(io.BytesIO(data)) for suffix, data in cached.items()}
+                    )
+                else:
+                    images = await self._curve_generator.agenerate_image_buffers(new_dir_path, optimizer_params=optimizer_params, index=index)
+
+            # annotate and encode images
+            with timed("annotation"):
+                buffers = await asyncio.gather(
+                    *(
+                        asyncio.to_thread(self._annotate_to_buffer, image, name, new_dir_path)
+                        for name, image in sorted(images.items())
+                    )
+                )
+
+        # the unannotated images are only encoded for the evaluation cache
+        store = cached is None and self._evaluation_cache is not None
+        task = asyncio.create_task(
+            asyncio.to_thread(self._persist, buffers, optimizer_params, index, images if store else None)
+        )
+        self._persistence_tasks.add(task)
+        task.add_done_callback(self._on_persisted)
+        return buffers
+
+    @staticmethod
+    def _annotate_to_buffer(image: Image.Image, name: str, dir: str) -> ImageBuffer:
+        """
+        Annotates an image with its name and encodes it as PNG.
+        """
+        annotated = annotate_image(image, name)
+        data = io.BytesIO()
+        annotated.save(data, format="PNG")
+        return ImageBuffer(name, data.getvalue(), "image/png", annotated, os.path.join(dir, f"{name}.png"))
+
+    def _persist(self, buffers: list[ImageBuffer], optimizer_params: OptimizerParameters, index: int, unannotated_images: dict[str, Image.Image] | None):
+        """
+        Saves the annotated images to their paths and, if given, the unannotated images to the evaluation cache.
+        Each file is written to a temporary file first, so that no partially written image is visible.
+        """
+        with timed("image_persistence"):
+            for buffer in buffers:
+                temporary_path = buffer.path + ".tmp"
+                with open(temporary_path, "wb") as file:
+                    file.write(buffer.data)
+                os.replace(temporary_path, buffer.path)
+            self._write_complete_marker(index)
+            if unannotated_images is not None:
+                encoded = {}
+                for name, image in unannotated_images.items():
+                    data = io.BytesIO()
+                    image.save(data, format="PNG")
+                    encoded[name[len(str(index)):]] = data.getvalue()
+                self._evaluation_cache.store_images(self._scenario, optimizer_params, encoded)
+
+    @staticmethod
+    def _load_buffers(dir: str) -> list[ImageBuffer]:
+        """
+        Reads the annotated images in a directory, sorted by name.
+        """
+        buffers = []
+        for file_name in sorted(os.listdir(dir)):
+            name, extension = os.path.splitext(file_name)
+            if extension == ".png":
+                with open(os.path.join(dir, file_name), "rb") as file:
+                    buffers.append(ImageBuffer(name, file.read(), "image/png", path=os.path.join(dir, file_name)))
+        return buffers
+
+    def _complete_marker_path(self, index: int) -> str:
+        # next to the image directory, since all files in the directory are sent as images
+        return os.path.join(self._output_dir, f".{index}.complete")
+
+    def _write_complete_marker(self, index: int):
+        """
+        Marks the image directory of the index as complete (generated and annotated), so that it can be reused on resume.
+        """
+        with open(self._complete_marker_path(index), "w"):
+            pass
+
+    def _remove_complete_marker(self, index: int):
+        try:
+            os.remove(self._complete_marker_path(index))
+        except FileNotFoundError:
+            pass
+
+    def _on_persisted(self, task: asyncio.Task):
+        self._persistence_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"Could not save images: {task.exception()!r}")
+
+    async def aflush(self):
+        """
+        Waits until all images generated in memory are saved to the output directory (and the evaluation cache).
+        """
+        if self._persistence_tasks:
+            await asyncio.gather(*self._persistence_tasks, return_exceptions=True)
+
+    async def adiscard(self, state: dict):
+        """
+        Discards the images generated since the given state was taken (see get_state), e.g., the images generated speculatively for an early response that differs from the final response.
+        The image index, the evaluated optimizer parameters and the evaluation cache hits are restored, so that the next images take the indices of the discarded ones and repeats only refer to images that were presented. The directories of the discarded images are removed (after the images still being saved in the background), so that they are not taken for the next images.
+        
+        args:
+            state: The state taken before the discarded images were generated.
+        """
+        await self.aflush()
+        for index in range(state["image_index"] + 1, self.image_index + 1):
+            self._remove_complete_marker(index)
+            await asyncio.to_thread(shutil.rmtree, os.path.join(self._output_dir, str(index)), True)
+        self.image_index = state["image_index"]
+        self._evaluated_indices = self._evaluated_indices_from_state(state)
+        self.evaluation_cache_hits = state["evaluation_cache_hits"]
+        self.candidate_indices = []
+        self.repeated_indices = []
+        self.repeated_index = None
+
+    def get_state(self) -> dict:
+        """
+        Returns the state of the image generation (image index, evaluated optimizer parameters and cache hits), e.g., for a checkpoint (see restore_state).
+        
+        returns:
+            The JSON-serializable state.
+        """
+        return {
+            "image_index": self.image_index,
+            "evaluated_indices": [[*key, index] for key, index in self._evaluated_indices.items()],
+            "evaluation_cache_hits": self.evaluation_cache_hits,
+        }
+
+    def restore_state(self, state: dict):
+        """
+        Restores a state returned by get_state, e.g., to resume a run from a checkpoint.
+        Image directories in the output directory with a higher index than the restored image index were generated after the state was taken, for the response the run is resumed with. Complete directories (generated and annotated) are reused instead of generated again. The others are kept, so that images already supplied (e.g., to the manual CurveImageGenerator) are accepted right away; automated generators overwrite them.
+        
+        args:
+            state: The state.
+        """
+        self.image_index = state["image_index"]
+        self._evaluated_indices = self._evaluated_indices_from_state(state)
+        self.evaluation_cache_hits = state["evaluation_cache_hits"]
+        self.candidate_indices = []
+        self.repeated_indices = []
+        self.repeated_index = None
+        self._resumed_indices = {
+            int(entry.name)
+            for entry in os.scandir(self._output_dir)
+            if entry.is_dir()
+            and entry.name.isdigit()
+            and int(entry.name) > self.image_index
+            and os.path.exists(self._complete_marker_path(int(entry.name)))
+        }
+
+    @staticmethod
+    def _evaluated_indices_from_state(state: dict) -> dict:
+        return {tuple(entry[:4]): entry[4] for entry in state["evaluated_indices"]}
+
+    def flush(self):
+        """
+        Synchronous wrapper around aflush.
+        """
+        run_sync(self.aflush())
+
+    def response_to_image(self, response: LLMResponse) -> str | list[ImageBuffer]:
+        """
+        Synchronous wrapper around aresponse_to_image.
+        
+        args:
+            response: The response from the LLM model
+            
+        Returns:
+            The path to the directory containing the generated images, or the images in memory if in_memory is set.
+        """
+        return run_sync(self.aresponse_to_image(response))
+
+    def response_to_images(self, response: LLMResponse) -> list[str] | list[list[ImageBuffer]]:
+        """
+        Synchronous wrapper around aresponse_to_images.
+        
+        args:
+            response: The response from the LLM model
+            
+        Returns:
+            The paths to the directories containing the generated images (or the images in memory if in_memory is set), in the order of the candidates.
+        """
+        return run_sync(self.aresponse_to_images(response))
@@ -1,4 +1,13 @@
-from .llm_response import OptimizerParameters, BadnessCriteria, LLMResponse
-from .prompts import get_initial_prompt, get_reprompt, get_system_prompt, anthropic_think_tool
+from .llm_response import OptimizerParameters, BadnessCriteria, LLMResponse, IterationRecord
+from .prompts import get_initial_prompt, get_reprompt, get_candidates_reprompt, get_system_prompt, get_history_summary, get_repair_prompt, anthropic_think_tool, anthropic_submit_assessment_tool
+from .image_buffer import ImageBuffer
+from .image_preprocessing import ImagePreprocessingConfig
+from .image_eviction import ImageEvictionPolicy
+from .image_store import ImageStore, InlineImageStore, FilesApiImageStore
+from .request_scheduler import RequestScheduler, get_request_scheduler, set_request_scheduler
+from .budget_governor import BudgetGovernor, BudgetDecision, BudgetExceededError, ModelTier
 from .llm_conversation_manager import LLMConversationManager
+from .cassette import Cassette
+from .response_cache import ResponseCache
 from .anthropic_conversation_manager import AnthropicConversationManager
+from .replay_conversation_manager import ReplayConversationManager
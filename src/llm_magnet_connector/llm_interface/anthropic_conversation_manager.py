@@ -8,22 +8,50 @@ from . import (
     BadnessCriteria,
     LLMConversationManager,
     anthropic_think_tool,
+    anthropic_submit_assessment_tool,
+    get_repair_prompt,
 )
+from llm_magnet_connector.utils import timed, record_metrics
+from .token_accounting import estimate_text_tokens, estimate_image_tokens
+from .image_buffer import ImageBuffer
+from .image_preprocessing import ImagePreprocessingConfig, ImagePreprocessor
+from .image_eviction import ImageEvictionPolicy, downscale_image_block
+from .image_store import ImageStore, InlineImageStore
+from .request_scheduler import RequestScheduler, get_request_scheduler
+from .cassette import Cassette
+from .response_cache import ResponseCache
+from .budget_governor import BudgetGovernor, BudgetDecision, BudgetExceededError, ModelTier
 import os
-import anthropic
+import asyncio
 import base64
+import functools
+import json
+import anthropic
 import mimetypes
+import pydantic
 import re
+import time
+import uuid
+
+# validates the content of restored model responses (see _message_from_state)
+_CONTENT_BLOCKS = pydantic.TypeAdapter(list[anthropic.types.ContentBlock])
+
+# the minimum thinking budget accepted by the API [tokens]
+_MIN_THINKING_BUDGET = 1024
 
 
 class AnthropicConversationManager(LLMConversationManager):
     """
     This class is a subclass of LLMConversationManager and is used to manage a conversation with the Anthropic API.
-    Will send the system prompt with the first prompt.
+    Will send the system prompt with the first prompt, or with every prompt if prompt caching is enabled (the cached prefix must be identical across requests).
 
     Uses the environment variable ANTHROPIC_API_KEY.
+    Uses the async Anthropic client, so many conversations can be driven concurrently by one event loop via aprompt.
     """
 
+    # optimizer parameters in the format [order, ell, rbendmin, t1]
+    _PARAMETERS_PATTERN = r"\[(\d+),\s*(-?[0-9.]+),\s*(-?[0-9.]+),\s*(-?[0-9.]+)\]"
+
     def __init__(
         self,
         logger,
@@ -35,6 +63,23 @@ class AnthropicConversationManager(LLMConversationManager):
         max_prompts=100,
         thinking=False,
         think_tool=True,
+        assessment_tool=True,
+        prompt_caching=True,
+        cache_latest_prefix=True,
+        cost_1M_cache_write_tokens=None,
+        cost_1M_cache_read_tokens=None,
+        token_count_margin=0.1,
+        image_preprocessing: ImagePreprocessingConfig | None = None,
+        stream=False,
+        scheduler: RequestScheduler | None = None,
+        base_url: str | None = None,
+        cassette: Cassette | None = None,
+        context_compaction=False,
+        image_eviction: ImageEvictionPolicy | None = None,
+        image_store: ImageStore | None = None,
+        response_cache: ResponseCache | None = None,
+        candidates_per_turn=1,
+        budget_governor: BudgetGovernor | None = None,
     ):
         """
         {}
@@ -43,6 +88,21 @@ class AnthropicConversationManager(LLMConversationManager):
         Additional Args:
             thinking (bool): Whether to enable thinking. Defaults to False.
             think_tool (bool): Whether to use the "think" tool. Defaults to True. (see https://www.anthropic.com/engineering/claude-think-tool)
+            assessment_tool (bool): Whether the model submits its final answer (badness criteria and new optimizer parameters) with the "submit_assessment" tool instead of free text. Text answers are still parsed as fallback. Defaults to True.
+            prompt_caching (bool): Whether to set prompt cache breakpoints on the system prompt and the first functional context element. Defaults to True. (see https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching)
+            cache_latest_prefix (bool): Whether to additionally set a cache breakpoint at the end of each request, so that the next request can read the whole conversation so far from the cache. Only used if prompt_caching is True. Defaults to True.
+            token_count_margin (float): The context size is estimated locally. Only if the estimate is within this fraction of the context window limit, the tokens are counted by the API. Defaults to 0.1.
+            image_preprocessing (ImagePreprocessingConfig): Preprocessing applied to images before encoding (downscaling, quantization, recompression). If None, images are sent unchanged. Defaults to None.
+            stream (bool): Whether to stream responses. Enables early detection of the final answer (see prompt). Defaults to False.
+            scheduler (RequestScheduler): The scheduler all requests are submitted through (rate limits, retries). If None, the process-wide scheduler is used (see get_request_scheduler).
+            base_url (str): The base URL of the API, e.g., of a local fake server. If None, the default of the Anthropic client is used.
+            cassette (Cassette): If given, every request/response pair (including token counts) is recorded to the cassette (see ReplayConversationManager).
+            context_compaction (bool): Whether to replace removed functional context elements by a short summary of the removed iterations. Allows a much smaller context_window_limit without losing the history of selected optimizer parameters. Defaults to False.
+            image_eviction (ImageEvictionPolicy): If given, the images of old iterations are downscaled and then replaced by placeholders before functional context elements are removed. If None, functional elements are removed right away. Defaults to None.
+            image_store (ImageStore): Creates the image blocks, e.g., FilesApiImageStore to upload each image once instead of sending it inline with every request. If None, images are sent inline (InlineImageStore).
+            response_cache (ResponseCache): If given, responses are served from and stored in the on-disk cache, so identical requests (e.g., the first turns of a re-run) are not paid again. Can be bypassed per call (see aprompt). Defaults to None.
+            candidates_per_turn (int): The maximum number of candidate optimizer parameter lists the model proposes per answer. The candidates are evaluated in parallel and presented together in the next prompt (see LLMResponse.candidates). Requires assessment_tool. Defaults to 1.
+            budget_governor (BudgetGovernor): If given, the cost of every request is predicted and reserved with the governor, which caps the output token limit and refuses requests exceeding the budgets (BudgetExceededError). Before each query, the conversation adapts to the spent budget (context window limit, thinking budget, model, see BudgetGovernor). Can be shared by the conversations of a sweep. Defaults to None.
         """.format(
             LLMConversationManager.__init__.__doc__
         )
@@ -52,8 +112,17 @@ class AnthropicConversationManager(LLMConversationManager):
             cost_1M_output_tokens=cost_1M_output_tokens,
             system_prompt=system_prompt,
             max_prompts=max_prompts,
+            cost_1M_cache_write_tokens=cost_1M_cache_write_tokens,
+            cost_1M_cache_read_tokens=cost_1M_cache_read_tokens,
+            context_compaction=context_compaction,
+        )
+        # retries are done by the scheduler
+        self.__client = anthropic.AsyncClient(
+            api_key=os.environ.get("ANTHROPIC_API_KEY"), base_url=base_url, max_retries=0
         )
-        self.__client = anthropic.Client(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+        self._scheduler = scheduler if scheduler is not None else get_request_scheduler()
+        self._cassette = cassette
+        self._response_cache = response_cache
         self._model = "claude-3-7-sonnet-latest"
         if thinking:
             self._thinking = {
@@ -68,6 +137,16 @@ class AnthropicConversationManager(LLMConversationManager):
             system_prompt_suffix, think_tool_schema = anthropic_think_tool()
             self._system_prompt = f"{self._system_prompt if self._system_prompt else ''}\n\n{system_prompt_suffix}"
             self._tools += [think_tool_schema]
+        self._assessment_tool = assessment_tool
+        if candidates_per_turn > 1 and not self._assessment_tool:
+            raise ValueError("candidates_per_turn > 1 requires the assessment tool")
+        self._candidates_per_turn = candidates_per_turn
+        if self._assessment_tool:
+            system_prompt_suffix, assessment_tool_schema = anthropic_submit_assessment_tool(
+                candidates_per_turn
+            )
+            self._system_prompt = f"{self._system_prompt if self._system_prompt else ''}\n\n{system_prompt_suffix}"
+            self._tools += [assessment_tool_schema]
         self._temperature = 1  # must be 1 when thinking is enabled
         model_token_limit = 64000 if self._thinking else 8192
         self._max_tokens = (
@@ -81,17 +160,54 @@ class AnthropicConversationManager(LLMConversationManager):
             if context_window_limit == -1
             else min(context_window_limit, model_context_window_limit)
         )
+        self._prompt_caching = prompt_caching
+        self._cache_latest_prefix = cache_latest_prefix
+        # number of times an eviction invalidated the cached conversation prefix
+        self.cache_invalidations = 0
+        self._token_count_margin = token_count_margin
+        self._image_preprocessor = (
+            ImagePreprocessor(logger, image_preprocessing)
+            if image_preprocessing is not None
+            else None
+        )
+        self._image_eviction = image_eviction
+        self._image_store = image_store if image_store is not None else InlineImageStore()
+        self._stream = stream
+        # timings of the prompt calls, one dict per call (see prompt)
+        self.prompt_timings = []
+        self._prompt_timing = None
+        # id of a message content -> (content, text bytes, inline image bytes), see _payload_size
+        self._payload_sizes = {}
+        # id of a message content -> (content, converted message), and id of image data -> (data, file name), see _message_to_state
+        self._state_messages = {}
+        self._state_images = {}
+        self._budget_governor = budget_governor
+        # adaptation level applied (see BudgetGovernor.adaptation_level), and the input cost per token of the latest request (USD), None until the first request with the current model
+        self._budget_level = 0
+        self._input_token_cost = None
+        self._token_accountant.overhead_tokens = estimate_text_tokens(
+            self._system_prompt or ""
+        ) + estimate_text_tokens(json.dumps(self._tools))
 
-    def _send_message(self, messages: list, system_prompt: str | None = None):
+    async def _send_message(
+        self,
+        messages: list,
+        system_prompt: str | None = None,
+        on_content_block=None,
+        use_response_cache=True,
+    ):
         """
         Sends a message to the model and increments the prompt count.
 
         Args:
             messages ([Message]): The messages to send to the model (context and new message).
             system_prompt (str): The system prompt to use. Should only be used for the first prompt.
+            on_content_block (callable): Called with each content block as soon as the block is complete. Only used in streaming mode.
+            use_response_cache (bool): Whether to look up and store the response in the response cache (if set).
 
         Raises:
             ValueError: If the maximum number of prompts has been reached.
+            BudgetExceededError: If the budget governor refuses the request.
 
         Returns:
             The response from the model.
@@ -100,7 +216,23 @@ class AnthropicConversationManager(LLMConversationManager):
         if self._prompt_count > self._max_prompts:
             raise ValueError(f"Max number of {self._max_prompts} prompts reached.")
 
-        response = self.__client.messages.create(
+        # measured without the cache breakpoints, so that the sizes of unchanged messages are reused
+        payload_bytes, image_bytes = self._payload_size(messages, system_prompt)
+        if self._prompt_caching:
+            messages = self._add_cache_breakpoints(messages)
+            if system_prompt:
+                system_prompt = [
+                    {
+                        "type": "text",
+                        "text": system_prompt,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ]
+
+        # raw estimate of the sent context, used to calibrate the local token estimate
+        raw_estimate = self._token_accountant.raw_total()
+
+        request = dict(
             model=self._model,
             messages=messages,
             system=system_prompt if system_prompt else anthropic.NOT_GIVEN,
@@ -109,53 +241,632 @@ class AnthropicConversationManager(LLMConversationManager):
             thinking=self._thinking,
             tools=self._tools,
         )
+        if self._image_store.betas:
+            request["betas"] = self._image_store.betas
+
+        use_response_cache = use_response_cache and self._response_cache is not None
+
+        if use_response_cache:
+            response = self._response_cache.get(request)
+            if response is not None:
+                # a cached response counts as sent when it is served
+                if self.request_sent_time is None:
+                    self.request_sent_time = time.perf_counter()
+                # cached responses are not paid, so the usage is not counted
+                self.logger.info("Response served from the response cache.")
+                self.response_cache_hits += 1
+                record_metrics("api_call", endpoint="messages.create", response_cache_hit=True)
+                if self._stream and on_content_block is not None:
+                    for block in response.content:
+                        on_content_block(block)
+                return response
+
+        budget_decision = self._reserve_budget(request) if self._budget_governor is not None else None
+
+        if self._prompt_timing is not None:
+            self._prompt_timing["payload_bytes"] += payload_bytes
+        self.logger.info(
+            f"Request payload: ~{payload_bytes / 1000:.0f} kB (inline image data: ~{image_bytes / 1000:.0f} kB)."
+        )
+
+        async def send_request():
+            # the request is sent once the scheduler grants it, i.e., after waiting for rate limits and concurrency
+            if self.request_sent_time is None:
+                self.request_sent_time = time.perf_counter()
+            return await self._request_message(request, on_content_block)
+
+        start_time = time.perf_counter()
+        try:
+            with timed("llm_request"):
+                response = await self._scheduler.submit(
+                    send_request,
+                    input_tokens=self._token_accountant.estimate(),
+                    output_tokens=request["max_tokens"],
+                    # cache reads do not count against the input tokens per minute
+                    usage=lambda response: (
+                        response.usage.input_tokens
+                        + (response.usage.cache_creation_input_tokens or 0),
+                        response.usage.output_tokens,
+                    ),
+                )
+        except BaseException:
+            if budget_decision is not None:
+                self._budget_governor.settle(budget_decision, 0.0)
+            raise
+
+        latency = time.perf_counter() - start_time
+        if use_response_cache:
+            self._response_cache.put(request, response)
+
+        self.sent_image_bytes += image_bytes
+        record_metrics(
+            "api_call",
+            endpoint="messages.create",
+            model=self._model,
+            latency=latency,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            cache_write_tokens=response.usage.cache_creation_input_tokens or 0,
+            cache_read_tokens=response.usage.cache_read_input_tokens or 0,
+            stop_reason=response.stop_reason,
+            payload_bytes=payload_bytes,
+            image_bytes=image_bytes,
+        )
+        # cache fields are None if the request did not use prompt caching
+        cache_write_tokens = response.usage.cache_creation_input_tokens or 0
+        cache_read_tokens = response.usage.cache_read_input_tokens or 0
+        cost = self._add_usage(
+            response.usage.input_tokens, response.usage.output_tokens, cache_write_tokens, cache_read_tokens
+        )
+        if budget_decision is not None:
+            self._budget_governor.settle(budget_decision, cost)
+        input_tokens = response.usage.input_tokens + cache_write_tokens + cache_read_tokens
+        if input_tokens > 0:
+            self._input_token_cost = (
+                cost - response.usage.output_tokens * self.cost_1M_output_tokens / 1e6
+            ) / input_tokens
+
+        self._token_accountant.calibrate(
+            raw_estimate,
+            response.usage.input_tokens
+            + (response.usage.cache_creation_input_tokens or 0)
+            + (response.usage.cache_read_input_tokens or 0),
+        )
+
+        return response
+
+    def _predict_input_cost(self, input_tokens: int) -> float:
+        """
+        Predicts the cost of the input tokens of a request (USD) with the input cost per token of the latest request, which reflects the share of tokens read from the prompt cache.
+        Before the first request (or after a model switch), all input tokens are priced as written to the cache if prompt caching is enabled.
+
+        Args:
+            input_tokens (int): The number of input tokens of the request, e.g., the token estimate of the context.
+        """
+        if self._input_token_cost is not None:
+            return input_tokens * self._input_token_cost
+        cost_1M_tokens = self.cost_1M_cache_write_tokens if self._prompt_caching else self.cost_1M_input_tokens
+        return input_tokens * cost_1M_tokens / 1e6
+
+    def _expected_output_tokens(self) -> int:
+        """
+        Returns the expected number of output tokens of a request: the mean of the paid requests so far, or the output token limit before the first request.
+        """
+        if self.usage_requests == 0:
+            return self._max_tokens
+        return round(self.usage_output_tokens / self.usage_requests)
+
+    def _reserve_budget(self, request: dict) -> BudgetDecision:
+        """
+        Reserves the predicted cost of a request with the budget governor, and caps the output token limit (and the thinking budget) of the request to the reservation.
+
+        Args:
+            request (dict): The request. max_tokens and thinking are replaced if capped.
+
+        Raises:
+            BudgetExceededError: If the governor refuses the request, or the budget left does not cover the minimum thinking budget.
+
+        Returns:
+            The decision of the governor, to be settled once the request is done.
+        """
+        predicted_input_cost = self._predict_input_cost(self._token_accountant.estimate())
+        decision = self._budget_governor.reserve(
+            self.usage_cost,
+            predicted_input_cost,
+            self.cost_1M_output_tokens,
+            self._max_tokens,
+            self._expected_output_tokens(),
+        )
+        max_tokens = decision.max_output_tokens
+        if max_tokens < self._max_tokens:
+            request["max_tokens"] = max_tokens
+            thinking = request["thinking"]
+            if thinking["type"] == "enabled" and thinking["budget_tokens"] >= max_tokens:
+                # the thinking budget must be below the output token limit
+                budget_tokens = max(_MIN_THINKING_BUDGET, max_tokens // 2)
+                if budget_tokens >= max_tokens:
+                    self._budget_governor.settle(decision, 0.0)
+                    raise BudgetExceededError(
+                        f"The budget left covers only {max_tokens} output tokens, not the minimum thinking budget of {_MIN_THINKING_BUDGET} tokens."
+                    )
+                request["thinking"] = {**thinking, "budget_tokens": budget_tokens}
+            self.logger.info(f"Output token limit of the request capped to {max_tokens} tokens by the budget.")
+        self.logger.debug(
+            f"Budget: predicted cost of the request {decision.predicted_cost:.4f}$, reserved {decision.reserved_cost:.4f}$."
+        )
+        return decision
+
+    def _adapt_to_budget(self):
+        """
+        Adapts the conversation to the budgets before the request of a new query (the latest functional element, before the context is managed), and logs the decision.
+        The cost of the request is predicted from the token estimate of the context, and the adaptation levels reached (see BudgetGovernor.adaptation_level) are applied.
+        """
+        governor = self._budget_governor
+        predicted_cost = (
+            self._predict_input_cost(self._token_accountant.estimate())
+            + self._expected_output_tokens() * self.cost_1M_output_tokens / 1e6
+        )
+        level = governor.adaptation_level(self.usage_cost, predicted_cost)
+        adaptations = self._apply_budget_level(level)
+        run_budget = f" of {governor.run_budget:.2f}$" if governor.run_budget is not None else ""
+        total_budget = f" of {governor.total_budget:.2f}$" if governor.total_budget is not None else ""
+        self.logger.info(
+            f"Budget: run spent {self.usage_cost:.4f}${run_budget}, total spent {governor.spent:.4f}${total_budget}, "
+            f"predicted cost of the next request {predicted_cost:.4f}$, adaptation level {self._budget_level}"
+            + (f" ({', '.join(adaptations)})." if adaptations else ".")
+        )
+        record_metrics(
+            "budget",
+            run=self.logger.name,
+            run_spent=self.usage_cost,
+            total_spent=governor.spent,
+            predicted_cost=predicted_cost,
+            level=self._budget_level,
+            adaptations=adaptations,
+            model=self._model,
+            context_window_limit=self._context_window_limit,
+        )
+
+    def _apply_budget_level(self, level: int) -> list[str]:
+        """
+        Applies the adaptations (see BudgetGovernor.ADAPTATIONS) up to the given level that were not applied yet. Adaptations are never undone.
+
+        Args:
+            level (int): The adaptation level.
+
+        Returns:
+            A description of each change made.
+        """
+        governor = self._budget_governor
+        changes = []
+        while self._budget_level < level:
+            adaptation = BudgetGovernor.ADAPTATIONS[self._budget_level]
+            self._budget_level += 1
+            if adaptation == "context_window":
+                limit = max(
+                    governor.min_context_window_limit,
+                    round(self._context_window_limit * governor.context_window_factor),
+                )
+                if limit < self._context_window_limit:
+                    changes.append(f"context window limit {self._context_window_limit} -> {limit} tokens")
+                    self._context_window_limit = limit
+                    # a context prepared for the previous limit is trimmed again
+                    self._prepared_context = None
+            elif adaptation == "thinking_budget":
+                budget_tokens = max(governor.min_thinking_budget, _MIN_THINKING_BUDGET)
+                if self._thinking["type"] == "enabled" and self._thinking["budget_tokens"] > budget_tokens:
+                    changes.append(f"thinking budget {self._thinking['budget_tokens']} -> {budget_tokens} tokens")
+                    self._thinking = {**self._thinking, "budget_tokens": budget_tokens}
+            elif adaptation == "model":
+                if governor.fallback_model is not None and governor.fallback_model.model != self._model:
+                    changes.append(f"model {self._model} -> {governor.fallback_model.model}")
+                    self._switch_model(governor.fallback_model)
+        return changes
+
+    def _switch_model(self, tier: ModelTier):
+        """
+        Switches the conversation to another model and its token prices. The prompt cache of the previous model is not shared.
+
+        Args:
+            tier (ModelTier): The model.
+        """
+        self._model = tier.model
+        self.cost_1M_input_tokens = tier.cost_1M_input_tokens
+        self.cost_1M_output_tokens = tier.cost_1M_output_tokens
+        self.cost_1M_cache_write_tokens = (
+            tier.cost_1M_cache_write_tokens
+            if tier.cost_1M_cache_write_tokens is not None
+            else tier.cost_1M_input_tokens * 1.25
+        )
+        self.cost_1M_cache_read_tokens = (
+            tier.cost_1M_cache_read_tokens
+            if tier.cost_1M_cache_read_tokens is not None
+            else tier.cost_1M_input_tokens * 0.1
+        )
+        if not tier.thinking:
+            self._thinking = {"type": "disabled"}
+        if tier.output_token_limit is not None:
+            self._max_tokens = min(self._max_tokens, tier.output_token_limit)
+        self._input_token_cost = None
+
+    async def _request_message(self, request: dict, on_content_block=None):
+        """
+        Sends one request to the API, streaming if enabled. Records the request and response if a cassette is set.
+
+        Args:
+            request (dict): The keyword arguments for messages.create.
+            on_content_block (callable): Called with each content block as soon as the block is complete. Only used in streaming mode.
+
+        Returns:
+            The response from the model.
+        """
+        start_time = time.perf_counter()
+        if self._stream:
+            response = await self._stream_message(request, on_content_block)
+        else:
+            response = await self._messages_api(request).create(**request)
+        if self._cassette is not None:
+            self._cassette.record(request, response, time.perf_counter() - start_time)
+        return response
 
-        self.usage_input_tokens += response.usage.input_tokens
-        self.usage_output_tokens += response.usage.output_tokens
+    async def _request_token_count(self, request: dict):
+        """
+        Sends one token counting request to the API. Records the request and response if a cassette is set.
 
+        Args:
+            request (dict): The keyword arguments for messages.count_tokens.
+
+        Returns:
+            The token count.
+        """
+        start_time = time.perf_counter()
+        response = await self._messages_api(request).count_tokens(**request)
+        if self._cassette is not None:
+            self._cassette.record(request, response, time.perf_counter() - start_time, endpoint="count_tokens")
         return response
 
-    def prompt(self, prompt: str, images_dir: str | None) -> LLMResponse:
-        def send_prompt(new_message) -> LLMResponse:
+    async def _stream_message(self, request: dict, on_content_block=None):
+        """
+        Sends a request in streaming mode and records the time to the first token of the current prompt call.
+
+        Args:
+            request (dict): The keyword arguments for messages.stream.
+            on_content_block (callable): Called with each content block as soon as the block is complete.
+
+        Returns:
+            The complete response from the model.
+        """
+        async with self._messages_api(request).stream(**request) as stream:
+            async for event in stream:
+                if (
+                    event.type == "content_block_delta"
+                    and self._prompt_timing is not None
+                    and self._prompt_timing["time_to_first_token"] is None
+                ):
+                    self._prompt_timing["time_to_first_token"] = (
+                        time.perf_counter() - self._prompt_timing["start"]
+                    )
+                elif event.type == "content_block_stop" and on_content_block is not None:
+                    on_content_block(event.content_block)
+            return await stream.get_final_message()
+
+    def _messages_api(self, request: dict):
+        """
+        Returns the messages resource of the client for a request: the beta resource if the request needs beta flags (e.g., file references), the regular one otherwise.
+        """
+        return self.__client.beta.messages if "betas" in request else self.__client.messages
+
+    def _payload_size(self, messages: list, system_prompt=None) -> tuple[int, int]:
+        """
+        Approximates the size of the JSON payload of a request without serializing it, from the lengths of the texts and the inline image data.
+        The sizes are cached per message content (which is replaced, not modified, when the context changes), so only new messages are measured.
+
+        Args:
+            messages ([Message]): The messages of the request.
+            system_prompt: The system prompt of the request.
+
+        Returns:
+            The approximate payload size and the size of the inline image data [bytes].
+        """
+        image_bytes = 0
+        text_bytes = len(json.dumps(system_prompt)) if system_prompt else 0
+        sizes = {}
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                text_bytes += len(content)
+                continue
+            # the content is kept in the cache entry, so that its id is not reused
+            entry = self._payload_sizes.get(id(content)) or (content, *self._content_size(content))
+            sizes[id(content)] = entry
+            text_bytes += entry[1]
+            image_bytes += entry[2]
+        # messages no longer sent are dropped from the cache
+        self._payload_sizes = sizes
+        # a constant for the request parameters and the JSON structure of each message
+        return text_bytes + image_bytes + 500 + 100 * len(messages), image_bytes
+
+    @staticmethod
+    def _content_size(content: list) -> tuple[int, int]:
+        """
+        Returns the approximate JSON size of the text and the size of the inline image data of a message content [bytes] (see _payload_size).
+        """
+        text_bytes = 0
+        image_bytes = 0
+        for block in content:
+            if not isinstance(block, dict):
+                # content blocks of model responses
+                block = block.model_dump(exclude_none=True)
+            if block["type"] == "image" and block["source"]["type"] == "base64":
+                image_bytes += len(block["source"]["data"])
+            elif block["type"] == "image":
+                text_bytes += len(block["source"].get("file_id", ""))
+            else:
+                text_bytes += len(block.get("text") or block.get("thinking") or json.dumps(block))
+        return text_bytes, image_bytes
+
+    def _add_cache_breakpoints(self, messages: list) -> list:
+        """
+        Marks the end of the first message (initial prompt and example images) and, if enabled, the end of the last message (newest stable prefix) as prompt cache breakpoints.
+        The messages in the context are not modified, the marked messages are shallow copies.
+
+        Args:
+            messages ([Message]): The messages to send to the model.
+
+        Returns:
+            The messages with cache breakpoints.
+        """
+
+        def with_breakpoint(message):
+            content = message["content"]
+            # only user messages built by this class consist of dict blocks
+            if not isinstance(content, list) or not isinstance(content[-1], dict):
+                return message
+            last_block = {**content[-1], "cache_control": {"type": "ephemeral"}}
+            return {**message, "content": content[:-1] + [last_block]}
+
+        messages = list(messages)
+        if len(messages) > 0:
+            messages[0] = with_breakpoint(messages[0])
+        if self._cache_latest_prefix and len(messages) > 1:
+            messages[-1] = with_breakpoint(messages[-1])
+        return messages
+
+    def _on_context_evicted(self, num_elements: int, num_reductions=0):
+        if self._prompt_caching:
+            self.cache_invalidations += 1
+            self.logger.info(
+                "The cached prefix after the first functional element is invalidated and will be re-written with the next prompt."
+            )
+
+    async def _reduce_context(self) -> bool:
+        """
+        Makes one step of the graded image eviction (see ImageEvictionPolicy): downscales the images of the oldest iteration with full images or, if all are downscaled, replaces the images of the oldest iteration with a placeholder.
+        The first functional element, the summary of removed iterations and the protected most recent iterations are never changed.
+
+        Returns:
+            True if images were reduced, False otherwise.
+        """
+        policy = self._image_eviction
+        if policy is None:
+            return False
+        candidates = [
+            index
+            for index in range(1, len(self._context) - max(1, policy.protected_iterations))
+            if self._iteration_records[index] is not None
+        ]
+
+        if policy.downscale_factor is not None:
+            for index in candidates:
+                if self._iteration_records[index].image_detail == "full":
+                    self._iteration_records[index].image_detail = "reduced"
+                    if await self._downscale_element_images(index, policy):
+                        return True
+        if policy.placeholders:
+            for index in candidates:
+                if self._iteration_records[index].image_detail != "omitted":
+                    self._iteration_records[index].image_detail = "omitted"
+                    if self._omit_element_images(index):
+                        return True
+        return False
+
+    async def _downscale_element_images(self, index: int, policy: ImageEvictionPolicy) -> bool:
+        """
+        Downscales the images of a functional element in place (in worker threads) and updates its token estimate.
+
+        Args:
+            index (int): The index of the functional element.
+            policy (ImageEvictionPolicy): The eviction policy.
+
+        Returns:
+            True if at least one image was downscaled.
+        """
+        blocks = [
+            (message, position)
+            for message in self._context[index]
+            if isinstance(message["content"], list)
+            for position, block in enumerate(message["content"])
+            # images uploaded to the image store cannot be downscaled
+            if isinstance(block, dict) and block["type"] == "image" and block["source"]["type"] == "base64"
+        ]
+        downscaled = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    downscale_image_block,
+                    message["content"][position],
+                    policy.downscale_factor,
+                    policy.min_long_edge,
+                )
+                for message, position in blocks
+            )
+        )
+        if not any(downscaled):
+            return False
+        for (message, position), block in zip(blocks, downscaled):
+            if block is not None:
+                # the message content is replaced, not modified, as earlier requests may still reference it
+                message["content"] = (
+                    message["content"][:position] + [block] + message["content"][position + 1 :]
+                )
+        self._update_element_tokens(index, "Downscaled the images of")
+        return True
+
+    def _omit_element_images(self, index: int) -> bool:
+        """
+        Replaces the images of a functional element (and their labels) with a text placeholder and updates its token estimate.
+
+        Args:
+            index (int): The index of the functional element.
+
+        Returns:
+            True if images were replaced.
+        """
+        record = self._iteration_records[index]
+        omitted = False
+        for message in self._context[index]:
+            content = message["content"]
+            if not isinstance(content, list) or not any(
+                isinstance(block, dict) and block["type"] == "image" for block in content
+            ):
+                continue
+            labels = []
+            new_content = []
+            for block in content:
+                if isinstance(block, dict) and block["type"] == "image":
+                    continue
+                label = (
+                    re.fullmatch(r"Image (\S+):", block["text"])
+                    if isinstance(block, dict) and block["type"] == "text"
+                    else None
+                )
+                if label:
+                    labels.append(label.group(1))
+                else:
+                    new_content.append(block)
+            placeholder = f"Images {', '.join(labels)} of iteration {record.iteration} omitted to save space"
+            if record.evaluated_parameters is not None:
+                parameters = record.evaluated_parameters
+                placeholder += f"; optimizer parameters [{parameters.order}, {parameters.ell}, {parameters.rbendmin}, {parameters.t1}]"
+            message["content"] = [{"type": "text", "text": placeholder + "."}] + new_content
+            omitted = True
+        if omitted:
+            self._update_element_tokens(index, "Omitted the images of")
+        return omitted
+
+    def _update_element_tokens(self, index: int, action: str):
+        """
+        Re-estimates the tokens of a changed functional element and logs the reclaimed tokens.
+        """
+        tokens = sum(self._estimate_message_tokens(message) for message in self._context[index])
+        reclaimed = self._token_accountant.pop(index) - tokens
+        self._token_accountant.insert(index, tokens)
+        self.logger.info(
+            f"{action} iteration {self._iteration_records[index].iteration} (~{reclaimed} tokens reclaimed)."
+        )
+
+    async def aprompt(
+        self,
+        prompt: str,
+        images_dir: str | list | None,
+        on_early_response=None,
+        use_response_cache=True,
+    ) -> LLMResponse:
+        """
+        See LLMConversationManager.aprompt.
+        images_dir can also be a list of directories and ImageBuffers (or lists of them, e.g., one per candidate), whose images are sent in the given order.
+
+        Additional Args:
+            use_response_cache (bool): Whether to use the response cache (if set) for the requests of this call. Defaults to True.
+        """
+        def on_content_block(block):
+            """
+            Local helper function to detect the final answer in a completed text or submit_assessment block while the response is still streaming.
+            Calls on_early_response once per prompt call.
+            """
+            if on_early_response is None or self._prompt_timing["time_to_parameters"] is not None:
+                return
+            early_response = None
+            if block.type == "text":
+                early_response = self._parse_final_answer(block.text)
+            elif block.type == "tool_use" and block.name == "submit_assessment":
+                try:
+                    early_response = self._parse_assessment(block.input)
+                except ValueError:
+                    pass
+            if early_response is not None:
+                self._prompt_timing["time_to_parameters"] = (
+                    time.perf_counter() - self._prompt_timing["start"]
+                )
+                on_early_response(early_response)
+
+        async def send_prompt(new_message, repairs=0, follow_up=False, query=False) -> LLMResponse:
             """
             Local helper function to send the prompt.
             If the model answers with a tool_use, the function will call itself recursively with the tool use result.
+            If the final answer cannot be parsed, the function will call itself recursively once with a repair request.
 
             Args:
                 new_message: The new message to add to the context.
+                repairs (int): The number of repair requests sent for this prompt.
+                follow_up (bool): Whether the new message continues the current functional element (e.g., a repair request).
+                query (bool): Whether the new message is the query of this prompt call. The conversation is adapted to the budgets before it is sent.
             """
-            # Add the new message to the context
-            self._add_to_context(new_message)
+            with timed("context_management"):
+                # Add the new message to the context
+                self._add_to_context(new_message, follow_up=follow_up)
+
+                if query and self._budget_governor is not None:
+                    self._adapt_to_budget()
 
-            # Remove old messages if the context window size is exceeded
-            self._manage_context()
+                # Remove old messages if the context window size is exceeded
+                await self._manage_context()
 
-            # Send the message to the model, include system prompt if this is the first prompt
-            system_prompt = self._system_prompt if self._prompt_count == 0 else None
-            response = self._send_message(
-                self._context_to_message(), system_prompt=system_prompt
+            # Send the message to the model, include system prompt if this is the first prompt (or always, to keep the cached prefix stable)
+            system_prompt = (
+                self._system_prompt
+                if self._prompt_count == 0 or self._prompt_caching
+                else None
+            )
+            response = await self._send_message(
+                self._context_to_message(),
+                system_prompt=system_prompt,
+                on_content_block=on_content_block,
+                use_response_cache=use_response_cache,
             )
 
             # add response to context
-            self._add_to_context({"role": "assistant", "content": response.content})
+            with timed("context_management"):
+                self._add_to_context({"role": "assistant", "content": response.content})
 
-            # log the response
-            self.logger.debug(response)
+            # log the response (the content is logged block by block below)
+            self.logger.debug(
+                f"Response {response.id}: stop reason {response.stop_reason}, "
+                f"content [{', '.join(block.type for block in response.content)}], usage {response.usage.model_dump(exclude_none=True)}."
+            )
             for message in response.content:
                 self.logger.info(self.__format_message(message))
 
             # check stop reason
+            tool_use_blocks = [block for block in response.content if block.type == "tool_use"]
             if response.stop_reason == "tool_use":
-                tool_use_blocks = [
-                    block for block in response.content if block.type == "tool_use"
-                ]
-                if len(tool_use_blocks) != 1:
-                    raise ValueError(
-                        f"Expected one tool use block, got {len(tool_use_blocks)} tool use blocks"
-                    )
-                # get new message with tool use result
-                new_message = self._parse_tool_use(tool_use_blocks[0])
-                return send_prompt(new_message)
+                # every tool use is answered with a tool result, a submitted assessment takes precedence over other tools
+                assessment_block = next(
+                    (block for block in tool_use_blocks if block.name == "submit_assessment"), None
+                )
+                tool_results = []
+                for block in tool_use_blocks:
+                    if block is assessment_block:
+                        continue
+                    if block.name == "submit_assessment":
+                        tool_results.append(
+                            self._tool_error(block, "Only the first submitted assessment is processed.")
+                        )
+                    else:
+                        tool_results.append(self._parse_tool_use(block))
+                if assessment_block is not None:
+                    return await submit_assessment(assessment_block, repairs, tool_results)
+                # get new message with tool use results
+                return await send_prompt({"role": "user", "content": tool_results}, repairs)
 
             if response.stop_reason not in ["end_turn", "tool_use"]:
                 self.logger.warning(
@@ -163,19 +874,81 @@ class AnthropicConversationManager(LLMConversationManager):
                 )
 
             # return the response
-            response = self._parse_response(response)
+            try:
+                with timed("response_parsing"):
+                    response = self._parse_response(response)
+            except ValueError as ex:
+                if repairs > 0:
+                    raise
+                self.logger.warning(f"Could not parse the LLM answer ({ex}). Requesting a repaired answer.")
+                # a tool use cut off by the stop reason (e.g., max_tokens) must still be answered with a tool result
+                tool_results = [
+                    self._tool_error(block, f"The tool use was not processed, the answer was stopped due to stop reason '{response.stop_reason}'.")
+                    for block in tool_use_blocks
+                ]
+                repair_message = {
+                    "role": "user",
+                    "content": tool_results
+                    + [{"type": "text", "text": get_repair_prompt(str(ex), self._assessment_tool)}],
+                }
+                return await send_prompt(repair_message, repairs + 1, follow_up=True)
+            self._record_response(response)
+            return response
+
+        async def submit_assessment(tool_use_block, repairs, tool_results) -> LLMResponse:
+            """
+            Local helper function to process a submit_assessment tool use, i.e., the final answer.
+            The tool use is closed with a tool result and a short acknowledgement, so that the next prompt can start a new functional element.
+            If the assessment is invalid, the tool result reports the error and asks once for a corrected submission.
+
+            Args:
+                tool_use_block: The submit_assessment tool use block.
+                repairs (int): The number of repair requests sent for this prompt.
+                tool_results (list): The tool results of the other tool use blocks of the same response, sent along with the tool result of the assessment.
+            """
+            try:
+                with timed("response_parsing"):
+                    response = self._parse_assessment(tool_use_block.input)
+            except ValueError as ex:
+                if repairs > 0:
+                    raise
+                self.logger.warning(f"Invalid assessment ({ex}). Requesting a repaired answer.")
+                tool_result = self._tool_error(tool_use_block, get_repair_prompt(str(ex), True))
+                return await send_prompt({"role": "user", "content": tool_results + [tool_result]}, repairs + 1)
+
+            with timed("context_management"):
+                self._add_to_context(
+                    {
+                        "role": "user",
+                        "content": tool_results
+                        + [
+                            {
+                                "type": "tool_result",
+                                "tool_use_id": tool_use_block.id,
+                                "content": "Assessment submitted.",
+                            }
+                        ],
+                    }
+                )
+                self._add_to_context(
+                    {"role": "assistant", "content": [{"type": "text", "text": "Assessment submitted."}]}
+                )
+            self._record_response(response)
             return response
         
         ############################################
 
-        # Convert images to base64 (with text blocks)
+        self.request_sent_time = None
+
+        # Convert images to image blocks (with text blocks)
         image_blocks = []
         if images_dir is not None:
-            for image_file in os.listdir(images_dir):
-                image_path = os.path.join(images_dir, image_file)
-                image_blocks.extend(
-                    AnthropicConversationManager._image_to_base64_message(image_path)
-                )
+            images = self._collect_images(images_dir)
+            with timed("image_encoding"):
+                for blocks in await asyncio.gather(
+                    *(self._image_to_message(image) for image in images)
+                ):
+                    image_blocks.extend(blocks)
 
         # Create the message
         new_message = {
@@ -183,119 +956,417 @@ class AnthropicConversationManager(LLMConversationManager):
             "content": image_blocks + [{"type": "text", "text": prompt}],
         }
 
-        response = send_prompt(new_message)
+        self._prompt_timing = {
+            "start": time.perf_counter(),
+            "time_to_first_token": None,
+            "time_to_parameters": None,
+            "payload_bytes": 0,
+        }
+        response = await send_prompt(new_message, query=True)
+
+        # record the timing of this prompt call
+        timing = self._prompt_timing
+        timing["duration"] = time.perf_counter() - timing.pop("start")
+        self.prompt_timings.append(timing)
+        self._prompt_timing = None
+        if self._stream:
+            self.logger.info(
+                f"Time to first token: {self._format_seconds(timing['time_to_first_token'])}, time to parameters: {self._format_seconds(timing['time_to_parameters'])}, total: {self._format_seconds(timing['duration'])}."
+            )
 
         return response
 
+    async def aprepare_prompt(self):
+        """
+        See LLMConversationManager.aprepare_prompt.
+        Additionally measures the payload size of the context (see _payload_size), so that only the new query is measured when it is sent.
+        """
+        with timed("context_preparation"):
+            await super().aprepare_prompt()
+            self._payload_size(self._context_to_message())
+
+    def response_cache_stats(self) -> dict | None:
+        return self._response_cache.stats() if self._response_cache is not None else None
+
+    def get_state(self) -> tuple[dict, dict[str, bytes]]:
+        """
+        See LLMConversationManager.get_state.
+        Inline images are stored as files with a unique name per image. Converted messages are cached per message content (which is replaced, not modified, when the context changes), so only new messages are converted.
+        The image files are returned as functions decoding the image data, so that decoding can be left to the writer of the checkpoint.
+        """
+        state, files = super().get_state()
+        state["cache_invalidations"] = self.cache_invalidations
+        state["budget_level"] = self._budget_level
+        # messages and images no longer in the context are dropped from the caches
+        messages = [message for element in self._context for message in element]
+        contents = {id(message["content"]) for message in messages}
+        self._state_messages = {
+            key: value for key, value in self._state_messages.items() if key in contents
+        }
+        images = {
+            id(block["source"]["data"])
+            for message in messages
+            if isinstance(message["content"], list)
+            for block in message["content"]
+            if isinstance(block, dict) and block["type"] == "image" and block["source"]["type"] == "base64"
+        }
+        self._state_images = {key: value for key, value in self._state_images.items() if key in images}
+        return state, files
+
+    def restore_state(self, state: dict, files_dir: str):
+        """
+        See LLMConversationManager.restore_state.
+        """
+        super().restore_state(state, files_dir)
+        self.cache_invalidations = state["cache_invalidations"]
+        if self._budget_governor is not None:
+            # the adaptations depend only on the configuration, so they are applied again
+            self._apply_budget_level(state["budget_level"])
+            self._budget_governor.charge(self.usage_cost)
+        self._payload_sizes = {}
+        self._state_messages = {}
+        # the restored images are in their files already
+        self._state_images = {
+            id(block["source"]["data"]): (block["source"]["data"], file_name)
+            for element, state_element in zip(self._context, state["context"])
+            for message, state_message in zip(element, state_element)
+            if message["role"] == "user" and isinstance(message["content"], list)
+            for block, state_block in zip(message["content"], state_message["content"])
+            if state_block["type"] == "image" and state_block["source"]["type"] == "checkpoint_file"
+            for file_name in [state_block["source"]["file_name"]]
+        }
+
+    def _message_to_state(self, message, files: dict) -> dict:
+        content = message["content"]
+        if isinstance(content, str):
+            return message
+        cached = self._state_messages.get(id(content))
+        if cached is not None:
+            return cached[1]
+        blocks = []
+        for block in content:
+            if not isinstance(block, dict):
+                # content blocks of model responses
+                block = block.model_dump(exclude_none=True)
+            elif block["type"] == "image" and block["source"]["type"] == "base64":
+                data = block["source"]["data"]
+                cached_image = self._state_images.get(id(data))
+                if cached_image is not None:
+                    file_name = cached_image[1]
+                else:
+                    file_name = uuid.uuid4().hex + (mimetypes.guess_extension(block["source"]["media_type"]) or "")
+                    self._state_images[id(data)] = (data, file_name)
+                    files[file_name] = functools.partial(base64.b64decode, data)
+                block = {
+                    **block,
+                    "source": {
+                        "type": "checkpoint_file",
+                        "media_type": block["source"]["media_type"],
+                        "file_name": file_name,
+                    },
+                }
+            blocks.append(block)
+        state = {"role": message["role"], "content": blocks}
+        self._state_messages[id(content)] = (content, state)
+        return state
+
+    def _message_from_state(self, state: dict, files_dir: str):
+        content = state["content"]
+        if isinstance(content, str):
+            return state
+        if state["role"] == "assistant":
+            return {"role": "assistant", "content": _CONTENT_BLOCKS.validate_python(content)}
+        blocks = []
+        for block in content:
+            if block["type"] == "image" and block["source"]["type"] == "checkpoint_file":
+                with open(os.path.join(files_dir, block["source"]["file_name"]), "rb") as file:
+                    data = file.read()
+                block = {
+                    **block,
+                    "source": {
+                        "type": "base64",
+                        "media_type": block["source"]["media_type"],
+                        "data": base64.b64encode(data).decode("utf-8"),
+                    },
+                }
+            blocks.append(block)
+        return {"role": "user", "content": blocks}
+
+    def _create_placeholder_query(self) -> tuple | None:
+        """
+        Returns a copy of the latest query with images (text and image blocks), which the next query of the conversation is expected to resemble.
+        """
+        for element in reversed(self._context):
+            message = element[0]
+            content = message["content"]
+            if message["role"] == "user" and isinstance(content, list) and any(
+                isinstance(block, dict) and block["type"] == "image" for block in content
+            ):
+                placeholder = {"role": "user", "content": list(content)}
+                return placeholder, self._estimate_message_tokens(placeholder)
+        return None
+
     def _parse_tool_use(self, tool_use_block):
         """
-        Parses a ToolUseBlock from the LLM and provides the new message to send to the model based on the tool result.
+        Parses a ToolUseBlock from the LLM and provides the tool result to send to the model.
+        Unknown tools are answered with an error result, so that the conversation can continue.
 
         Args:
             tool_use_block: The tool use block from the LLM response.
 
         Returns:
-            The new message to send to the model.
+            The tool result block.
         """
         # retrieve properties
         tool_name = tool_use_block.name
-        tool_input = tool_use_block.input
         tool_use_id = tool_use_block.id
 
-        if tool_use_block.name == "think":
+        if tool_name == "think":
             # return empty block to continue the conversation, tool does not provide a new message
             return {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "tool_result",
-                        "tool_use_id": tool_use_id,
-                    }
-                ],
+                "type": "tool_result",
+                "tool_use_id": tool_use_id,
             }
         else:
-            raise ValueError(f"Unknown tool name: {tool_name}")
+            self.logger.warning(f"The LLM used the unknown tool '{tool_name}'.")
+            return self._tool_error(tool_use_block, f"Unknown tool name: {tool_name}")
+
+    @staticmethod
+    def _tool_error(tool_use_block, message: str) -> dict:
+        """
+        Returns a tool result block reporting an error for the given tool use block.
+
+        Args:
+            tool_use_block: The tool use block from the LLM response.
+            message (str): The error message.
+        """
+        return {
+            "type": "tool_result",
+            "tool_use_id": tool_use_block.id,
+            "is_error": True,
+            "content": message,
+        }
 
-    def _add_to_context(self, element):
+    def _add_to_context(self, element, follow_up=False):
+        tokens = self._estimate_message_tokens(element)
         if len(self._context) == 0:
-            self._context.append([element])
+            self._new_context_element(element, tokens)
         else:
-            # only a user query that does not start with a tool_result should start a new functional element (list)
+            # only a user query that does not start with a tool_result (and is not a follow-up, e.g., a repair request) should start a new functional element (list)
             if (
                 element["role"] == "user"
                 and element["content"][0]["type"] != "tool_result"
+                and not follow_up
             ):
-                self._context.append([element])
+                self._new_context_element(element, tokens)
             else:
                 # append to the last list
                 self._context[-1].append(element)
+                self._token_accountant.extend_last(tokens)
 
-    def _is_context_too_large(self):
-        def count_tokens(messages):
-            # Calculate the total token count of the context
-            response = self.__client.messages.count_tokens(
-                model=self._model,
-                messages=messages,
-                thinking=self._thinking,
-                tools=self._tools,
-            )
+    def _create_summary_element(self, summary: str) -> tuple[list, int]:
+        # the summary is answered by a fixed acknowledgement, so that user and assistant messages keep alternating
+        element = [
+            {"role": "user", "content": [{"type": "text", "text": summary}]},
+            {
+                "role": "assistant",
+                "content": [{"type": "text", "text": "Understood. I will take the summarized iterations into account."}],
+            },
+        ]
+        return element, sum(self._estimate_message_tokens(message) for message in element)
+
+    async def _count_tokens(self, messages: list) -> int:
+        """
+        Counts the input tokens of the given messages (with system prompt and tools) with the API.
 
-            return response.input_tokens
+        Args:
+            messages ([Message]): The messages to count.
 
-        # calculate input tokens of the context
-        input_tokens = count_tokens(self._context_to_message())
+        Returns:
+            The number of input tokens.
+        """
+        request = dict(
+            model=self._model,
+            messages=messages,
+            system=self._system_prompt if self._system_prompt else anthropic.NOT_GIVEN,
+            thinking=self._thinking,
+            tools=self._tools,
+        )
+        if self._image_store.betas:
+            request["betas"] = self._image_store.betas
+        start_time = time.perf_counter()
+        response = await self._scheduler.submit(
+            lambda: self._request_token_count(request),
+            rate_limited=False,
+        )
+        record_metrics(
+            "api_call",
+            endpoint="count_tokens",
+            model=self._model,
+            latency=time.perf_counter() - start_time,
+            counted_tokens=response.input_tokens,
+        )
+        return response.input_tokens
 
+    async def _is_context_too_large(self):
         # count_tokens is not exact, so we use 95% of the limit
-        return input_tokens > self._context_window_limit * 0.95
+        limit = self._context_window_limit * 0.95
+
+        # decide locally if the estimate is clearly below or above the limit
+        estimate = self._token_accountant.estimate()
+        if abs(estimate - limit) > self._context_window_limit * self._token_count_margin:
+            return estimate > limit
+
+        # close to the limit: calculate input tokens of the context and calibrate the estimate
+        raw_estimate = self._token_accountant.raw_total()
+        input_tokens = await self._count_tokens(self._context_to_message())
+        self._token_accountant.calibrate(raw_estimate, input_tokens)
+        self.logger.debug(
+            f"Counted {input_tokens} context tokens (local estimate: {estimate})."
+        )
+
+        return input_tokens > limit
+
+    def _estimate_message_tokens(self, message) -> int:
+        """
+        Estimates the number of tokens of a message locally.
+        Text is estimated with a tokenizer approximation and images with the width x height formula.
+
+        Args:
+            message: The message (dict with role and content) to estimate.
+
+        Returns:
+            The raw token estimate of the message.
+        """
+
+        def estimate_block(block):
+            # content blocks of model responses are pydantic models
+            if not isinstance(block, dict):
+                block = block.model_dump(exclude_none=True)
+            block_type = block["type"]
+            if block_type == "image":
+                return estimate_image_tokens(*self._image_block_size(block))
+            elif block_type == "text":
+                return estimate_text_tokens(block["text"])
+            elif block_type == "thinking":
+                return estimate_text_tokens(block["thinking"])
+            elif block_type == "tool_use":
+                return estimate_text_tokens(block["name"] + json.dumps(block["input"]))
+            elif block_type == "tool_result":
+                content = block.get("content", "")
+                if isinstance(content, str):
+                    return estimate_text_tokens(content)
+                return sum(estimate_block(b) for b in content)
+            else:
+                return estimate_text_tokens(json.dumps(block))
+
+        # a few tokens per message for the role and separators
+        tokens = 4
+        content = message["content"]
+        if isinstance(content, str):
+            return tokens + estimate_text_tokens(content)
+        return tokens + sum(estimate_block(block) for block in content)
+
+    def _image_block_size(self, image_block) -> tuple[int, int]:
+        """
+        Returns the size of the image in an image block (see ImageStore.image_size).
+
+        Args:
+            image_block (dict): The image block.
+
+        Returns:
+            The width and height of the image [px].
+        """
+        return self._image_store.image_size(image_block)
 
     def _context_to_message(self):
         # in this case, the list of lists needs to be flattened
         return [element for sublist in self._context for element in sublist]
 
-    def _image_to_base64_message(image_path):
+    @staticmethod
+    def _collect_images(images) -> list:
+        """
+        Flattens the images of a prompt into a list of image file paths and ImageBuffers.
+
+        Args:
+            images (str | ImageBuffer | list): A directory (all image files, sorted by name, so that the request does not depend on the file system order; other files such as a scenario's geometry.json are skipped), an ImageBuffer, or a list of them (nested lists are flattened in order).
+
+        Returns:
+            The image file paths and ImageBuffers in order.
         """
-        Converts a local image file to a list of two message blocks containing (1) a text block with the image file name, e.g., "Image 0a:" for 0a.png, and (2) the image data in base64 encoding
+        if isinstance(images, ImageBuffer):
+            return [images]
+        if isinstance(images, str):
+            return [
+                os.path.join(images, file_name)
+                for file_name in sorted(os.listdir(images))
+                if (mimetypes.guess_type(file_name)[0] or "").startswith("image/")
+            ]
+        return [image for item in images for image in AnthropicConversationManager._collect_images(item)]
+
+    async def _image_to_message(self, image):
+        """
+        Converts a local image file or an ImageBuffer to a list of two message blocks containing (1) a text block with the image name, e.g., "Image 0a:" for 0a.png, and (2) the image block created by the image store (inline base64 data or reference to an uploaded file).
+        The file is read (and preprocessed) in a worker thread, so that other conversations on the event loop are not blocked. An ImageBuffer is used as is, without reading the file.
         Taken from Anthropic's `anthropic-cookbook` example code and modified.
 
+        Args:
+            image (str | ImageBuffer): The path to the image file, or the image in memory.
+        """
+        if isinstance(image, ImageBuffer):
+            if self._image_preprocessor is not None:
+                binary_data, mime_type = await asyncio.to_thread(
+                    self._image_preprocessor.process_data, image.data, image.mime_type, image.name, image.image
+                )
+            else:
+                binary_data, mime_type = image.data, image.mime_type
+            image_name = image.name
+            file_name = os.path.basename(image.path) if image.path else f"{image.name}.png"
+        else:
+            binary_data, mime_type = await asyncio.to_thread(
+                AnthropicConversationManager._read_image, image, self._image_preprocessor
+            )
+            file_name = os.path.basename(image)
+            # Remove the file extension from the image file name
+            image_name = os.path.splitext(file_name)[0]
+
+        # Create the image block
+        image_block = await self._image_store.image_block(binary_data, mime_type, file_name)
+
+        text_block = {"type": "text", "text": f"Image {image_name}:"}
+
+        return [text_block, image_block]
+
+    @staticmethod
+    def _read_image(image_path, preprocessor: ImagePreprocessor | None = None) -> tuple[bytes, str]:
+        """
+        Reads a local image file.
+
         Args:
             image_path (str): The path to the image file.
+            preprocessor (ImagePreprocessor): The preprocessor to apply to the image. If None, the file is read as is.
+
+        Returns:
+            The image data and its MIME type.
         """
+        if preprocessor is not None:
+            return preprocessor.process(image_path)
+
         # Open the image file in "read binary" mode
         with open(image_path, "rb") as image_file:
             # Read the contents of the image as a bytes object
             binary_data = image_file.read()
 
-        # Encode the binary data using Base64 encoding
-        base64_encoded_data = base64.b64encode(binary_data)
-
-        # Decode base64_encoded_data from bytes to a string
-        base64_string = base64_encoded_data.decode("utf-8")
-
         # Get the MIME type of the image based on its file extension
         mime_type, _ = mimetypes.guess_type(image_path)
 
-        # Create the image block
-        image_block = {
-            "type": "image",
-            "source": {
-                "type": "base64",
-                "media_type": mime_type,
-                "data": base64_string,
-            },
-        }
-
-        # Remove the file extension from the image file name
-        image_name = os.path.splitext(os.path.basename(image_path))[0]
-
-        text_block = {"type": "text", "text": f"Image {image_name}:"}
-
-        return [text_block, image_block]
+        return binary_data, mime_type
 
     def _parse_response(self, response) -> LLMResponse:
         """
         Parses the response from the model and returns a LLMResponse object.
         Assumes that the response either ends with "DONE" or new optimizer parameters in the format [order, ell, rbendmin, t1].
-        TODO: Parsing of badness criteria.
+        Used if the model does not answer with the submit_assessment tool, the badness criteria are only known for "DONE".
 
         Args:
             response (anthropic.Response): The response from the model.
@@ -310,17 +1381,10 @@ class AnthropicConversationManager(LLMConversationManager):
                 return LLMResponse(None, BadnessCriteria(False, False, False, False))
             else:
                 # Find all optimizer parameter matches
-                matches = re.findall(
-                    r"\[(\d+),\s*(-?[0-9.]+),\s*(-?[0-9.]+),\s*(-?[0-9.]+)\]", text
-                )
+                matches = re.findall(self._PARAMETERS_PATTERN, text)
                 if matches:
-                    last_match = matches[-1]
-                    order = int(last_match[0])
-                    ell = float(last_match[1])
-                    rbendmin = float(last_match[2])
-                    t1 = float(last_match[3])
                     return LLMResponse(
-                        OptimizerParameters(order, ell, rbendmin, t1), None
+                        self._match_to_parameters(matches[-1]), None
                     )  # Placeholder for badness criteria
                 else:
                     raise ValueError(
@@ -330,6 +1394,100 @@ class AnthropicConversationManager(LLMConversationManager):
         else:
             raise ValueError(f"Unknown response format: {response.content}")
 
+    def _parse_assessment(self, tool_input: dict) -> LLMResponse:
+        """
+        Validates the input of a submit_assessment tool use and converts it to a LLMResponse.
+        If no badness criterion is satisfied, the curve is "good" and the response has no optimizer parameters (like "DONE").
+        With multiple candidates per turn, the first candidate is the optimizer parameters of the response.
+
+        Args:
+            tool_input (dict): The input of the tool use.
+
+        Raises:
+            ValueError: If the input does not match the schema of the tool.
+
+        Returns:
+            The parsed response as a LLMResponse object.
+        """
+        criteria = {}
+        for criterion in BadnessCriteria.__dataclass_fields__:
+            value = tool_input.get(criterion)
+            if not isinstance(value, bool):
+                raise ValueError(f"criterion '{criterion}' must be true or false, got {value!r}")
+            criteria[criterion] = value
+        badness_criteria = BadnessCriteria(**criteria)
+        if not any(criteria.values()):
+            return LLMResponse(None, badness_criteria)
+
+        if self._candidates_per_turn > 1:
+            candidates = tool_input.get("candidates")
+            if not isinstance(candidates, list) or not candidates:
+                raise ValueError('the curve is "bad", but no candidates were given')
+            if len(candidates) > self._candidates_per_turn:
+                raise ValueError(
+                    f"at most {self._candidates_per_turn} candidates are allowed, got {len(candidates)}"
+                )
+            candidates = [self._parse_parameters(parameters) for parameters in candidates]
+            return LLMResponse(candidates[0], badness_criteria, candidates)
+
+        parameters = tool_input.get("optimizer_parameters")
+        if not isinstance(parameters, dict):
+            raise ValueError('the curve is "bad", but no optimizer_parameters were given')
+        return LLMResponse(self._parse_parameters(parameters), badness_criteria)
+
+    def _parse_parameters(self, parameters) -> OptimizerParameters:
+        """
+        Validates one optimizer parameters object of a submit_assessment tool use.
+
+        Raises:
+            ValueError: If the object does not match the schema of the tool.
+        """
+        if not isinstance(parameters, dict):
+            raise ValueError(f"invalid optimizer_parameters {parameters!r}")
+        try:
+            order = parameters["order"]
+            values = [float(parameters[name]) for name in ("ell", "rbendmin", "t1")]
+        except (KeyError, TypeError, ValueError) as ex:
+            raise ValueError(f"invalid optimizer_parameters {parameters!r}") from ex
+        if isinstance(order, float) and order.is_integer():
+            order = int(order)
+        if not isinstance(order, int) or isinstance(order, bool) or order < 1:
+            raise ValueError(f"order must be a positive integer, got {order!r}")
+        return OptimizerParameters(order, *values)
+
+    def _match_to_parameters(self, match) -> OptimizerParameters:
+        """
+        Converts a match of _PARAMETERS_PATTERN to OptimizerParameters.
+        """
+        return OptimizerParameters(
+            int(match[0]), float(match[1]), float(match[2]), float(match[3])
+        )
+
+    def _parse_final_answer(self, text: str) -> LLMResponse | None:
+        """
+        Checks if a text block ends with a final answer, i.e., "DONE" or optimizer parameters in the format [order, ell, rbendmin, t1] (optionally followed by punctuation or markdown).
+        Used to detect the answer before the streamed response is complete, the result has to be confirmed by _parse_response.
+
+        Args:
+            text (str): The text of a completed text block.
+
+        Returns:
+            The parsed response, or None if the text does not end with a final answer.
+        """
+        text = text.rstrip(" \t\n.*`_")
+        if text.endswith("DONE"):
+            return LLMResponse(None, BadnessCriteria(False, False, False, False))
+        match = re.search(self._PARAMETERS_PATTERN + "$", text)
+        if match:
+            return LLMResponse(self._match_to_parameters(match.groups()), None)
+        return None
+
+    def _format_seconds(self, seconds: float | None) -> str:
+        """
+        Formats a duration for logging.
+        """
+        return "n/a" if seconds is None else f"{seconds:.2f} s"
+
     def __format_message(self, message) -> str:
         """
         Formats a anthropic.ContentBlock to a string.
@@ -0,0 +1,200 @@
+from dataclasses import dataclass
+import math
+import threading
+
+
+@dataclass
+class ModelTier:
+    """
+    This class describes a model and its token prices, e.g., the cheaper model the BudgetGovernor switches to when a budget is nearly spent.
+
+    Attributes:
+        model: The name of the model.
+        cost_1M_input_tokens: The cost of 1M input tokens (USD).
+        cost_1M_output_tokens: The cost of 1M output tokens (USD).
+        cost_1M_cache_write_tokens: The cost of 1M input tokens written to the prompt cache (USD). Defaults to 1.25x the input token cost.
+        cost_1M_cache_read_tokens: The cost of 1M input tokens read from the prompt cache (USD). Defaults to 0.1x the input token cost.
+        output_token_limit: The maximum number of output tokens of the model. If None, the output token limit of the conversation is kept.
+        thinking: Whether the model supports extended thinking. If False, thinking is disabled when switching to the model.
+    """
+
+    model: str
+    cost_1M_input_tokens: float
+    cost_1M_output_tokens: float
+    cost_1M_cache_write_tokens: float | None = None
+    cost_1M_cache_read_tokens: float | None = None
+    output_token_limit: int | None = None
+    thinking: bool = True
+
+
+class BudgetExceededError(Exception):
+    """
+    Raised if a request cannot be afforded within the budget of its run or the total budget of the BudgetGovernor.
+    """
+
+
+@dataclass
+class BudgetDecision:
+    """
+    This class contains the decision of the BudgetGovernor on one request.
+
+    Attributes:
+        predicted_cost: The expected cost of the request (USD), from the predicted input cost and the expected output tokens.
+        reserved_cost: The cost reserved for the request (USD), from the predicted input cost and max_output_tokens.
+        max_output_tokens: The output token limit of the request, capped so that the reserved cost fits into the budgets.
+        run_remaining: The budget of the run left before the request (USD), None if the run budget is unlimited.
+        total_remaining: The total budget left before the request (USD), excluding the reservations of other requests in flight. None if the total budget is unlimited.
+    """
+
+    predicted_cost: float
+    reserved_cost: float
+    max_output_tokens: int
+    run_remaining: float | None
+    total_remaining: float | None
+
+
+class BudgetGovernor:
+    """
+    This class enforces cost budgets (USD) per run and in total (e.g., for all runs of a sweep), shared by the LLM conversation managers of the runs.
+    Before each request, the conversation manager predicts its cost from the size of the context and reserves it (see reserve). The output token limit of the request is capped so that the reservation fits into both budgets; if not even the expected cost fits, the request is refused with a BudgetExceededError.
+    When the spent and predicted cost reach adapt_threshold of a budget, the conversation managers adapt in up to three levels (see adaptation_level): a tighter context window, a lower thinking budget and a cheaper model.
+    The input cost of a request is predicted, not known in advance, so a request can exceed its reservation by the error of the prediction.
+
+    The governor does not hold an asyncio primitive, so it can be shared by conversations on different event loops.
+    """
+
+    # adaptations in the order of the levels they are applied at
+    ADAPTATIONS = ("context_window", "thinking_budget", "model")
+
+    def __init__(
+        self,
+        run_budget: float | None = None,
+        total_budget: float | None = None,
+        adapt_threshold=0.5,
+        context_window_factor=0.5,
+        min_context_window_limit=20_000,
+        min_thinking_budget=1024,
+        fallback_model: ModelTier | None = None,
+    ):
+        """
+        Initializes the BudgetGovernor.
+
+        Args:
+            run_budget (float): The budget of each run (USD), i.e., of each conversation. If None, runs are not limited.
+            total_budget (float): The budget of all runs together (USD). If None, the total is not limited.
+            adapt_threshold (float): The fraction of a budget from which the conversations adapt. The levels are spread evenly between the threshold and the full budget.
+            context_window_factor (float): The factor the context window limit is reduced by at the first level.
+            min_context_window_limit (int): The context window limit is never reduced below this number of tokens.
+            min_thinking_budget (int): The thinking budget (tokens) at the second level. The API requires at least 1024 tokens.
+            fallback_model (ModelTier): The cheaper model used at the third level. If None, the model is not changed.
+        """
+        self.run_budget = run_budget
+        self.total_budget = total_budget
+        self._adapt_threshold = adapt_threshold
+        self.context_window_factor = context_window_factor
+        self.min_context_window_limit = min_context_window_limit
+        self.min_thinking_budget = min_thinking_budget
+        self.fallback_model = fallback_model
+        self._lock = threading.Lock()
+        # cost of all settled requests, and the cost reserved for requests in flight (USD)
+        self.spent = 0.0
+        self._reserved = 0.0
+        self._exhausted = False
+
+    def exhausted(self) -> bool:
+        """
+        Returns whether the total budget is spent, i.e., a request was refused because of the total budget or the spent cost reached it.
+        """
+        with self._lock:
+            return self._exhausted or (self.total_budget is not None and self.spent >= self.total_budget)
+
+    def adaptation_level(self, run_spent: float, predicted_cost: float) -> int:
+        """
+        Returns the adaptation level for the next request of a run: 0 if the spent and predicted cost are below adapt_threshold of both budgets, up to len(ADAPTATIONS) close to a budget.
+
+        Args:
+            run_spent (float): The cost spent by the run so far (USD).
+            predicted_cost (float): The predicted cost of the next request (USD).
+        """
+        with self._lock:
+            pressure = 0.0
+            if self.run_budget is not None:
+                pressure = max(pressure, (run_spent + predicted_cost) / self.run_budget)
+            if self.total_budget is not None:
+                pressure = max(pressure, (self.spent + self._reserved + predicted_cost) / self.total_budget)
+        if pressure < self._adapt_threshold:
+            return 0
+        step = (1 - self._adapt_threshold) / len(self.ADAPTATIONS)
+        return min(len(self.ADAPTATIONS), 1 + math.floor((pressure - self._adapt_threshold) / step))
+
+    def reserve(
+        self,
+        run_spent: float,
+        input_cost: float,
+        cost_1M_output_tokens: float,
+        max_output_tokens: int,
+        expected_output_tokens: int,
+    ) -> BudgetDecision:
+        """
+        Reserves the cost of a request. Must be followed by settle once the request is done (or failed).
+
+        Args:
+            run_spent (float): The cost spent by the run so far (USD).
+            input_cost (float): The predicted cost of the input tokens of the request (USD).
+            cost_1M_output_tokens (float): The cost of 1M output tokens of the model (USD).
+            max_output_tokens (int): The output token limit of the conversation.
+            expected_output_tokens (int): The expected number of output tokens, e.g., the mean of the previous requests. The request is refused if the budgets cannot cover them.
+
+        Raises:
+            BudgetExceededError: If the predicted input cost and the expected output tokens do not fit into the budget of the run or the total budget.
+
+        Returns:
+            The decision, including the output token limit of the request.
+        """
+        output_cost = cost_1M_output_tokens / 1e6
+        expected_output_tokens = min(expected_output_tokens, max_output_tokens)
+        predicted_cost = input_cost + expected_output_tokens * output_cost
+        with self._lock:
+            run_remaining = self.run_budget - run_spent if self.run_budget is not None else None
+            total_remaining = (
+                self.total_budget - self.spent - self._reserved if self.total_budget is not None else None
+            )
+            remaining = min(
+                (value for value in (run_remaining, total_remaining) if value is not None), default=math.inf
+            )
+            if predicted_cost > remaining:
+                if total_remaining is not None and predicted_cost > total_remaining:
+                    self._exhausted = True
+                    budget = f"total budget of {self.total_budget:.2f}$ ({total_remaining:.4f}$ left)"
+                else:
+                    budget = f"run budget of {self.run_budget:.2f}$ ({run_remaining:.4f}$ left)"
+                raise BudgetExceededError(
+                    f"The predicted cost of the next request ({predicted_cost:.4f}$) exceeds the {budget}."
+                )
+            if output_cost > 0 and remaining < math.inf:
+                max_output_tokens = min(max_output_tokens, math.floor((remaining - input_cost) / output_cost))
+            reserved_cost = input_cost + max_output_tokens * output_cost
+            self._reserved += reserved_cost
+        return BudgetDecision(predicted_cost, reserved_cost, max_output_tokens, run_remaining, total_remaining)
+
+    def settle(self, decision: BudgetDecision, cost: float):
+        """
+        Releases the reservation of a request and adds its actual cost to the spent cost.
+
+        Args:
+            decision (BudgetDecision): The decision returned by reserve.
+            cost (float): The actual cost of the request (USD), 0 if it failed.
+        """
+        with self._lock:
+            self._reserved -= decision.reserved_cost
+            self.spent += cost
+
+    def charge(self, cost: float):
+        """
+        Adds a cost spent without a reservation to the spent cost, e.g., the cost of a resumed run before it was interrupted.
+
+        Args:
+            cost (float): The cost (USD).
+        """
+        with self._lock:
+            self.spent += cost
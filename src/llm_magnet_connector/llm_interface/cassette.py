@@ -0,0 +1,146 @@
+import anthropic
+import hashlib
+import json
+import os
+import threading
+
+# response type per recorded endpoint
+_RESPONSE_TYPES = {
+    "messages": anthropic.types.Message,
+    "count_tokens": anthropic.types.MessageTokensCount,
+}
+
+
+def normalize_request(request: dict) -> dict:
+    """
+    Converts a request to the Messages API into a JSON-serializable dict that only depends on its content.
+    Content blocks of model responses (pydantic models) are converted to dicts, omitted arguments (anthropic.NOT_GIVEN) and cache breakpoints are removed, and image data is replaced by its SHA-256 hash.
+
+    Args:
+        request (dict): The keyword arguments of the request.
+
+    Returns:
+        The normalized request.
+    """
+
+    def normalize(value):
+        if hasattr(value, "model_dump"):
+            value = value.model_dump(exclude_none=True)
+        if isinstance(value, dict):
+            if value.get("type") == "base64" and "data" in value:
+                digest = hashlib.sha256(value["data"].encode()).hexdigest()
+                return {**{k: v for k, v in value.items() if k != "data"}, "sha256": digest}
+            return {
+                key: normalize(item)
+                for key, item in value.items()
+                if key != "cache_control" and item is not anthropic.NOT_GIVEN
+            }
+        if isinstance(value, (list, tuple)):
+            return [normalize(item) for item in value]
+        return value
+
+    return normalize(request)
+
+
+def request_fingerprint(request: dict) -> str:
+    """
+    Returns a stable hash of a request to the Messages API (see normalize_request).
+
+    Args:
+        request (dict): The keyword arguments of the request, or an already normalized request.
+
+    Returns:
+        The hex digest of the SHA-256 hash.
+    """
+    normalized = json.dumps(normalize_request(request), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class Cassette:
+    """
+    This class stores request/response pairs of the Messages API (messages.create and count_tokens) in a JSON lines file, keyed by request_fingerprint.
+    The normalized request is stored along with the response for inspection; image data is only stored as hash.
+    Identical requests recorded multiple times are replayed in the recorded order (the last response is repeated).
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the Cassette. Loads the recorded interactions if the file exists.
+
+        Args:
+            path (str): The path to the cassette file (JSON lines).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # fingerprint -> list of recorded interactions, and the number of replays per fingerprint
+        self._interactions = {}
+        self._replay_counts = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self._interactions.setdefault(interaction["key"], []).append(interaction)
+
+    def __len__(self):
+        return sum(len(interactions) for interactions in self._interactions.values())
+
+    @staticmethod
+    def _key(normalized_request: dict, endpoint: str) -> str:
+        # requests to messages.create keep the plain fingerprint, so that existing cassettes stay valid
+        if endpoint == "messages":
+            return request_fingerprint(normalized_request)
+        return request_fingerprint({"endpoint": endpoint, **normalized_request})
+
+    def record(self, request: dict, response, latency: float, endpoint="messages"):
+        """
+        Appends a request/response pair to the cassette.
+
+        Args:
+            request (dict): The keyword arguments of the request.
+            response (anthropic.types.Message | anthropic.types.MessageTokensCount): The response.
+            latency (float): The time the request took [s].
+            endpoint (str): The endpoint of the request, "messages" (messages.create) or "count_tokens".
+        """
+        normalized = normalize_request(request)
+        interaction = {
+            "key": self._key(normalized, endpoint),
+            "endpoint": endpoint,
+            "request": normalized,
+            "response": response.model_dump(mode="json"),
+            "latency": latency,
+        }
+        with self._lock:
+            self._interactions.setdefault(interaction["key"], []).append(interaction)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write(json.dumps(interaction) + "\n")
+
+    def replay(self, request: dict, endpoint="messages") -> tuple[anthropic.types.Message | anthropic.types.MessageTokensCount, float]:
+        """
+        Returns the recorded response to a request.
+
+        Args:
+            request (dict): The keyword arguments of the request.
+            endpoint (str): The endpoint of the request, "messages" (messages.create) or "count_tokens".
+
+        Raises:
+            KeyError: If no response was recorded for the request.
+
+        Returns:
+            The recorded response and the recorded latency [s].
+        """
+        key = self._key(normalize_request(request), endpoint)
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                raise KeyError(f"No response recorded for request {key} in cassette {self.path}.")
+            count = self._replay_counts.get(key, 0)
+            self._replay_counts[key] = count + 1
+            interaction = interactions[min(count, len(interactions) - 1)]
+        return (
+            _RESPONSE_TYPES[endpoint].model_validate(interaction["response"]),
+            interaction["latency"],
+        )
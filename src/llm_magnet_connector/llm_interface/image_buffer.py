@@ -0,0 +1,22 @@
+from dataclasses import dataclass, field
+from PIL import Image
+
+
+@dataclass
+class ImageBuffer:
+    """
+    This class holds an encoded image in memory, so that it can be passed from the image generator to the request payload without writing and reading it again.
+
+    Attributes:
+        name: The name of the image, i.e., its label and file name without extension (e.g., "3a").
+        data: The encoded image.
+        mime_type: The MIME type of the image.
+        image: The decoded image, if available. Saves decoding the data again, e.g., for preprocessing.
+        path: The file the image is (or will be) persisted to, if any.
+    """
+    name: str
+    # not part of the representation, which is logged
+    data: bytes = field(repr=False)
+    mime_type: str = "image/png"
+    image: Image.Image | None = field(default=None, repr=False)
+    path: str | None = None
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from PIL import Image
+import base64
+import io
+
+
+@dataclass
+class ImageEvictionPolicy:
+    """
+    This class contains the settings of the graded eviction of images from the conversation context.
+    If the context window limit is reached, the images of the oldest iterations are first downscaled, then replaced by a text placeholder, and only then whole functional elements are removed.
+    The initial prompt (with the example images) and the most recent iterations are never changed.
+
+    Attributes:
+        protected_iterations: Number of most recent iterations whose images are never reduced (at least 1, the latest query).
+        downscale_factor: Factor the images of old iterations are downscaled by in the first step. If None, images are not downscaled. Only inline (base64) images can be downscaled.
+        min_long_edge: Images are never downscaled below this length of the longer edge [px], so that the labels stay legible.
+        placeholders: Whether to replace the images of old iterations by a text placeholder in the second step.
+    """
+
+    protected_iterations: int = 1
+    downscale_factor: float | None = 0.5
+    min_long_edge: int = 400
+    placeholders: bool = True
+
+
+def downscale_image_block(image_block: dict, factor: float, min_long_edge: int) -> dict | None:
+    """
+    Downscales the image of a base64 image block.
+
+    Args:
+        image_block (dict): The image block.
+        factor (float): The scale factor (< 1).
+        min_long_edge (int): The minimum length of the longer edge [px].
+
+    Returns:
+        A new image block with the downscaled PNG image, or None if the image cannot be downscaled further.
+    """
+    with Image.open(io.BytesIO(base64.b64decode(image_block["source"]["data"]))) as image:
+        width, height = image.size
+        scale = max(factor, min_long_edge / max(width, height))
+        if scale >= 1.0:
+            return None
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": "image/png",
+            "data": base64.b64encode(buffer.getvalue()).decode("utf-8"),
+        },
+    }
@@ -0,0 +1,165 @@
+from dataclasses import dataclass
+from PIL import Image
+import numpy as np
+import io
+import math
+import mimetypes
+import os
+
+from .token_accounting import estimate_image_tokens
+
+
+@dataclass
+class ImagePreprocessingConfig:
+    """
+    This class contains the settings of the preprocessing applied to images before they are encoded and sent to the LLM.
+
+    Attributes:
+        max_long_edge: Maximum length of the longer image edge [px]. Larger images are downscaled. The API downscales images above 1568 px anyway.
+        max_image_tokens: Maximum estimated number of tokens per image (tokens = width * height / 750). Larger images are downscaled.
+        min_scale: Images are never downscaled below this factor, so that the labels (font size 120 px) stay legible.
+        colors: Number of palette colors to quantize the image to (2-256). If None, the image is not quantized.
+        grayscale: Whether to convert the image to grayscale. Red pixels (the image labels) keep their color.
+        optimize: Whether to recompress the PNG with maximum (lossless) compression.
+    """
+
+    max_long_edge: int = 1568
+    max_image_tokens: int = 1600
+    min_scale: float = 0.25
+    colors: int | None = None
+    grayscale: bool = False
+    optimize: bool = True
+
+
+class ImagePreprocessor:
+    """
+    This class prepares images for the LLM according to an ImagePreprocessingConfig: downscaling to the token budget, optional grayscale conversion and palette quantization, and PNG recompression.
+    The byte and estimated token savings are logged per image.
+    """
+
+    def __init__(self, logger, config: ImagePreprocessingConfig):
+        """
+        Initializes the ImagePreprocessor.
+
+        Args:
+            logger: The logger to use.
+            config (ImagePreprocessingConfig): The preprocessing settings.
+        """
+        self.logger = logger
+        self.config = config
+
+    def process(self, image_path: str) -> tuple[bytes, str]:
+        """
+        Preprocesses the image at the given path.
+
+        Args:
+            image_path (str): The path to the image file.
+
+        Returns:
+            The image data and its MIME type. If preprocessing does not reduce the size or token count, the original data is returned.
+        """
+        with open(image_path, "rb") as image_file:
+            original_data = image_file.read()
+        mime_type, _ = mimetypes.guess_type(image_path)
+        return self.process_data(original_data, mime_type, os.path.basename(image_path))
+
+    def process_data(self, original_data: bytes, mime_type: str, name: str, image: Image.Image | None = None) -> tuple[bytes, str]:
+        """
+        Preprocesses an image in memory.
+
+        Args:
+            original_data (bytes): The encoded image.
+            mime_type (str): The MIME type of the encoded image.
+            name (str): The name of the image, used for logging.
+            image (Image.Image): The decoded image, if available. Otherwise, the data is decoded.
+
+        Returns:
+            The image data and its MIME type. If preprocessing does not reduce the size or token count, the original data is returned.
+        """
+        if image is not None:
+            original_size = image.size
+            image = self._flatten(image)
+        else:
+            with Image.open(io.BytesIO(original_data)) as original:
+                original_size = original.size
+                image = self._flatten(original)
+
+        width, height = original_size
+        scale = min(
+            1.0,
+            self.config.max_long_edge / max(width, height),
+            math.sqrt(self.config.max_image_tokens * 750 / (width * height)),
+        )
+        scale = max(scale, self.config.min_scale)
+        if scale < 1.0:
+            new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+        if self.config.grayscale:
+            image = self._to_grayscale_keep_red(image)
+
+        if self.config.colors is not None:
+            image = self._quantize(image)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=self.config.optimize)
+        data = buffer.getvalue()
+
+        original_tokens = estimate_image_tokens(*original_size)
+        tokens = estimate_image_tokens(*image.size)
+        if len(data) >= len(original_data) and tokens >= original_tokens:
+            # nothing gained, keep the original image
+            data = original_data
+            tokens = original_tokens
+        else:
+            mime_type = "image/png"
+
+        self.logger.debug(
+            f"Preprocessed image {name}: {len(original_data)} -> {len(data)} bytes, ~{original_tokens} -> ~{tokens} tokens."
+        )
+
+        return data, mime_type
+
+    def _flatten(self, image: Image.Image) -> Image.Image:
+        """
+        Converts the image to RGB. Transparent areas are composited onto a white background.
+        """
+        if image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        ):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            return background
+        return image.convert("RGB")
+
+    def _to_grayscale_keep_red(self, image: Image.Image) -> Image.Image:
+        """
+        Converts the image to grayscale, except for strongly red pixels (the image labels), which keep their color.
+        """
+        pixels = np.asarray(image, dtype=np.int16)
+        red = (pixels[..., 0] - np.maximum(pixels[..., 1], pixels[..., 2])) > 80
+        gray = np.asarray(image.convert("L"))
+        result = np.repeat(gray[..., None], 3, axis=-1)
+        result[red] = np.asarray(image)[red]
+        return Image.fromarray(result)
+
+    def _quantize(self, image: Image.Image) -> Image.Image:
+        """
+        Quantizes the image to a palette of config.colors colors. Pure red is always part of the palette, so that the labels keep their color.
+        """
+        colors = max(2, min(256, self.config.colors))
+        if self.config.grayscale:
+            # fixed palette: evenly spaced gray levels and pure red
+            levels = np.linspace(0, 255, colors - 1).round().astype(np.uint8)
+            palette = np.stack([levels] * 3, axis=-1).flatten().tolist() + [255, 0, 0]
+        else:
+            adaptive = image.quantize(
+                colors=colors - 1,
+                method=Image.Quantize.FASTOCTREE,
+                dither=Image.Dither.NONE,
+            )
+            palette = adaptive.getpalette()[: 3 * (colors - 1)] + [255, 0, 0]
+        palette_image = Image.new("P", (1, 1))
+        palette_image.putpalette(palette)
+        return image.quantize(palette=palette_image, dither=Image.Dither.NONE)
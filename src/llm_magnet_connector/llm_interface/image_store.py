@@ -0,0 +1,192 @@
+from abc import ABC, abstractmethod
+from PIL import Image
+import anthropic
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import struct
+
+from llm_magnet_connector.utils import run_sync
+from .request_scheduler import RequestScheduler, get_request_scheduler
+
+# beta flag required for requests referencing uploaded files
+FILES_API_BETA = "files-api-2025-04-14"
+
+# upload errors after which the store falls back to inline images, e.g., the Files API is not enabled or does not accept the images
+_FALLBACK_STATUS_CODES = {400, 403, 404, 415}
+
+
+class ImageStore(ABC):
+    """
+    This class is an abstract class for turning image data into image blocks of the Messages API, either inline (base64) or as reference to an uploaded file.
+    It also provides the size of the images of its blocks, which is needed for token estimates.
+    """
+
+    @abstractmethod
+    async def image_block(self, data: bytes, mime_type: str, name: str) -> dict:
+        """
+        This method should return an image block for the given image.
+
+        Args:
+            data (bytes): The image data.
+            mime_type (str): The MIME type of the image.
+            name (str): The file name of the image.
+
+        Returns:
+            The image block.
+        """
+        pass
+
+    @property
+    def betas(self) -> list[str]:
+        """
+        The beta flags requests with blocks of this store must be sent with.
+        """
+        return []
+
+    def image_size(self, image_block: dict) -> tuple[int, int]:
+        """
+        Returns the size of the image in an image block created by this store.
+        For base64 PNG images only the header is decoded.
+
+        Args:
+            image_block (dict): The image block.
+
+        Returns:
+            The width and height of the image [px].
+        """
+        data = image_block["source"]["data"]
+        # the first 32 base64 characters contain the PNG signature and the IHDR chunk with width and height
+        return _image_size(base64.b64decode(data[:32]), lambda: base64.b64decode(data))
+
+
+class InlineImageStore(ImageStore):
+    """
+    This class sends images inline, i.e., base64 encoded in every request.
+    """
+
+    async def image_block(self, data: bytes, mime_type: str, name: str) -> dict:
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": mime_type,
+                "data": base64.b64encode(data).decode("utf-8"),
+            },
+        }
+
+
+class FilesApiImageStore(InlineImageStore):
+    """
+    This class uploads each distinct image once to the Files API and references it by file id in requests, so that the image data is not re-sent with every request of the conversation.
+    Identical images (e.g., the example images of the initial prompt) are uploaded only once, also across conversation managers sharing the store.
+    If the upload fails with a non-retryable error (400, 403, 404 or 415, e.g., the Files API is not available), the store falls back to inline images for the rest of its lifetime. Other errors (e.g., rate limits or server errors left after the retries of the scheduler) are raised, and the upload is tried again with the next request.
+    Uploaded files are kept by the API until they are deleted with adelete_files.
+
+    Requests recorded with this store reference file ids, so they can only be replayed (see Cassette) with the same uploaded files.
+    """
+
+    def __init__(self, logger, base_url: str | None = None, scheduler: RequestScheduler | None = None):
+        """
+        Initializes the FilesApiImageStore. Uses the environment variable ANTHROPIC_API_KEY.
+
+        Args:
+            logger: The logger to use.
+            base_url (str): The base URL of the API, e.g., of a local fake server. If None, the default of the Anthropic client is used.
+            scheduler (RequestScheduler): The scheduler uploads are submitted through (retries). If None, the process-wide scheduler is used.
+        """
+        self.logger = logger
+        # retries are done by the scheduler
+        self.__client = anthropic.AsyncClient(
+            api_key=os.environ.get("ANTHROPIC_API_KEY"), base_url=base_url, max_retries=0
+        )
+        self._scheduler = scheduler if scheduler is not None else get_request_scheduler()
+        self._available = True
+        # SHA-256 of the image data -> upload task (file id), and file id -> image size
+        self._uploads = {}
+        self._sizes = {}
+        self.uploaded_bytes = 0
+
+    @property
+    def betas(self) -> list[str]:
+        return [FILES_API_BETA] if self._sizes else []
+
+    async def image_block(self, data: bytes, mime_type: str, name: str) -> dict:
+        if self._available:
+            key = hashlib.sha256(data).hexdigest()
+            if key not in self._uploads:
+                self._uploads[key] = asyncio.ensure_future(self._upload(data, mime_type, name))
+            upload = self._uploads[key]
+            try:
+                file_id = await upload
+            except anthropic.APIError as ex:
+                if self._uploads.get(key) is upload:
+                    self._uploads.pop(key)
+                if not isinstance(ex, anthropic.APIStatusError) or ex.status_code not in _FALLBACK_STATUS_CODES:
+                    raise
+                if self._available:
+                    self._available = False
+                    self.logger.warning(
+                        f"Uploading images to the Files API failed ({ex}). Falling back to inline images."
+                    )
+            else:
+                return {"type": "image", "source": {"type": "file", "file_id": file_id}}
+        return await super().image_block(data, mime_type, name)
+
+    async def _upload(self, data: bytes, mime_type: str, name: str) -> str:
+        """
+        Uploads an image and returns its file id.
+        """
+        metadata = await self._scheduler.submit(
+            lambda: self.__client.beta.files.upload(
+                file=(name, data, mime_type), betas=[FILES_API_BETA]
+            ),
+            rate_limited=False,
+        )
+        self._sizes[metadata.id] = _image_size(data, lambda: data)
+        self.uploaded_bytes += len(data)
+        self.logger.debug(f"Uploaded image {name} ({len(data)} bytes) as {metadata.id}.")
+        return metadata.id
+
+    async def adelete_files(self):
+        """
+        Deletes all files uploaded by the store from the Files API. Must only be called once no conversation sends the image blocks of the store anymore; images are uploaded again if they are needed afterwards.
+        """
+        uploads = [upload for upload in self._uploads.values() if upload.done() and not upload.exception()]
+        file_ids = [upload.result() for upload in uploads]
+        self._uploads = {key: upload for key, upload in self._uploads.items() if upload not in uploads}
+        await asyncio.gather(
+            *(
+                self._scheduler.submit(
+                    lambda file_id=file_id: self.__client.beta.files.delete(file_id, betas=[FILES_API_BETA]),
+                    rate_limited=False,
+                )
+                for file_id in file_ids
+            )
+        )
+        for file_id in file_ids:
+            self._sizes.pop(file_id, None)
+        self.logger.debug(f"Deleted {len(file_ids)} uploaded images.")
+
+    def delete_files(self):
+        """
+        Deletes all files uploaded by the store from the Files API. Synchronous wrapper around adelete_files.
+        """
+        run_sync(self.adelete_files())
+
+    def image_size(self, image_block: dict) -> tuple[int, int]:
+        if image_block["source"]["type"] == "file":
+            return self._sizes[image_block["source"]["file_id"]]
+        return super().image_size(image_block)
+
+
+def _image_size(header: bytes, load_data) -> tuple[int, int]:
+    """
+    Returns the size of an image from the PNG header, or by decoding the data returned by load_data for other formats.
+    """
+    if header[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", header[16:24])
+    with Image.open(io.BytesIO(load_data())) as image:
+        return image.size
@@ -1,10 +1,14 @@
 from abc import ABC, abstractmethod
-from .llm_response import LLMResponse
+from .llm_response import LLMResponse, IterationRecord
+from .prompts import get_history_summary
+from .token_accounting import ContextTokenAccountant
+from llm_magnet_connector.utils import run_sync
 
 
 class LLMConversationManager(ABC):
     """
     This class is an abstract class for handling one conversation with a LLM.
+    The conversation is asyncio-native (see aprompt), prompt is a synchronous wrapper.
     """
 
     def __init__(
@@ -14,6 +18,9 @@ class LLMConversationManager(ABC):
         cost_1M_output_tokens,
         system_prompt=None,
         max_prompts=-1,
+        cost_1M_cache_write_tokens=None,
+        cost_1M_cache_read_tokens=None,
+        context_compaction=False,
     ):
         """
         Initializes the LLMConversationManager.
@@ -26,21 +33,62 @@ class LLMConversationManager(ABC):
             output_token_limit (int): The maximum number of tokens the model can generate. If -1, the default limit of the model will be used.
             context_window_limit (int): The token capacity used for the context window. If -1, the default limit of the model will be used.
             max_prompts (int): The maximum number of prompts that can be sent to the model. If -1, there is no limit.
+            cost_1M_cache_write_tokens (float): The cost of 1M input tokens written to the prompt cache (USD). Defaults to 1.25x the input token cost.
+            cost_1M_cache_read_tokens (float): The cost of 1M input tokens read from the prompt cache (USD). Defaults to 0.1x the input token cost.
+            context_compaction (bool): Whether to replace functional elements removed from the context by a short text summary of the removed iterations (parameters, assessment), kept as second functional element. Defaults to False.
         """
         self.logger = logger
         self.cost_1M_input_tokens = cost_1M_input_tokens
         self.cost_1M_output_tokens = cost_1M_output_tokens
+        self.cost_1M_cache_write_tokens = (
+            cost_1M_cache_write_tokens
+            if cost_1M_cache_write_tokens is not None
+            else cost_1M_input_tokens * 1.25
+        )
+        self.cost_1M_cache_read_tokens = (
+            cost_1M_cache_read_tokens
+            if cost_1M_cache_read_tokens is not None
+            else cost_1M_input_tokens * 0.1
+        )
         self._system_prompt = system_prompt
         self.usage_input_tokens = 0
         self.usage_output_tokens = 0
+        # input tokens written to / read from the prompt cache (not included in usage_input_tokens)
+        self.usage_cache_write_tokens = 0
+        self.usage_cache_read_tokens = 0
+        # cost of the usage at the token prices of each request (USD), and the number of paid requests
+        self.usage_cost = 0.0
+        self.usage_requests = 0
+        # requests answered from a response cache instead of the model (not included in the usage), set by implementations
+        self.response_cache_hits = 0
+        # inline image data sent with all requests [bytes], set by implementations
+        self.sent_image_bytes = 0
+        # functional elements removed from and reduction steps applied to the context (see _manage_context)
+        self.evicted_elements = 0
+        self.context_reductions = 0
         self._prompt_count = 0
         self._context = []
+        # token estimate per functional element of self._context, must be updated together with self._context
+        self._token_accountant = ContextTokenAccountant()
+        # record per functional element of self._context, must be updated together with self._context
+        self._iteration_records = []
+        self._iteration_count = 0
+        self._context_compaction = context_compaction
+        # records of the removed iterations, summarized in the second functional element if compaction is enabled
+        self._compacted_records = []
+        self._summary_in_context = False
+        # (number of functional elements, raw token estimate, reserved tokens) of the context trimmed by aprepare_prompt
+        self._prepared_context = None
+        # time (time.perf_counter()) at which the first request of the latest prompt call was sent, set by implementations
+        self.request_sent_time = None
         self._max_prompts = (
             max_prompts if max_prompts != -1 else 1000
         )  # hardcoded limit
 
     @abstractmethod
-    def prompt(self, prompt: str, images_dir: str | None) -> LLMResponse:
+    async def aprompt(
+        self, prompt: str, images_dir: str | list | None, on_early_response=None
+    ) -> LLMResponse:
         """
         This method should take a prompt and a path to a directory of images to prompt the model with and return an LLMResponse object.
         All images in the directory should be considered when generating the response. The file name of the image should coincide with the label on the image.
@@ -49,19 +97,205 @@ class LLMConversationManager(ABC):
 
         Args:
             prompt (str): The prompt to be used for the LLM.
-            images_dir (str): The directory where the images are stored.
+            images_dir (str | list): The directory where the images are stored, or a list of directories and ImageBuffers (images in memory, e.g., one list per candidate of the previous response) whose images are considered in the given order.
+            on_early_response (callable): Optional callback that implementations supporting streaming call with a preliminary LLMResponse as soon as the final answer is detected, before the response is complete. The returned LLMResponse is authoritative.
 
         Raises:
             ValueError: If not all images could be attached to the prompt.
         """
         pass
 
+    def prompt(
+        self, prompt: str, images_dir: str | list | None, on_early_response=None, **kwargs
+    ) -> LLMResponse:
+        """
+        Synchronous wrapper around aprompt. Runs aprompt on the event loop of the calling thread.
+        Must not be called from a running event loop, await aprompt instead.
+
+        Args:
+            prompt (str): The prompt to be used for the LLM.
+            images_dir (str | list): The directory where the images are stored (see aprompt).
+            on_early_response (callable): See aprompt.
+            **kwargs: Further arguments of the aprompt implementation.
+
+        Returns:
+            The LLMResponse.
+        """
+        return run_sync(self.aprompt(prompt, images_dir, on_early_response, **kwargs))
+
+    async def aprepare_prompt(self):
+        """
+        Prepares the context for the next prompt while its images are still being generated, so that less work is left once they are available.
+        The context is trimmed (see _manage_context) as if a query like the latest one (see _create_placeholder_query) was added already. If the next query is not larger, aprompt does not trim the context again.
+        Must not be called while a prompt is in progress.
+        """
+        placeholder = self._create_placeholder_query()
+        if placeholder is None:
+            return
+        message, tokens = placeholder
+        self._prepared_context = None
+        self._new_context_element(message, tokens)
+        try:
+            await self._manage_context()
+        finally:
+            # the placeholder is always the last functional element, it is never removed
+            self._context.pop()
+            self._token_accountant.pop(len(self._context))
+            self._iteration_records.pop()
+            self._iteration_count -= 1
+        self._prepared_context = (len(self._context), self._token_accountant.raw_total(), tokens)
+
+    def prepare_prompt(self):
+        """
+        Synchronous wrapper around aprepare_prompt.
+        """
+        run_sync(self.aprepare_prompt())
+
+    def _add_usage(self, input_tokens: int, output_tokens: int, cache_write_tokens=0, cache_read_tokens=0) -> float:
+        """
+        Adds the usage of a request to the usage counters.
+
+        Args:
+            input_tokens (int): The number of uncached input tokens.
+            output_tokens (int): The number of output tokens.
+            cache_write_tokens (int): The number of input tokens written to the prompt cache.
+            cache_read_tokens (int): The number of input tokens read from the prompt cache.
+
+        Returns:
+            The cost of the request at the current token prices (USD).
+        """
+        cost = (
+            input_tokens * self.cost_1M_input_tokens
+            + output_tokens * self.cost_1M_output_tokens
+            + cache_write_tokens * self.cost_1M_cache_write_tokens
+            + cache_read_tokens * self.cost_1M_cache_read_tokens
+        ) / 1e6
+        self.usage_input_tokens += input_tokens
+        self.usage_output_tokens += output_tokens
+        self.usage_cache_write_tokens += cache_write_tokens
+        self.usage_cache_read_tokens += cache_read_tokens
+        self.usage_cost += cost
+        self.usage_requests += 1
+        return cost
+
+    def context_size(self) -> tuple[int, int]:
+        """
+        Returns the number of functional elements in the context and the (calibrated) token estimate of the context.
+        """
+        return len(self._context), self._token_accountant.estimate()
+
+    def response_cache_stats(self) -> dict | None:
+        """
+        Returns the statistics of the response cache of the manager (see ResponseCache.stats), or None if it has no response cache.
+        """
+        return None
+
+    def get_state(self) -> tuple[dict, dict[str, bytes]]:
+        """
+        Returns the state of the conversation (context, iteration records, token estimates, prompt count and usage), e.g., for a checkpoint (see restore_state).
+        Messages are converted by _message_to_state, which can move large data (e.g., images) out of the state into files.
+
+        Returns:
+            The JSON-serializable state, and the contents of the files referenced by it (bytes, or a function returning them) by file name. Only files not returned by an earlier call are included.
+        """
+        files = {}
+        state = {
+            "prompt_count": self._prompt_count,
+            "usage_input_tokens": self.usage_input_tokens,
+            "usage_output_tokens": self.usage_output_tokens,
+            "usage_cache_write_tokens": self.usage_cache_write_tokens,
+            "usage_cache_read_tokens": self.usage_cache_read_tokens,
+            "usage_cost": self.usage_cost,
+            "usage_requests": self.usage_requests,
+            "response_cache_hits": self.response_cache_hits,
+            "context": [
+                [self._message_to_state(message, files) for message in element]
+                for element in self._context
+            ],
+            "element_tokens": [
+                self._token_accountant.element_tokens(index) for index in range(len(self._context))
+            ],
+            "calibration_factor": self._token_accountant.calibration_factor,
+            "iteration_records": [
+                record.to_dict() if record is not None else None for record in self._iteration_records
+            ],
+            "iteration_count": self._iteration_count,
+            "compacted_records": [record.to_dict() for record in self._compacted_records],
+            "summary_in_context": self._summary_in_context,
+        }
+        return state, files
+
+    def restore_state(self, state: dict, files_dir: str):
+        """
+        Restores a state returned by get_state, e.g., to resume a conversation from a checkpoint. The manager should be configured like the one the state was taken from.
+
+        Args:
+            state (dict): The state.
+            files_dir (str): The directory with the files referenced by the state.
+        """
+        self._prompt_count = state["prompt_count"]
+        self.usage_input_tokens = state["usage_input_tokens"]
+        self.usage_output_tokens = state["usage_output_tokens"]
+        self.usage_cache_write_tokens = state["usage_cache_write_tokens"]
+        self.usage_cache_read_tokens = state["usage_cache_read_tokens"]
+        self.usage_cost = state["usage_cost"]
+        self.usage_requests = state["usage_requests"]
+        self.response_cache_hits = state["response_cache_hits"]
+        self._context = [
+            [self._message_from_state(message, files_dir) for message in element]
+            for element in state["context"]
+        ]
+        overhead_tokens = self._token_accountant.overhead_tokens
+        self._token_accountant = ContextTokenAccountant()
+        self._token_accountant.overhead_tokens = overhead_tokens
+        for tokens in state["element_tokens"]:
+            self._token_accountant.add_element(tokens)
+        self._token_accountant.calibration_factor = state["calibration_factor"]
+        self._iteration_records = [
+            IterationRecord.from_dict(record) if record is not None else None
+            for record in state["iteration_records"]
+        ]
+        self._iteration_count = state["iteration_count"]
+        self._compacted_records = [IterationRecord.from_dict(record) for record in state["compacted_records"]]
+        self._summary_in_context = state["summary_in_context"]
+        self._prepared_context = None
+
+    def _message_to_state(self, message, files: dict) -> dict:
+        """
+        Converts a message of the context to a JSON-serializable dict (see get_state). Messages are dicts by default.
+
+        Args:
+            message: The message.
+            files (dict): Files referenced by the converted message can be added here, by file name.
+        """
+        return message
+
+    def _message_from_state(self, state: dict, files_dir: str):
+        """
+        Converts a message returned by _message_to_state back to a message of the context.
+
+        Args:
+            state (dict): The converted message.
+            files_dir (str): The directory with the files referenced by the message.
+        """
+        return state
+
+    def _create_placeholder_query(self) -> tuple | None:
+        """
+        Hook for aprepare_prompt. Implementations supporting the preparation return a message expected to be at least as large as the next query (e.g., with the images of the latest query).
+
+        Returns:
+            The message and its raw token estimate, or None if the context cannot be prepared.
+        """
+        return None
+
     @abstractmethod
     def _add_to_context(self, element):
         """
         This method should add an element to self._context.
         The context is a list of lists where each list represents a functional element that can be safely removed from the context together (e.g., a user prompt and corresponding model answer).
         This method should decide whether to add the new element to the most recent list or to a new list.
+        The token estimate of the element should be added to self._token_accountant accordingly.
 
         Args:
             element: The element to be added to the context.
@@ -79,29 +313,155 @@ class LLMConversationManager(ABC):
         pass
 
     @abstractmethod
-    def _is_context_too_large(self) -> bool:
+    async def _is_context_too_large(self) -> bool:
         """
         This method should check if the context is too large and should be trimmed.
+        It is called repeatedly while trimming, so it should prefer the local estimate of self._token_accountant over counting the whole context.
 
         Returns:
             True if the context is too large, False otherwise.
         """
         pass
 
-    def _manage_context(self):
+    def _new_context_element(self, element, tokens: int):
+        """
+        Starts a new functional element in self._context with the given message and records it as a new iteration.
+        The optimizer parameters presented in the new iteration are the ones selected in the previous iteration.
+
+        Args:
+            element: The first message of the functional element.
+            tokens (int): The raw token estimate of the message.
+        """
+        previous_response = (
+            self._iteration_records[-1].response if self._iteration_records else None
+        )
+        self._context.append([element])
+        self._token_accountant.add_element(tokens)
+        self._iteration_records.append(
+            IterationRecord(
+                self._iteration_count,
+                previous_response.optimizer_parameters if previous_response else None,
+            )
+        )
+        self._iteration_count += 1
+
+    def _record_response(self, response: LLMResponse):
+        """
+        Records the parsed response of the current iteration (used for the summary of removed iterations).
+
+        Args:
+            response (LLMResponse): The parsed response.
+        """
+        if self._iteration_records:
+            self._iteration_records[-1].response = response
+
+    def _create_summary_element(self, summary: str) -> tuple[list, int]:
+        """
+        This method should create the functional element holding the summary of removed iterations (e.g., a user message with the summary and a short assistant acknowledgement).
+        Required if context compaction is enabled.
+
+        Args:
+            summary (str): The summary text (see get_history_summary).
+
+        Returns:
+            The functional element (list of messages) and its raw token estimate.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support context compaction."
+        )
+
+    async def _reduce_context(self) -> bool:
+        """
+        Hook called by _manage_context before removing a functional element. Implementations can reduce the context in a cheaper way first (e.g., by reducing old images).
+        Should make one reduction step per call, so that the context size is checked after every step.
+
+        Returns:
+            True if the context was reduced, False if nothing could be reduced (the next functional element is removed).
+        """
+        return False
+
+    async def _manage_context(self):
         """
         This method manages the self._context by removing functional elements if necessary.
         It never removes the first element (containing the system prompt, initial prompt, etc.) and most recent element.
-        The strategy followed is to remove the second oldest functional element if the context window limit is reached.
+        The strategy followed is to remove the second oldest functional element if the context window limit is reached, once _reduce_context cannot reduce the context any further.
+        If context compaction is enabled, the removed iterations are summarized in a functional element after the first one, which replaces the summary of earlier removals.
+        Nothing is done if the context was already trimmed for the newest query by aprepare_prompt.
         """
-        # Remove elements as long as the context window is too large
-        while self._is_context_too_large():
-            # never remove the first or last functional element
-            if len(self._context) <= 2:
+        prepared, self._prepared_context = self._prepared_context, None
+        if prepared is not None:
+            elements, raw_tokens, reserved_tokens = prepared
+            new_tokens = self._token_accountant.element_tokens(-1)
+            # the context was trimmed for a query at least as large as the new one by aprepare_prompt
+            if (
+                len(self._context) == elements + 1
+                and self._token_accountant.raw_total() - new_tokens == raw_tokens
+                and new_tokens <= reserved_tokens
+            ):
+                return
+
+        evicted = 0
+        evicted_tokens = 0
+        reduced = 0
+        # Reduce or remove elements as long as the context window is too large
+        while await self._is_context_too_large():
+            if await self._reduce_context():
+                reduced += 1
+                continue
+            # never remove the first or last functional element, or the summary
+            first_removable = 2 if self._summary_in_context else 1
+            if len(self._context) <= first_removable + 1:
                 self.logger.warning(
                     "2 functional context elements exceed the context window limit (i.e., initial interaction and latest query). Please increase the context window limit. Aborting context window management..."
                 )
-                return
+                break
             else:
                 # remove the oldest functional element that is not the first or last
-                self._context.pop(1)
+                self._context.pop(first_removable)
+                evicted_tokens += self._token_accountant.pop(first_removable)
+                record = self._iteration_records.pop(first_removable)
+                evicted += 1
+                if self._context_compaction:
+                    self._compacted_records.append(record)
+                    self._update_summary_element()
+
+        if evicted > 0 and self._context_compaction:
+            self.logger.info(
+                f"Compacted {evicted} iteration(s) (~{evicted_tokens} tokens) into the summary of {len(self._compacted_records)} removed iteration(s) (~{self._token_accountant.element_tokens(1)} tokens)."
+            )
+        elif evicted > 0:
+            self.logger.info(
+                f"Removed {evicted} functional context element(s) (~{evicted_tokens} tokens)."
+            )
+        if evicted > 0 or reduced > 0:
+            self.evicted_elements += evicted
+            self.context_reductions += reduced
+            self._on_context_evicted(evicted, reduced)
+
+    def _update_summary_element(self):
+        """
+        Replaces the summary of removed iterations (second functional element) with a summary of all records in self._compacted_records.
+        """
+        if self._summary_in_context:
+            self._context.pop(1)
+            self._token_accountant.pop(1)
+            self._iteration_records.pop(1)
+        element, tokens = self._create_summary_element(
+            get_history_summary(self._compacted_records)
+        )
+        self._context.insert(1, element)
+        self._token_accountant.insert(1, tokens)
+        # the summary is not an iteration, its record is never summarized
+        self._iteration_records.insert(1, None)
+        self._summary_in_context = True
+
+    def _on_context_evicted(self, num_elements: int, num_reductions=0):
+        """
+        Hook called by _manage_context after functional elements have been removed from or reduced in the context.
+        Changing a functional element after the first one changes every message after it, so implementations caching a prefix of the context should treat that part of the cache as invalid.
+
+        Args:
+            num_elements (int): The number of functional elements removed.
+            num_reductions (int): The number of reduction steps (see _reduce_context).
+        """
+        pass
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 
 
 @dataclass
@@ -32,12 +32,78 @@ class BadnessCriteria:
 class LLMResponse:
     """
     This class contains the key values from the LLM response, i.e., the assessed badness criteria and the newly selected optimizer parameters.
+    If the LLM proposes multiple candidates, optimizer_parameters is the first one and candidates contains all of them.
     """
-    def __init__(self, optimizer_parameters: OptimizerParameters, badnessCriteria: BadnessCriteria):
+    def __init__(self, optimizer_parameters: OptimizerParameters, badnessCriteria: BadnessCriteria, candidates: list[OptimizerParameters] | None = None):
         self.optimizer_parameters = optimizer_parameters
         self.badnessCriteria = badnessCriteria
+        if candidates is None:
+            candidates = [optimizer_parameters] if optimizer_parameters is not None else []
+        self.candidates = candidates
     
     def __str__(self):
+        if len(self.candidates) > 1:
+            return f"{self.candidates}, {self.badnessCriteria}"
         return f"{self.optimizer_parameters}, {self.badnessCriteria}"
+
+    def to_dict(self) -> dict:
+        """
+        Returns the response as JSON-serializable dict (see from_dict).
+        """
+        return {
+            "optimizer_parameters": asdict(self.optimizer_parameters) if self.optimizer_parameters is not None else None,
+            "badnessCriteria": asdict(self.badnessCriteria) if self.badnessCriteria is not None else None,
+            "candidates": [asdict(candidate) for candidate in self.candidates],
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "LLMResponse":
+        """
+        Creates a response from a dict returned by to_dict.
+        """
+        return LLMResponse(
+            OptimizerParameters(**data["optimizer_parameters"]) if data["optimizer_parameters"] is not None else None,
+            BadnessCriteria(**data["badnessCriteria"]) if data["badnessCriteria"] is not None else None,
+            [OptimizerParameters(**candidate) for candidate in data["candidates"]],
+        )
+    
     
-    
\ No newline at end of file
+
+@dataclass
+class IterationRecord:
+    """
+    This class records one iteration of a conversation, i.e., one functional context element, so that it can be summarized once it is removed from the context.
+
+    Attributes:
+        iteration: The index of the iteration (0 for the initial prompt).
+        evaluated_parameters: The optimizer parameters of the curve presented in this iteration. None if unknown (e.g., the initial curve).
+        response: The parsed response of the LLM in this iteration. None if no response was parsed.
+        image_detail: The state of the images of this iteration in the context: "full", "reduced" (downscaled) or "omitted" (replaced by a placeholder).
+    """
+    iteration: int
+    evaluated_parameters: OptimizerParameters | None = None
+    response: LLMResponse | None = None
+    image_detail: str = "full"
+
+    def to_dict(self) -> dict:
+        """
+        Returns the record as JSON-serializable dict (see from_dict).
+        """
+        return {
+            "iteration": self.iteration,
+            "evaluated_parameters": asdict(self.evaluated_parameters) if self.evaluated_parameters is not None else None,
+            "response": self.response.to_dict() if self.response is not None else None,
+            "image_detail": self.image_detail,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "IterationRecord":
+        """
+        Creates a record from a dict returned by to_dict.
+        """
+        return IterationRecord(
+            data["iteration"],
+            OptimizerParameters(**data["evaluated_parameters"]) if data["evaluated_parameters"] is not None else None,
+            LLMResponse.from_dict(data["response"]) if data["response"] is not None else None,
+            data["image_detail"],
+        )
@@ -1,4 +1,4 @@
-from .llm_response import OptimizerParameters
+from .llm_response import OptimizerParameters, IterationRecord
 
 
 def get_system_prompt():
@@ -8,13 +8,22 @@ def get_system_prompt():
     return f"""You are an expert magnet engineer."""
 
 
-def get_initial_prompt(optimizer_params: OptimizerParameters):
+def get_initial_prompt(optimizer_params: OptimizerParameters, assessment_tool: bool = True):
     """
     The initial prompt to feed the LLM.
 
     args:
         optimizer_params: The optimizer parameters used for the initial configuration.
+        assessment_tool: Whether the LLM submits its final answer with the "submit_assessment" tool (see anthropic_submit_assessment_tool) instead of stating it as text.
     """
+    if assessment_tool:
+        final_answer = """- The final answer is submitted with the "submit_assessment" tool instead of being stated as text. If the curve is "good", no criterion is satisfied and no new optimizer parameters are given.
+
+- Submitting the assessment ends the message."""
+    else:
+        final_answer = """- The final answer will be the either "DONE" or the new optimizer parameters.
+
+- The final answer is the end of the message."""
     return f"""We are creating connector curves connecting two parts of a magnet model using an optimizer. Our goal is to analyse connector curves created by an optimizer, assess their "goodness", and propose new optimizer parameters to create a "good" curve. The following describes the procedure to follow:
 
 1) We analyse a given curve to be "bad" if one(1) or more of the following criteria hold, and "good" otherwise:
@@ -100,9 +109,7 @@ Please remember the following:
 
 - After finding a criterion making the curve "bad", also analyse the remaining criteria.
 
-- The final answer will be the either "DONE" or the new optimizer parameters.
-
-- The final answer is the end of the message.
+{final_answer}
 
 
 In the picture marked "Z", there are the two parts of the magnet model needing a connector.
@@ -118,14 +125,20 @@ The pictures marked "0a", "0b", and "0c" depict the curve connecting these two p
 Please analyse the connector curve created by the optimizer, assess its "goodness", and propose new optimizer parameters to create a "good" curve. Use the procedure above. Please think carefully."""
 
 
-def get_reprompt(optimizer_params: OptimizerParameters, index: int):
+def get_reprompt(optimizer_params: OptimizerParameters, index: int, repeated_index: int | None = None):
     """
     The re-prompt to present the curve generated by the previous optimizer parameters.
 
     args:
         optimizer_params: The optimizer parameters used for the previous configuration.
         index: The index of the images.
+        repeated_index: The index of the images of an earlier curve generated with the same optimizer parameters, if the parameters are a repeat.
     """
+    repeat_note = ""
+    if repeated_index is not None:
+        repeat_note = f"""
+
+Note that these optimizer parameters were already selected before. The curve is identical to the one in the pictures marked "{repeated_index}a", "{repeated_index}b", and "{repeated_index}c". Select optimizer parameters that have not been tried yet."""
     return f"""The pictures marked "{index}a", "{index}b", and "{index}c" depict the curve connecting these two parts generated by the optimizer using the selected optimizer parameters [{optimizer_params.order}, {optimizer_params.ell}, {optimizer_params.rbendmin}, {optimizer_params.t1}], where each picture depicts the following:
 
 - "{index}a" depicts a general overview of the curve.
@@ -134,7 +147,80 @@ def get_reprompt(optimizer_params: OptimizerParameters, index: int):
 
 - "{index}c" depicts a close-up view where the curve meets the other part to be connected.
 
-Please analyse the connector curve created by the optimizer, assess its "goodness", and propose new optimizer parameters to create a "good" curve. Use the procedure above. Take into account all optimizer parameter lists selected so far. Please think carefully."""
+Please analyse the connector curve created by the optimizer, assess its "goodness", and propose new optimizer parameters to create a "good" curve. Use the procedure above. Take into account all optimizer parameter lists selected so far. Please think carefully.{repeat_note}"""
+
+
+def get_candidates_reprompt(candidates: list[tuple[OptimizerParameters, int, int | None]]):
+    """
+    The re-prompt to present the curves generated by multiple candidate optimizer parameters together.
+
+    args:
+        candidates: Per candidate, the optimizer parameters, the index of its images, and the index of the images of an earlier curve generated with the same optimizer parameters (None if the parameters are new).
+    """
+    curves = []
+    for optimizer_params, index, repeated_index in candidates:
+        curve = f"""- The pictures marked "{index}a", "{index}b", and "{index}c" depict the curve generated using the optimizer parameters [{optimizer_params.order}, {optimizer_params.ell}, {optimizer_params.rbendmin}, {optimizer_params.t1}]."""
+        if repeated_index is not None:
+            curve += f""" These optimizer parameters were already selected before, the curve is identical to the one in the pictures marked "{repeated_index}a", "{repeated_index}b", and "{repeated_index}c"."""
+        curves.append(curve)
+    curves = "\n\n".join(curves)
+    return f"""The following pictures depict the curves connecting these two parts generated by the optimizer using the selected candidate optimizer parameters. For each curve, "a" depicts a general overview of the curve, and "b" and "c" depict close-up views where the curve meets the parts to be connected.
+
+{curves}
+
+Please analyse the connector curves created by the optimizer, assess their "goodness", and propose new candidate optimizer parameters to create a "good" curve. Use the procedure above. Take into account all optimizer parameter lists selected so far and do not select them again. Please think carefully."""
+
+
+def get_history_summary(iterations: list[IterationRecord]):
+    """
+    The summary of iterations removed from the context to save tokens (see context compaction of LLMConversationManager).
+    Lists per iteration the presented optimizer parameters, the assessment, and the selected optimizer parameters.
+
+    args:
+        iterations: The records of the removed iterations, oldest first.
+    """
+    criteria_descriptions = {
+        "unrealizable_kinks": "unrealizable deformation",
+        "overlapping": "crosses itself or the magnet",
+        "unreasonable_length": "unreasonably long",
+        "ends_not_smooth": "connection not smooth",
+    }
+
+    def format_parameters(optimizer_params):
+        return f"[{optimizer_params.order}, {optimizer_params.ell}, {optimizer_params.rbendmin}, {optimizer_params.t1}]"
+
+    lines = []
+    for record in iterations:
+        response = record.response
+        if record.evaluated_parameters is not None:
+            curve = f"The curve generated with {format_parameters(record.evaluated_parameters)}"
+        else:
+            curve = "The curve"
+        if response is None:
+            lines.append(f"- Iteration {record.iteration}: {curve} was presented, no answer was recorded.")
+            continue
+        if response.optimizer_parameters is None:
+            lines.append(f'- Iteration {record.iteration}: {curve} was assessed as "good".')
+            continue
+        verdict = 'was assessed as "bad"'
+        if response.badnessCriteria is not None:
+            flagged = [
+                description
+                for criterion, description in criteria_descriptions.items()
+                if getattr(response.badnessCriteria, criterion)
+            ]
+            if flagged:
+                verdict += f" ({', '.join(flagged)})"
+        lines.append(
+            f"- Iteration {record.iteration}: {curve} {verdict}. Selected optimizer parameters: {', '.join(format_parameters(candidate) for candidate in response.candidates)}."
+        )
+
+    summary = "\n".join(lines)
+    return f"""The following iterations were removed from our conversation to save space. This is a summary of them:
+
+{summary}
+
+Take these optimizer parameter lists into account like all other optimizer parameter lists selected so far."""
 
 
 def anthropic_think_tool():
@@ -169,3 +255,99 @@ def anthropic_think_tool():
     }
     
     return "", think_tool
+
+
+def anthropic_submit_assessment_tool(candidates: int = 1):
+    """
+    Defines the "submit_assessment" tool for the AnthropicConversationManager. The model submits its final answer (the badness criteria and, if the curve is "bad", the new optimizer parameters) as validated JSON instead of free text.
+
+    args:
+        candidates: The maximum number of candidate optimizer parameter lists the model proposes per answer. If > 1, the candidates are submitted as list and the badness criteria refer to the best of the given curves.
+
+    returns:
+        system_prompt_suffix: The system prompt suffix to append to the system prompt. Contains instructions on how to use the submit_assessment tool.
+        submit_assessment_tool: The submit_assessment tool schema to append to the tool schema.
+    """
+
+    parameters_schema = {
+        "type": "object",
+        "properties": {
+            "order": {"type": "integer", "minimum": 1},
+            "ell": {"type": "number"},
+            "rbendmin": {"type": "number"},
+            "t1": {"type": "number", "description": "Should be < 0."},
+        },
+        "required": ["order", "ell", "rbendmin", "t1"],
+    }
+
+    if candidates > 1:
+        system_prompt_suffix = f"""Instead of stating the final answer as text, submit it with the "submit_assessment" tool. If several curves are given, assess each of them and submit the assessment of the best curve: state for each "bad" curve criterion whether the curve satisfies it. If the best curve is "bad", give up to {candidates} candidate lists of new optimizer parameters. The candidates are evaluated in parallel and their curves are given together in the next prompt, so choose candidates that explore different changes. If no criterion is satisfied, the curve is "good" and we are done. Submitting the assessment ends the message."""
+        curve = "The best given curve"
+        parameters_property = {
+            "candidates": {
+                "type": "array",
+                "description": f'Up to {candidates} candidate lists of new optimizer parameters. Required if the best curve is "bad".',
+                "items": parameters_schema,
+                "minItems": 1,
+                "maxItems": candidates,
+            }
+        }
+    else:
+        system_prompt_suffix = """Instead of stating the final answer as text, submit it with the "submit_assessment" tool: state for each "bad" curve criterion whether the curve satisfies it, and give the new optimizer parameters if the curve is "bad". If no criterion is satisfied, the curve is "good" and we are done. Submitting the assessment ends the message."""
+        curve = "The curve"
+        parameters_property = {
+            "optimizer_parameters": {
+                **parameters_schema,
+                "description": 'The new optimizer parameters. Required if the curve is "bad".',
+            }
+        }
+
+    submit_assessment_tool = {
+        "name": "submit_assessment",
+        "description": 'Submit the assessment of the given curve and, if the curve is "bad", the new optimizer parameters. This is the final answer of the message.',
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "unrealizable_kinks": {
+                    "type": "boolean",
+                    "description": f"{curve} exhibits an unrealizable deformation, i.e., an abrupt kink.",
+                },
+                "overlapping": {
+                    "type": "boolean",
+                    "description": f"{curve} crosses itself or other parts of the magnet.",
+                },
+                "unreasonable_length": {
+                    "type": "boolean",
+                    "description": f"The length of {curve[0].lower() + curve[1:]} is unreasonably long for the points to be connected.",
+                },
+                "ends_not_smooth": {
+                    "type": "boolean",
+                    "description": f"The connection of {curve[0].lower() + curve[1:]} to the two parts to be connected is not smooth.",
+                },
+                **parameters_property,
+            },
+            "required": [
+                "unrealizable_kinks",
+                "overlapping",
+                "unreasonable_length",
+                "ends_not_smooth",
+            ],
+        },
+    }
+
+    return system_prompt_suffix, submit_assessment_tool
+
+
+def get_repair_prompt(error: str, assessment_tool: bool):
+    """
+    The follow-up prompt asking the LLM to repair an answer that could not be parsed.
+
+    args:
+        error: The reason the answer could not be parsed.
+        assessment_tool: Whether the LLM should answer with the "submit_assessment" tool (see anthropic_submit_assessment_tool).
+    """
+    if assessment_tool:
+        answer = 'submit your final answer again with the "submit_assessment" tool'
+    else:
+        answer = 'state your final answer again, i.e., "DONE" or the new optimizer parameters in the format [order, ell, rbendmin, t1] at the end of the message'
+    return f"""Your answer could not be processed: {error}. Please {answer}, without repeating the analysis."""
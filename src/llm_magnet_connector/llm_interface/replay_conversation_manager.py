@@ -0,0 +1,60 @@
+from .anthropic_conversation_manager import AnthropicConversationManager
+from .cassette import Cassette
+from .request_scheduler import RequestScheduler
+import asyncio
+
+
+class ReplayConversationManager(AnthropicConversationManager):
+    """
+    This class is a subclass of AnthropicConversationManager that serves the responses recorded in a Cassette instead of calling the Anthropic API.
+    Requests are matched by their content (see request_fingerprint), so the conversation must be configured like the recorded one (system prompt, model settings, prompts and images).
+    Token counts are served from the cassette as well, so the context is trimmed like in the recorded conversation. Model latency can be simulated, and is accumulated in model_time so it can be separated from the own overhead.
+    """
+
+    def __init__(
+        self,
+        logger,
+        cassette: Cassette | str,
+        cost_1M_input_tokens,
+        cost_1M_output_tokens,
+        latency: float | str | None = None,
+        **kwargs,
+    ):
+        """
+        Initializes the ReplayConversationManager.
+
+        Args:
+            logger: The logger to use.
+            cassette (Cassette | str): The cassette (or path to the cassette file) to replay.
+            cost_1M_input_tokens (int): The cost of 1M input tokens (USD).
+            cost_1M_output_tokens (int): The cost of 1M output tokens (USD).
+            latency (float | str): Simulated latency per request [s], or "recorded" to use the recorded latency. If None, responses are returned immediately.
+            **kwargs: Further arguments of AnthropicConversationManager, must match the recorded conversation.
+        """
+        # replayed requests are neither rate limited nor retried by the process-wide scheduler
+        kwargs.setdefault("scheduler", RequestScheduler(max_retries=0))
+        super().__init__(
+            logger,
+            cost_1M_input_tokens=cost_1M_input_tokens,
+            cost_1M_output_tokens=cost_1M_output_tokens,
+            **kwargs,
+        )
+        self._replay_cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+        self._latency = latency
+        # total simulated model latency [s]
+        self.model_time = 0.0
+
+    async def _request_message(self, request: dict, on_content_block=None):
+        response, recorded_latency = self._replay_cassette.replay(request)
+        latency = recorded_latency if self._latency == "recorded" else self._latency
+        if latency:
+            await asyncio.sleep(latency)
+            self.model_time += latency
+        if self._stream and on_content_block is not None:
+            for block in response.content:
+                on_content_block(block)
+        return response
+
+    async def _request_token_count(self, request: dict):
+        response, _ = self._replay_cassette.replay(request, endpoint="count_tokens")
+        return response
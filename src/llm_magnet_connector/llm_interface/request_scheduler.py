@@ -0,0 +1,277 @@
+import anthropic
+import asyncio
+import random
+import threading
+import time
+
+# status codes worth retrying: request timeout, conflict, rate limit, server errors and overloaded (529)
+_RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class TokenBucket:
+    """
+    This class is a token bucket refilled continuously at a rate given per minute.
+    The bucket can go into debt: a reservation is always granted immediately and the caller waits until the debt is paid off.
+    This keeps reservations in arrival order without holding a lock while waiting.
+    """
+
+    def __init__(self, capacity_per_minute: float):
+        """
+        Initializes the TokenBucket with a full bucket.
+
+        Args:
+            capacity_per_minute (float): The capacity of the bucket, refilled once per minute.
+        """
+        self.capacity = capacity_per_minute
+        self._rate = capacity_per_minute / 60
+        self._level = capacity_per_minute
+        self._last_refill = time.monotonic()
+
+    def _refill(self, now: float):
+        self._level = min(self.capacity, self._level + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Reserves the given amount and returns the time to wait until the reservation is covered.
+        Amounts above the capacity are capped at the capacity.
+
+        Args:
+            amount (float): The amount to reserve.
+            now (float): The current time (time.monotonic).
+
+        Returns:
+            The time to wait [s].
+        """
+        self._refill(now)
+        self._level -= min(amount, self.capacity)
+        return max(0.0, -self._level / self._rate)
+
+    def refund(self, amount: float):
+        """
+        Returns (or, if negative, additionally consumes) an amount, e.g., if the actual usage differs from the reservation.
+
+        Args:
+            amount (float): The amount to return.
+        """
+        self._level = min(self.capacity, self._level + amount)
+
+
+class RequestScheduler:
+    """
+    This class schedules all outgoing LLM API requests of the process.
+    It enforces requests-per-minute and input/output-tokens-per-minute budgets with token buckets, retries failed requests (rate limit, overloaded, server and connection errors) with jittered exponential backoff, and honors retry-after headers by pausing all requests.
+    Queue depth and wait times are recorded (see metrics).
+
+    The scheduler does not hold an asyncio primitive, so it can be shared by conversations on different event loops.
+    """
+
+    def __init__(
+        self,
+        logger=None,
+        requests_per_minute: float | None = None,
+        input_tokens_per_minute: float | None = None,
+        output_tokens_per_minute: float | None = None,
+        max_retries=8,
+        initial_backoff=1.0,
+        max_backoff=60.0,
+    ):
+        """
+        Initializes the RequestScheduler.
+
+        Args:
+            logger: The logger to use. If None, retries are not logged.
+            requests_per_minute (float): The requests per minute budget. If None, requests are not limited.
+            input_tokens_per_minute (float): The input tokens per minute budget. If None, input tokens are not limited.
+            output_tokens_per_minute (float): The output tokens per minute budget. If None, output tokens are not limited.
+            max_retries (int): The maximum number of retries per request.
+            initial_backoff (float): The backoff before the first retry [s]. Doubled with every retry.
+            max_backoff (float): The maximum backoff [s].
+        """
+        self.logger = logger
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._input_bucket = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute else None
+        self._output_bucket = TokenBucket(output_tokens_per_minute) if output_tokens_per_minute else None
+        self._max_retries = max_retries
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._lock = threading.Lock()
+        # all requests wait until this time (time.monotonic) after a retry-after header
+        self._paused_until = 0.0
+        # metrics
+        self._queue_depth = 0
+        self._max_queue_depth = 0
+        self._requests = 0
+        self._retries = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    async def submit(
+        self,
+        request,
+        input_tokens=0,
+        output_tokens=0,
+        usage=None,
+        rate_limited=True,
+    ):
+        """
+        Sends a request once the budgets allow it and retries it if it fails with a retryable error.
+
+        Args:
+            request (callable): Creates the coroutine sending the request. Called again for every retry.
+            input_tokens (int): The estimated number of input tokens of the request.
+            output_tokens (int): The number of output tokens to reserve (e.g., max_tokens).
+            usage (callable): Optional. Returns the actual (input_tokens, output_tokens) of a result, used to correct the reservations.
+            rate_limited (bool): Whether the request counts against the budgets (e.g., False for token counting requests, which have separate limits). Retries are done in any case.
+
+        Raises:
+            anthropic.APIError: If the request fails with a non-retryable error or the maximum number of retries is exceeded.
+
+        Returns:
+            The result of the request.
+        """
+        attempt = 0
+        while True:
+            await self._wait_for_budget(
+                input_tokens if rate_limited else 0,
+                output_tokens if rate_limited else 0,
+                rate_limited,
+            )
+            try:
+                result = await request()
+            except (anthropic.APIStatusError, anthropic.APIConnectionError) as ex:
+                delay = self._retry_delay(ex, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                    if isinstance(ex, anthropic.APIStatusError) and self._retry_after(ex) is not None:
+                        # the server asks all clients to wait
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if self.logger is not None:
+                    self.logger.warning(
+                        f"Request failed ({self._describe_error(ex)}). Retry {attempt}/{self._max_retries} in {delay:.1f} s."
+                    )
+                await asyncio.sleep(delay)
+                continue
+
+            if rate_limited and usage is not None:
+                actual_input_tokens, actual_output_tokens = usage(result)
+                with self._lock:
+                    if self._input_bucket is not None:
+                        self._input_bucket.refund(input_tokens - actual_input_tokens)
+                    if self._output_bucket is not None:
+                        self._output_bucket.refund(output_tokens - actual_output_tokens)
+            return result
+
+    async def _wait_for_budget(self, input_tokens, output_tokens, rate_limited):
+        """
+        Reserves the budgets for one request and waits until they are available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait_time = max(0.0, self._paused_until - now)
+            if rate_limited:
+                for bucket, amount in (
+                    (self._request_bucket, 1),
+                    (self._input_bucket, input_tokens),
+                    (self._output_bucket, output_tokens),
+                ):
+                    if bucket is not None:
+                        wait_time = max(wait_time, bucket.reserve(amount, now))
+            self._requests += 1
+            self._total_wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            if wait_time > 0:
+                self._queue_depth += 1
+                self._max_queue_depth = max(self._max_queue_depth, self._queue_depth)
+
+        if wait_time > 0:
+            try:
+                await asyncio.sleep(wait_time)
+            finally:
+                with self._lock:
+                    self._queue_depth -= 1
+
+    def _retry_delay(self, ex, attempt: int) -> float | None:
+        """
+        Returns the delay before retrying a failed request, or None if the request should not be retried.
+        """
+        if attempt >= self._max_retries:
+            return None
+        if isinstance(ex, anthropic.APIStatusError):
+            if ex.status_code not in _RETRYABLE_STATUS_CODES:
+                return None
+            retry_after = self._retry_after(ex)
+            if retry_after is not None:
+                return min(retry_after, self._max_backoff)
+        # full jitter: uniform between 0 and the exponential backoff
+        return random.uniform(0, min(self._max_backoff, self._initial_backoff * 2**attempt))
+
+    def _retry_after(self, ex) -> float | None:
+        """
+        Reads the retry-after(-ms) header of an error response [s].
+        """
+        headers = ex.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+        except ValueError:
+            # retry-after as HTTP date is not supported, fall back to backoff
+            pass
+        return None
+
+    def _describe_error(self, ex) -> str:
+        if isinstance(ex, anthropic.APIStatusError):
+            return f"status {ex.status_code}"
+        return type(ex).__name__
+
+    def metrics(self) -> dict:
+        """
+        Returns the metrics of the scheduler.
+
+        Returns:
+            A dict with the current and maximum queue depth (requests waiting for budget), the number of requests and retries, and the total, average and maximum wait time for budget [s].
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._queue_depth,
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "retries": self._retries,
+                "total_wait_time": self._total_wait_time,
+                "average_wait_time": self._total_wait_time / self._requests if self._requests else 0.0,
+                "max_wait_time": self._max_wait_time,
+            }
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_request_scheduler() -> RequestScheduler:
+    """
+    Returns the process-wide RequestScheduler used by conversation managers that are not given a scheduler.
+    Created without budgets (retries only) on first use, see set_request_scheduler.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler()
+        return _default_scheduler
+
+
+def set_request_scheduler(scheduler: RequestScheduler):
+    """
+    Sets the process-wide RequestScheduler, e.g., to configure the budgets of the API quota.
+    Must be called before creating the conversation managers.
+
+    Args:
+        scheduler (RequestScheduler): The scheduler to use.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        _default_scheduler = scheduler
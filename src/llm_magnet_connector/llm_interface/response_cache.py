@@ -0,0 +1,140 @@
+import anthropic
+import hashlib
+import json
+import os
+import threading
+import time
+
+from . import prompts
+from .cassette import request_fingerprint
+
+
+def _prompts_fingerprint() -> str:
+    """
+    Returns the SHA-256 hash of the prompts module, so that cached responses are invalidated if a prompt changes.
+    """
+    with open(prompts.__file__, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class ResponseCache:
+    """
+    This class caches responses of the Messages API on disk, keyed by the content of the request (see request_fingerprint: model, system prompt, tools, thinking configuration and messages, with image data hashed) and the content of the prompts module.
+    Each response is stored in its own file. If the total size exceeds max_bytes, the least recently used responses are removed.
+    Hits and misses are counted (see stats).
+    """
+
+    def __init__(self, directory: str, max_bytes=100_000_000):
+        """
+        Initializes the ResponseCache. Responses cached by earlier runs in the directory are reused.
+
+        Args:
+            directory (str): The directory of the cache. Will be created if it does not exist.
+            max_bytes (int): The maximum total size of the cached responses [bytes]. Defaults to 100 MB.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._prompts_fingerprint = _prompts_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        # key -> size of the cache file [bytes], in least recently used order
+        self._entries = {}
+        files = [
+            entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(".json")
+        ]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self._entries[entry.name[: -len(".json")]] = entry.stat().st_size
+        self._size = sum(self._entries.values())
+
+    def key(self, request: dict) -> str:
+        """
+        Returns the cache key of a request.
+
+        Args:
+            request (dict): The keyword arguments of the request.
+        """
+        return hashlib.sha256(
+            (self._prompts_fingerprint + request_fingerprint(request)).encode()
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, request: dict) -> anthropic.types.Message | None:
+        """
+        Returns the cached response to a request and marks it as recently used.
+
+        Args:
+            request (dict): The keyword arguments of the request.
+
+        Returns:
+            The cached response, or None if the request is not cached.
+        """
+        key = self.key(request)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key)) as file:
+                    data = json.load(file)
+                # the modification time keeps the recency across runs
+                os.utime(self._path(key))
+            except (OSError, ValueError):
+                # removed or corrupted by another process
+                self._size -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries[key] = self._entries.pop(key)
+            self.hits += 1
+        return anthropic.types.Message.model_validate(data["response"])
+
+    def put(self, request: dict, response):
+        """
+        Caches the response to a request and removes the least recently used responses if the cache is too large.
+
+        Args:
+            request (dict): The keyword arguments of the request.
+            response (anthropic.types.Message): The response.
+        """
+        key = self.key(request)
+        data = json.dumps(
+            {"created": time.time(), "response": response.model_dump(mode="json")}
+        )
+        with self._lock:
+            # write to a temporary file first, so that readers never see a partial file
+            temporary_path = self._path(key) + ".tmp"
+            with open(temporary_path, "w") as file:
+                file.write(data)
+            os.replace(temporary_path, self._path(key))
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._size -= self._entries.pop(oldest)
+                self.evictions += 1
+                try:
+                    os.remove(self._path(oldest))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the cache.
+
+        Returns:
+            A dict with the number of hits, misses and evictions, the hit rate, and the number and total size [bytes] of the cached responses.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+            }
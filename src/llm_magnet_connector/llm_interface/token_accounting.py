@@ -0,0 +1,145 @@
+import math
+import re
+
+# pieces the local tokenizer approximation splits text into: words, numbers, and single punctuation characters
+_TEXT_PIECE_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text locally, without calling a tokenizer API.
+    Words are counted as one token per 4 characters (rounded up), numbers as one token per 3 digits and punctuation characters as one token each.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        The estimated number of tokens.
+    """
+    tokens = 0
+    for piece in _TEXT_PIECE_PATTERN.findall(text):
+        if piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 4)
+        elif piece[0].isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estimates the number of tokens of an image using the formula tokens = (width * height) / 750.
+    Images with a long edge above 1568 px or more than ~1.15 megapixels are downscaled by the API before tokenization, which is taken into account.
+
+    Args:
+        width (int): The width of the image [px].
+        height (int): The height of the image [px].
+
+    Returns:
+        The estimated number of tokens.
+    """
+    scale = min(1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height)))
+    return math.ceil(width * height * scale**2 / 750)
+
+
+class ContextTokenAccountant:
+    """
+    This class keeps a token estimate for each functional element of a conversation context, so that the size of the context can be checked without counting the whole context again.
+    The raw (local) estimates are scaled by a calibration factor, which is learned from token counts reported by the API.
+    """
+
+    def __init__(self, calibration_smoothing=0.5):
+        """
+        Initializes the ContextTokenAccountant.
+
+        Args:
+            calibration_smoothing (float): Weight of a new measurement in the exponential moving average of the calibration factor (0 < x <= 1). Defaults to 0.5.
+        """
+        self._element_tokens = []
+        self._raw_total = 0
+        # tokens sent with every request independent of the context (e.g., system prompt and tool schemas)
+        self.overhead_tokens = 0
+        self.calibration_factor = 1.0
+        self._calibration_smoothing = calibration_smoothing
+
+    def add_element(self, tokens: int):
+        """
+        Adds the estimate of a new functional element.
+
+        Args:
+            tokens (int): The raw token estimate of the element.
+        """
+        self._element_tokens.append(tokens)
+        self._raw_total += tokens
+
+    def extend_last(self, tokens: int):
+        """
+        Adds tokens to the most recent functional element.
+
+        Args:
+            tokens (int): The raw token estimate of the added message.
+        """
+        self._element_tokens[-1] += tokens
+        self._raw_total += tokens
+
+    def insert(self, index: int, tokens: int):
+        """
+        Inserts the estimate of a functional element at the given position.
+
+        Args:
+            index (int): The index of the functional element.
+            tokens (int): The raw token estimate of the element.
+        """
+        self._element_tokens.insert(index, tokens)
+        self._raw_total += tokens
+
+    def pop(self, index: int) -> int:
+        """
+        Removes the estimate of a functional element.
+
+        Args:
+            index (int): The index of the functional element.
+
+        Returns:
+            The raw token estimate of the removed element.
+        """
+        tokens = self._element_tokens.pop(index)
+        self._raw_total -= tokens
+        return tokens
+
+    def element_tokens(self, index: int) -> int:
+        """
+        Returns the raw token estimate of a functional element.
+
+        Args:
+            index (int): The index of the functional element.
+        """
+        return self._element_tokens[index]
+
+    def raw_total(self) -> int:
+        """
+        Returns the uncalibrated token estimate of the context including the overhead.
+        """
+        return self._raw_total + self.overhead_tokens
+
+    def estimate(self) -> int:
+        """
+        Returns the calibrated token estimate of the context including the overhead.
+        """
+        return round(self.raw_total() * self.calibration_factor)
+
+    def calibrate(self, raw_estimate: int, actual_tokens: int):
+        """
+        Updates the calibration factor with a token count reported by the API.
+
+        Args:
+            raw_estimate (int): The raw estimate (see raw_total) of the context the count refers to.
+            actual_tokens (int): The token count reported by the API.
+        """
+        if raw_estimate <= 0 or actual_tokens <= 0:
+            return
+        ratio = actual_tokens / raw_estimate
+        self.calibration_factor += self._calibration_smoothing * (
+            ratio - self.calibration_factor
+        )
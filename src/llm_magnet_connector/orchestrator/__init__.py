@@ -1 +1,3 @@
-from .main_orchestrator import MainOrchestrator
\ No newline at end of file
+from .checkpoint import Checkpoint
+from .main_orchestrator import MainOrchestrator, RunResult
+from .scenario_sweep import ScenarioSweep, SweepRun, SweepResult
@@ -0,0 +1,90 @@
+from llm_magnet_connector.utils import timed
+import asyncio
+import json
+import os
+
+
+class Checkpoint:
+    """
+    This class stores the checkpoints of a run in a directory: the latest state in checkpoint.json and the files referenced by it (e.g., the images of the context) in the files directory.
+    Files are written once (existing files are not written again) and checkpoint.json is replaced atomically, so a crash never leaves a partial checkpoint.
+    Checkpoints are written in the background, in the order they are saved.
+    """
+
+    def __init__(self, logger, directory: str):
+        """
+        Initializes the Checkpoint.
+
+        Args:
+            logger: The logger to use.
+            directory (str): The directory of the checkpoint. Will be created if it does not exist.
+        """
+        self.logger = logger
+        self.directory = directory
+        self.files_dir = os.path.join(directory, "files")
+        self._path = os.path.join(directory, "checkpoint.json")
+        self._write_task = None
+        os.makedirs(self.files_dir, exist_ok=True)
+
+    def exists(self) -> bool:
+        """
+        Returns whether a checkpoint was written to the directory.
+        """
+        return os.path.exists(self._path)
+
+    def load(self) -> dict:
+        """
+        Loads the latest checkpoint.
+
+        Raises:
+            FileNotFoundError: If no checkpoint was written to the directory.
+
+        Returns:
+            The state saved with the checkpoint.
+        """
+        with open(self._path) as file:
+            return json.load(file)
+
+    def save(self, state: dict, files: dict):
+        """
+        Starts writing a checkpoint in the background, after the checkpoints saved earlier. Must be called from the event loop; errors are logged.
+
+        Args:
+            state (dict): The JSON-serializable state. Must not be modified afterwards.
+            files (dict): The contents of new files referenced by the state (bytes, or a function returning them, called by the writer thread), by file name.
+        """
+        self._write_task = asyncio.create_task(self._awrite(self._write_task, state, files))
+        self._write_task.add_done_callback(self._on_written)
+
+    async def _awrite(self, previous: asyncio.Task | None, state: dict, files: dict):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        await asyncio.to_thread(self._write, state, files)
+
+    def _write(self, state: dict, files: dict):
+        with timed("checkpoint"):
+            for file_name, data in files.items():
+                path = os.path.join(self.files_dir, file_name)
+                if not os.path.exists(path):
+                    self._write_atomically(path, data() if callable(data) else data)
+            self._write_atomically(self._path, json.dumps(state).encode())
+
+    @staticmethod
+    def _write_atomically(path: str, data: bytes):
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    def _on_written(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"Could not write checkpoint to {self.directory}: {task.exception()!r}")
+
+    async def aflush(self):
+        """
+        Waits until all saved checkpoints are written.
+        """
+        if self._write_task is not None:
+            await asyncio.gather(self._write_task, return_exceptions=True)
@@ -1,15 +1,62 @@
 from llm_magnet_connector.llm_interface import (
     LLMConversationManager,
     LLMResponse,
+    BudgetExceededError,
     get_reprompt,
+    get_candidates_reprompt,
 )
 from llm_magnet_connector.image_generator import ResponseToImage
+from llm_magnet_connector.utils import StageTimer, run_sync, timed, record_metrics, metrics_active
+from .checkpoint import Checkpoint
+from dataclasses import dataclass
+import asyncio
+import time
+
+
+@dataclass
+class RunResult:
+    """
+    This class contains the outcome and resource usage of one run of the MainOrchestrator.
+
+    Attributes:
+        terminated: Whether the LLM stated the conversation as terminated (i.e., found a good curve).
+        iterations: The number of re-prompt iterations.
+        input_tokens: The number of uncached input tokens used.
+        output_tokens: The number of output tokens used.
+        cache_write_tokens: The number of input tokens written to the prompt cache.
+        cache_read_tokens: The number of input tokens read from the prompt cache.
+        cost: The total cost of the run (USD).
+        wall_time: The duration of the run [s].
+        evaluation_cache_hits: The number of curve evaluations taken from the evaluation cache.
+        response_cache_hits: The number of LLM requests answered from the response cache (see ResponseCache).
+        critical_path_time: The mean time from the images of an iteration being available to the re-prompt being sent [s] (see MainOrchestrator.iteration_timings).
+        budget_exhausted: Whether the run was stopped because the next re-prompt exceeded a budget (see BudgetGovernor).
+    """
+    terminated: bool
+    iterations: int
+    input_tokens: int
+    output_tokens: int
+    cache_write_tokens: int
+    cache_read_tokens: int
+    cost: float
+    wall_time: float
+    evaluation_cache_hits: int = 0
+    response_cache_hits: int = 0
+    critical_path_time: float = 0.0
+    budget_exhausted: bool = False
 
 
 class MainOrchestrator:
     """
     This class is the entry point for the LLM Magnet Connector. It prompts the LLM conversation manager with the input prompt and images, passes the response to the image generator, and re-prompts the LLM conversation manager with the generated images.
     This is done until the conversation is finished or the specified number of iterations is reached.
+    If the LLM conversation manager detects the final answer early (streaming), image generation is started speculatively while the rest of the response arrives.
+    If the LLM proposes multiple candidate optimizer parameters per answer, all candidates are evaluated in parallel and presented together in the next re-prompt.
+    If pipelined, the context is prepared for the next re-prompt (trimmed, token estimates, payload size of the context) while the images are being generated, so that only encoding the new images and sending is left once they are available.
+    If a checkpoint directory is given, a checkpoint is written after every response, from which an interrupted run can be resumed (see aresume).
+    If the LLM conversation manager refuses a re-prompt because it exceeds a budget (BudgetExceededError), the run is stopped like at the maximum number of iterations.
+    If a MetricsRecorder is active, a metrics record is emitted per iteration (see _record_iteration), in addition to the records of the API calls emitted by the LLM conversation manager.
+    The orchestrator is asyncio-native (see arun), so one event loop can drive many conversations concurrently. run is a synchronous wrapper.
     """
 
     def __init__(
@@ -17,7 +64,9 @@ class MainOrchestrator:
         llm_manager: LLMConversationManager,
         image_generator: ResponseToImage,
         max_iterations: int,
-        logger
+        logger,
+        pipelined: bool = False,
+        checkpoint_dir: str | None = None,
     ):
         """
         Initializes the MainOrchestrator.
@@ -27,33 +76,193 @@ class MainOrchestrator:
             image_generator (ResponseToImage): The image generator to use.
             max_iterations (int): The maximum number of iterations to run the conversation for (excludes initial prompt).
             logger: The logger to use.
+            pipelined (bool): Whether to prepare the context for the next re-prompt while the images are being generated (see LLMConversationManager.aprepare_prompt).
+            checkpoint_dir (str): The directory for the checkpoints of the run (e.g., a subdirectory of the output directory). If None, no checkpoints are written.
         """
         self._llm_manager = llm_manager
         self._image_generator = image_generator
         self._max_iterations = max_iterations
         self._iteration = 0
         self.logger = logger
+        # (response, state of the image generator before, task) of the image generation started from an early response
+        self._speculative_images = None
+        self._pipelined = pipelined
+        # one dict per re-prompt: iteration and critical path time [s] from the images being available to the re-prompt being sent
+        self.iteration_timings = []
+        self._checkpoint = Checkpoint(logger, checkpoint_dir) if checkpoint_dir is not None else None
+        self._budget_exhausted = False
+        # stages of this run, and the counters at the previous metrics record (see _record_iteration)
+        self._stage_timer = StageTimer()
+        self._metrics_counters = None
+
+    def run(self, initial_prompt: str, initial_images_dir: str) -> RunResult:
+        """
+        Runs the LLM Magnet Connector. Synchronous wrapper around arun.
+
+        Args:
+            initial_prompt (str): The initial prompt to start the conversation with.
+            initial_images_dir (str): The directory where the images for the initial prompt are stored.
 
-    def run(self, initial_prompt: str, initial_images_dir: str):
+        Returns:
+            The outcome and resource usage of the run.
+        """
+        return run_sync(self.arun(initial_prompt, initial_images_dir))
+
+    async def arun(self, initial_prompt: str, initial_images_dir: str) -> RunResult:
         """
         Runs the LLM Magnet Connector.
 
         Args:
             initial_prompt (str): The initial prompt to start the conversation with.
             initial_images_dir (str): The directory where the images for the initial prompt are stored.
+
+        Returns:
+            The outcome and resource usage of the run.
         """
         # TODO add logging
         self.logger.info("Starting conversation...")
+        return await self._execute(self._run_conversation(initial_prompt, initial_images_dir))
+
+    def has_checkpoint(self) -> bool:
+        """
+        Returns whether there is a checkpoint to resume from (see aresume).
+        """
+        return self._checkpoint is not None and self._checkpoint.exists()
+
+    def resume(self) -> RunResult:
+        """
+        Resumes an interrupted run from its checkpoint. Synchronous wrapper around aresume.
+
+        Returns:
+            The outcome and resource usage of the run (usage including the interrupted part).
+        """
+        return run_sync(self.aresume())
+
+    async def aresume(self) -> RunResult:
+        """
+        Resumes an interrupted run from the latest checkpoint in the checkpoint directory: restores the state of the LLM conversation manager and the image generator, and continues with the last response.
+        The LLM conversation manager and the image generator must be configured like the ones of the interrupted run (e.g., the same output directory).
+
+        Raises:
+            ValueError: If there is no checkpoint to resume from.
+
+        Returns:
+            The outcome and resource usage of the run (usage including the interrupted part).
+        """
+        if not self.has_checkpoint():
+            raise ValueError("No checkpoint to resume from.")
+        state = self._checkpoint.load()
+        self._llm_manager.restore_state(state["llm_manager"], self._checkpoint.files_dir)
+        self._image_generator.restore_state(state["image_generator"])
+        self._iteration = state["iteration"]
+        response = LLMResponse.from_dict(state["response"])
+        self.logger.info(f"Resuming conversation at iteration {self._iteration} with answer {response}.")
+        return await self._execute(self._continue_conversation(response))
+
+    async def _execute(self, conversation) -> RunResult:
+        """
+        Executes the conversation and summarizes the outcome and resource usage of the run.
+
+        Args:
+            conversation (coroutine): The conversation, returning whether the LLM stated it as terminated.
+
+        Returns:
+            The outcome and resource usage of the run.
+        """
+        start_time = time.perf_counter()
+        self._metrics_counters = self._counters()
+
+        try:
+            with self._stage_timer.activate():
+                terminated = await conversation
+        finally:
+            # the conversation may end while images for an early response are still being generated
+            if self._speculative_images is not None:
+                self._speculative_images[2].cancel()
+                self._speculative_images = None
+            # images generated in memory and checkpoints are saved in the background
+            await self._image_generator.aflush()
+            if self._checkpoint is not None:
+                await self._checkpoint.aflush()
 
+        self._metrics_counters = None
+        cost_input_tokens = self._llm_manager.usage_input_tokens * self._llm_manager.cost_1M_input_tokens / 1e6
+        cost_output_tokens = self._llm_manager.usage_output_tokens * self._llm_manager.cost_1M_output_tokens / 1e6
+        cost_cache_write_tokens = self._llm_manager.usage_cache_write_tokens * self._llm_manager.cost_1M_cache_write_tokens / 1e6
+        cost_cache_read_tokens = self._llm_manager.usage_cache_read_tokens * self._llm_manager.cost_1M_cache_read_tokens / 1e6
+        # the token prices can change during the run (see BudgetGovernor), the total is accumulated per request
+        cost_total = self._llm_manager.usage_cost
+        self.logger.info(f"Input tokens used: {self._llm_manager.usage_input_tokens} ({round(cost_input_tokens, 2)}$)")
+        self.logger.info(f"Cache write tokens used: {self._llm_manager.usage_cache_write_tokens} ({round(cost_cache_write_tokens, 2)}$)")
+        self.logger.info(f"Cache read tokens used: {self._llm_manager.usage_cache_read_tokens} ({round(cost_cache_read_tokens, 2)}$)")
+        self.logger.info(f"Output tokens used: {self._llm_manager.usage_output_tokens} ({round(cost_output_tokens, 2)}$)")
+        self.logger.info(f"Total cost: {round(cost_total, 2)}$")
+        evaluations = self._image_generator.image_index
+        if evaluations > 0:
+            cache_hits = self._image_generator.evaluation_cache_hits
+            self.logger.info(f"Evaluation cache hits: {cache_hits} of {evaluations} curve evaluations ({round(100 * cache_hits / evaluations)}%)")
+        response_cache_stats = self._llm_manager.response_cache_stats()
+        if response_cache_stats is not None:
+            self.logger.info(f"Response cache hits: {self._llm_manager.response_cache_hits} of {self._llm_manager.response_cache_hits + self._llm_manager.usage_requests} requests, response cache: {response_cache_stats}")
+
+        return RunResult(
+            terminated=terminated,
+            iterations=self._iteration,
+            input_tokens=self._llm_manager.usage_input_tokens,
+            output_tokens=self._llm_manager.usage_output_tokens,
+            cache_write_tokens=self._llm_manager.usage_cache_write_tokens,
+            cache_read_tokens=self._llm_manager.usage_cache_read_tokens,
+            cost=cost_total,
+            wall_time=time.perf_counter() - start_time,
+            evaluation_cache_hits=self._image_generator.evaluation_cache_hits,
+            response_cache_hits=self._llm_manager.response_cache_hits,
+            critical_path_time=(
+                sum(timing["critical_path"] for timing in self.iteration_timings) / len(self.iteration_timings)
+                if self.iteration_timings
+                else 0.0
+            ),
+            budget_exhausted=self._budget_exhausted,
+        )
+
+    async def _run_conversation(self, initial_prompt: str, initial_images_dir: str) -> bool:
+        """
+        Prompts the LLM with the initial prompt and re-prompts it with new images until the conversation is terminated or the maximum number of iterations is reached.
+
+        Args:
+            initial_prompt (str): The initial prompt to start the conversation with.
+            initial_images_dir (str): The directory where the images for the initial prompt are stored.
+
+        Returns:
+            Whether the LLM stated the conversation as terminated.
+        """
         # initial prompt
         self.logger.info(f"Prompting LLM with initial prompt and images in {initial_images_dir}")
-        response = self._llm_manager.prompt(initial_prompt, initial_images_dir)
+        start_time = time.perf_counter()
+        generator_state = self._image_generator.get_state()
+        response = await self._llm_manager.aprompt(
+            initial_prompt, initial_images_dir, on_early_response=self._on_early_response
+        )
+        self._record_iteration(None, response, start_time, 0.0, None)
+        self._save_checkpoint(response, generator_state)
+        return await self._continue_conversation(response)
+
+    async def _continue_conversation(self, response: LLMResponse) -> bool:
+        """
+        Re-prompts the LLM with the images for its latest response until the conversation is terminated or the maximum number of iterations is reached.
+
+        Args:
+            response (LLMResponse): The latest response of the LLM.
 
+        Returns:
+            Whether the LLM stated the conversation as terminated.
+        """
         # re-prompt with new images
         while not self.is_terminated(response):
             self.logger.info(f"Answer: {response}")
-            # generate images
-            images_dir = self._image_generator.response_to_image(response)
+            start_time = time.perf_counter()
+            # generate images (or use the images generated from the early response)
+            images_dirs = await self._generate_images(response)
+            images_time = time.perf_counter()
 
             # re-prompt
             if self._iteration >= self._max_iterations:
@@ -61,20 +270,183 @@ class MainOrchestrator:
                 break
 
             self.logger.info(f"Re-prompting for iteration {self._iteration} / {self._max_iterations-1}.")
-            prompt = get_reprompt(
-                response.optimizer_parameters, self._image_generator.image_index
-            ) 
-            response = self._llm_manager.prompt(prompt, images_dir)
+            candidates = list(
+                zip(
+                    response.candidates,
+                    self._image_generator.candidate_indices,
+                    self._image_generator.repeated_indices,
+                )
+            )
+            for optimizer_params, _, repeated_index in candidates:
+                if repeated_index is not None:
+                    self.logger.info(f"Optimizer parameters {optimizer_params} are a repeat of image index {repeated_index}.")
+            if len(candidates) > 1:
+                prompt = get_candidates_reprompt(candidates)
+                images_dir = images_dirs
+            else:
+                prompt = get_reprompt(*candidates[0])
+                images_dir = images_dirs[0]
+            # taken before images for an early response are generated, which are generated again on resume
+            generator_state = self._image_generator.get_state()
+            try:
+                response = await self._llm_manager.aprompt(
+                    prompt, images_dir, on_early_response=self._on_early_response
+                )
+            except BudgetExceededError as ex:
+                self.logger.warning(f"Stopping the conversation at iteration {self._iteration}: {ex}")
+                self._budget_exhausted = True
+                break
+            critical_path = None
+            if self._llm_manager.request_sent_time is not None:
+                critical_path = self._llm_manager.request_sent_time - images_time
+                self.iteration_timings.append({"iteration": self._iteration, "critical_path": critical_path})
+                self.logger.info(f"Critical path of iteration {self._iteration}: {critical_path * 1000:.1f} ms from images to re-prompt.")
+            self._record_iteration(self._iteration, response, start_time, images_time - start_time, critical_path)
             self._iteration += 1
+            self._save_checkpoint(response, generator_state)
 
-        if self.is_terminated(response):
+        terminated = self.is_terminated(response)
+        if terminated:
             self.logger.info("LLM states conversation as terminated.")
 
         self.logger.info("Conversation finished.")
-        cost_input_tokens = self._llm_manager.usage_input_tokens * self._llm_manager.cost_1M_input_tokens / 1e6
-        cost_output_tokens = self._llm_manager.usage_output_tokens * self._llm_manager.cost_1M_output_tokens / 1e6
-        self.logger.info(f"Input tokens used: {self._llm_manager.usage_input_tokens} ({round(cost_input_tokens, 2)}$)")
-        self.logger.info(f"Output tokens used: {self._llm_manager.usage_output_tokens} ({round(cost_output_tokens, 2)}$)")
+        return terminated
+
+    def _counters(self) -> dict:
+        """
+        Returns the cumulative counters of the run used for the metrics records: usage, cost, sent image data, context evictions and stage durations.
+        """
+        manager = self._llm_manager
+        return {
+            "input_tokens": manager.usage_input_tokens,
+            "output_tokens": manager.usage_output_tokens,
+            "cache_write_tokens": manager.usage_cache_write_tokens,
+            "cache_read_tokens": manager.usage_cache_read_tokens,
+            "cost": manager.usage_cost,
+            "image_bytes": manager.sent_image_bytes,
+            "evictions": manager.evicted_elements,
+            "reductions": manager.context_reductions,
+            "stages": dict(self._stage_timer.totals),
+        }
+
+    def _record_iteration(self, iteration: int | None, response: LLMResponse, start_time: float, image_wait: float, critical_path: float | None):
+        """
+        Emits the metrics record of an iteration, if a MetricsRecorder is active. Usage, cost, sent image data, evictions and stage durations are the differences to the previous record.
+
+        Args:
+            iteration (int): The index of the re-prompt iteration, None for the initial prompt.
+            response (LLMResponse): The response of the iteration.
+            start_time (float): The start of the iteration (time.perf_counter()).
+            image_wait (float): The time spent waiting for the images of the iteration [s].
+            critical_path (float): The time from the images being available to the re-prompt being sent [s], None if unknown.
+        """
+        if not metrics_active():
+            return
+        counters = self._counters()
+        previous, self._metrics_counters = self._metrics_counters, counters
+        stages = {
+            stage: total - previous["stages"].get(stage, 0.0)
+            for stage, total in counters["stages"].items()
+            if total > previous["stages"].get(stage, 0.0)
+        }
+        context_elements, context_tokens = self._llm_manager.context_size()
+        record_metrics(
+            "iteration",
+            run=self.logger.name,
+            iteration=iteration,
+            wall_time=time.perf_counter() - start_time,
+            image_wait_time=image_wait,
+            critical_path_time=critical_path,
+            candidates=len(response.candidates),
+            terminated=self.is_terminated(response),
+            context_elements=context_elements,
+            context_tokens=context_tokens,
+            **{key: value - previous[key] for key, value in counters.items() if key != "stages"},
+            stages=stages,
+        )
+
+    def _save_checkpoint(self, response: LLMResponse, generator_state: dict):
+        """
+        Saves a checkpoint after a response (if a checkpoint directory is set). The checkpoint is written in the background.
+
+        Args:
+            response (LLMResponse): The latest response of the LLM.
+            generator_state (dict): The state of the image generator before the images for the response were generated.
+        """
+        if self._checkpoint is None:
+            return
+        with timed("checkpoint"):
+            llm_manager_state, files = self._llm_manager.get_state()
+            self._checkpoint.save(
+                {
+                    "iteration": self._iteration,
+                    "response": response.to_dict(),
+                    "llm_manager": llm_manager_state,
+                    "image_generator": generator_state,
+                },
+                files,
+            )
+
+    def _on_early_response(self, early_response: LLMResponse):
+        """
+        Callback for the LLM conversation manager. Starts generating the images for a preliminary response in the background.
+
+        Args:
+            early_response (LLMResponse): The preliminary response.
+        """
+        if self.is_terminated(early_response):
+            return
+        self.logger.info(f"Early answer: {early_response}. Starting image generation.")
+        self._speculative_images = (
+            early_response,
+            # restored if the images are discarded (see _response_to_image)
+            self._image_generator.get_state(),
+            asyncio.create_task(self._image_generator.aresponse_to_images(early_response)),
+        )
+
+    async def _generate_images(self, response: LLMResponse) -> list:
+        """
+        Returns the images for the candidates of the given response (see _response_to_image). If pipelined, the context is prepared for the next re-prompt in the meantime.
+
+        Args:
+            response (LLMResponse): The final response from the LLM.
+
+        Returns:
+            The images of the candidates, in the order of the candidates.
+        """
+        if not self._pipelined:
+            return await self._response_to_image(response)
+        images_task = asyncio.create_task(self._response_to_image(response))
+        try:
+            await self._llm_manager.aprepare_prompt()
+        except BaseException:
+            images_task.cancel()
+            raise
+        return await images_task
+
+    async def _response_to_image(self, response: LLMResponse) -> list:
+        """
+        Returns the directories (or, if the image generator works in memory, the ImageBuffers) with the images for the candidates of the given response.
+        Uses the images generated from the early response if it matches the final response, otherwise discards them (see ResponseToImage.adiscard) and generates new images.
+
+        Args:
+            response (LLMResponse): The final response from the LLM.
+
+        Returns:
+            The images of the candidates (see ResponseToImage.aresponse_to_images), in the order of the candidates.
+        """
+        speculative_images, self._speculative_images = self._speculative_images, None
+        if speculative_images is not None:
+            early_response, generator_state, task = speculative_images
+            # wait for the generation in any case, it shares the image index with the next generation
+            images_dirs = await task
+            if early_response.candidates == response.candidates:
+                return images_dirs
+            self.logger.warning(
+                f"Early answer {early_response} differs from final answer {response}. Discarding images in {images_dirs}."
+            )
+            await self._image_generator.adiscard(generator_state)
+        return await self._image_generator.aresponse_to_images(response)
 
     def is_terminated(self, response: LLMResponse) -> bool:
         """
@@ -93,4 +465,7 @@ class MainOrchestrator:
                 and not badness_criteria.unreasonable_length
             ):  # all False
                 terminated = True
+        if response.optimizer_parameters is None:
+            # no new parameters to try
+            terminated = True
         return terminated
@@ -0,0 +1,317 @@
+from llm_magnet_connector.llm_interface import (
+    LLMConversationManager,
+    BudgetGovernor,
+    ResponseCache,
+    OptimizerParameters,
+    get_initial_prompt,
+)
+from llm_magnet_connector.image_generator import ResponseToImage, EvaluationCache, CurveGenerator
+from llm_magnet_connector.utils import MetricsRecorder, run_sync
+from .main_orchestrator import MainOrchestrator, RunResult
+from dataclasses import dataclass, asdict
+import asyncio
+import csv
+import itertools
+import json
+import os
+import time
+from typing import Callable
+
+
+@dataclass
+class SweepRun:
+    """
+    This class describes one run of a sweep, i.e., one connector problem and one set of initial optimizer parameters.
+
+    Attributes:
+        scenario: The directory with the images for the initial prompt of the connector problem.
+        initial_parameters: The optimizer parameters of the initial curve.
+        name: The name of the run, used for its output directory. Generated from the scenario and parameters if None.
+    """
+    scenario: str
+    initial_parameters: OptimizerParameters
+    name: str | None = None
+
+
+@dataclass
+class SweepResult:
+    """
+    This class contains the result of one run of a sweep.
+
+    Attributes:
+        name: The name of the run.
+        scenario: The directory with the images for the initial prompt.
+        initial_parameters: The optimizer parameters of the initial curve.
+        output_dir: The output directory of the run.
+        result: The outcome and resource usage of the run. None if the run failed.
+        error: The error message if the run failed, None otherwise.
+    """
+    name: str
+    scenario: str
+    initial_parameters: OptimizerParameters
+    output_dir: str
+    result: RunResult | None
+    error: str | None = None
+
+
+class ScenarioSweep:
+    """
+    This class runs a MainOrchestrator for each combination of connector problems (scenarios) and initial optimizer parameters.
+    The runs are executed concurrently on one event loop, limited by max_concurrent_runs. Each run gets its own LLM conversation manager and output directory.
+    If a budget governor is given, runs are not started once its total budget is exhausted.
+    The results are aggregated into a summary table, which is logged and written to summary.csv in the output directory.
+    """
+
+    def __init__(
+        self,
+        logger,
+        llm_manager_factory: Callable[[object], LLMConversationManager],
+        output_dir: str,
+        max_iterations=100,
+        max_concurrent_runs=4,
+        initial_prompt_factory: Callable[[OptimizerParameters], str] = get_initial_prompt,
+        evaluation_cache: EvaluationCache | None = None,
+        curve_generator_factory: Callable[[object, str], CurveGenerator] | None = None,
+        in_memory_images=False,
+        pipelined=False,
+        checkpoints=False,
+        metrics: MetricsRecorder | None = None,
+        budget_governor: BudgetGovernor | None = None,
+        response_cache: ResponseCache | None = None,
+    ):
+        """
+        Initializes the ScenarioSweep.
+
+        Args:
+            logger: The logger to use. Each run logs to a child logger named after the run.
+            llm_manager_factory (callable): Creates a new LLMConversationManager for a run, given the logger of the run.
+            output_dir (str): The directory for the outputs of all runs. Will be created if it does not exist.
+            max_iterations (int): The maximum number of iterations per run.
+            max_concurrent_runs (int): The maximum number of runs executed at the same time. Limits the number of parallel requests to the LLM API.
+            initial_prompt_factory (callable): Creates the initial prompt from the initial optimizer parameters. Defaults to get_initial_prompt, which expects the "submit_assessment" tool; use functools.partial(get_initial_prompt, assessment_tool=False) for text answers.
+            evaluation_cache (EvaluationCache): If given, shared by all runs, so that curves already evaluated for a scenario (in this or an earlier sweep) are not generated again.
+            curve_generator_factory (callable): Creates the CurveGenerator for a run, given the logger and the scenario of the run (e.g., NumpyCurveGenerator.from_scenario for fully automated sweeps). If None, the default generator of ResponseToImage is used.
+            in_memory_images (bool): Whether the generated images are passed to the requests in memory and saved in the background (see ResponseToImage).
+            pipelined (bool): Whether the orchestrators prepare the context for the next re-prompt while the images are being generated (see MainOrchestrator).
+            checkpoints (bool): Whether each run writes checkpoints to the subdirectory checkpoint of its output directory. A run with a checkpoint (e.g., of an interrupted sweep) is resumed from it instead of started again.
+            metrics (MetricsRecorder): If given, records the metrics of all runs (per iteration and per API call, see MainOrchestrator), e.g., to a JSONL file.
+            budget_governor (BudgetGovernor): The budget governor shared by the LLM conversation managers of the runs (passed to them by llm_manager_factory). If given, runs not started before its total budget is exhausted are skipped, and the total spent is logged.
+            response_cache (ResponseCache): The response cache shared by the LLM conversation managers of the runs (passed to them by llm_manager_factory). If given, its statistics are logged at the end of the sweep.
+        """
+        self.logger = logger
+        self._llm_manager_factory = llm_manager_factory
+        self._output_dir = output_dir
+        self._max_iterations = max_iterations
+        self._max_concurrent_runs = max_concurrent_runs
+        self._initial_prompt_factory = initial_prompt_factory
+        self._evaluation_cache = evaluation_cache
+        self._curve_generator_factory = curve_generator_factory
+        self._in_memory_images = in_memory_images
+        self._pipelined = pipelined
+        self._checkpoints = checkpoints
+        self._metrics = metrics
+        self._budget_governor = budget_governor
+        self._response_cache = response_cache
+        os.makedirs(output_dir, exist_ok=True)
+
+    @staticmethod
+    def grid(
+        scenarios: list[str], initial_parameters: list[OptimizerParameters]
+    ) -> list[SweepRun]:
+        """
+        Creates the runs for all combinations of scenarios and initial optimizer parameters.
+
+        Args:
+            scenarios ([str]): The directories with the images for the initial prompts.
+            initial_parameters ([OptimizerParameters]): The initial optimizer parameters.
+
+        Returns:
+            The list of runs.
+        """
+        return [
+            SweepRun(scenario, parameters)
+            for scenario, parameters in itertools.product(scenarios, initial_parameters)
+        ]
+
+    @staticmethod
+    def load_runs(path: str) -> list[SweepRun]:
+        """
+        Loads the runs from a JSON file of the form
+        {"scenarios": ["assets/Scenario1", ...], "initial_parameters": [[9, 80, 20, -8], ...]},
+        i.e., the grid of scenarios and initial parameters ([order, ell, rbendmin, t1]).
+
+        Args:
+            path (str): The path to the JSON file.
+
+        Returns:
+            The list of runs.
+        """
+        with open(path) as file:
+            spec = json.load(file)
+        return ScenarioSweep.grid(
+            spec["scenarios"],
+            [OptimizerParameters(*parameters) for parameters in spec["initial_parameters"]],
+        )
+
+    def run(self, runs: list[SweepRun]) -> list[SweepResult]:
+        """
+        Executes all runs. Synchronous wrapper around arun.
+
+        Args:
+            runs ([SweepRun]): The runs to execute.
+
+        Returns:
+            The results in the order of the runs.
+        """
+        return run_sync(self.arun(runs))
+
+    async def arun(self, runs: list[SweepRun]) -> list[SweepResult]:
+        """
+        Executes all runs, at most max_concurrent_runs at a time.
+
+        Args:
+            runs ([SweepRun]): The runs to execute.
+
+        Returns:
+            The results in the order of the runs.
+        """
+        self.logger.info(
+            f"Starting sweep with {len(runs)} runs ({self._max_concurrent_runs} concurrent)."
+        )
+        start_time = time.perf_counter()
+        semaphore = asyncio.Semaphore(self._max_concurrent_runs)
+
+        async def bounded_run(index, run):
+            async with semaphore:
+                return await self._execute_run(index, run)
+
+        if self._metrics is not None:
+            with self._metrics.activate():
+                results = await asyncio.gather(
+                    *(bounded_run(index, run) for index, run in enumerate(runs))
+                )
+        else:
+            results = await asyncio.gather(
+                *(bounded_run(index, run) for index, run in enumerate(runs))
+            )
+
+        self.logger.info(
+            f"Sweep finished after {round(time.perf_counter() - start_time, 1)} s."
+        )
+        if self._evaluation_cache is not None:
+            self.logger.info(f"Evaluation cache: {self._evaluation_cache.stats()}")
+        if self._response_cache is not None:
+            self.logger.info(f"Response cache: {self._response_cache.stats()}")
+        if self._budget_governor is not None:
+            total_budget = self._budget_governor.total_budget
+            self.logger.info(
+                f"Budget: spent {self._budget_governor.spent:.2f}$"
+                + (f" of {total_budget:.2f}$." if total_budget is not None else ".")
+            )
+        self._write_summary(results)
+        return results
+
+    async def _execute_run(self, index: int, run: SweepRun) -> SweepResult:
+        """
+        Executes one run in its own output directory. Errors are logged and recorded in the result instead of aborting the sweep.
+
+        Args:
+            index (int): The index of the run in the sweep.
+            run (SweepRun): The run to execute.
+
+        Returns:
+            The result of the run.
+        """
+        parameters = run.initial_parameters
+        name = run.name or (
+            f"{index:03d}_{os.path.basename(os.path.normpath(run.scenario))}"
+            f"_{parameters.order}_{parameters.ell}_{parameters.rbendmin}_{parameters.t1}"
+        )
+        output_dir = os.path.join(self._output_dir, name)
+        run_logger = self.logger.getChild(name)
+
+        if self._budget_governor is not None and self._budget_governor.exhausted():
+            run_logger.warning(f"Skipping run {name}: the total budget is exhausted.")
+            return SweepResult(
+                name, run.scenario, parameters, output_dir, None, error="Total budget exhausted"
+            )
+
+        try:
+            llm_manager = self._llm_manager_factory(run_logger)
+            curve_generator = (
+                self._curve_generator_factory(run_logger, run.scenario)
+                if self._curve_generator_factory is not None
+                else None
+            )
+            image_generator = ResponseToImage(
+                run_logger,
+                output_dir,
+                curve_generator=curve_generator,
+                scenario=run.scenario,
+                evaluation_cache=self._evaluation_cache,
+                in_memory=self._in_memory_images,
+            )
+            checkpoint_dir = os.path.join(output_dir, "checkpoint") if self._checkpoints else None
+            orchestrator = MainOrchestrator(
+                llm_manager,
+                image_generator,
+                self._max_iterations,
+                run_logger,
+                pipelined=self._pipelined,
+                checkpoint_dir=checkpoint_dir,
+            )
+            if orchestrator.has_checkpoint():
+                result = await orchestrator.aresume()
+            else:
+                result = await orchestrator.arun(
+                    self._initial_prompt_factory(parameters), run.scenario
+                )
+            return SweepResult(name, run.scenario, parameters, output_dir, result)
+        except Exception as ex:
+            run_logger.exception(f"Run {name} failed.")
+            return SweepResult(
+                name, run.scenario, parameters, output_dir, None, error=repr(ex)
+            )
+
+    def _write_summary(self, results: list[SweepResult]):
+        """
+        Logs the summary table of the sweep and writes it to summary.csv in the output directory.
+
+        Args:
+            results ([SweepResult]): The results of the runs.
+        """
+        result_fields = list(RunResult.__dataclass_fields__)
+        header = ["name", "scenario", "initial_parameters"] + result_fields + ["error"]
+        rows = []
+        for sweep_result in results:
+            parameters = sweep_result.initial_parameters
+            run_values = (
+                asdict(sweep_result.result)
+                if sweep_result.result is not None
+                else dict.fromkeys(result_fields, "")
+            )
+            rows.append(
+                [
+                    sweep_result.name,
+                    sweep_result.scenario,
+                    f"[{parameters.order}, {parameters.ell}, {parameters.rbendmin}, {parameters.t1}]",
+                ]
+                + [
+                    round(value, 3) if isinstance(value, float) else value
+                    for value in run_values.values()
+                ]
+                + [sweep_result.error or ""]
+            )
+
+        summary_path = os.path.join(self._output_dir, "summary.csv")
+        with open(summary_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+        # log as aligned table
+        table = [header] + [[str(value) for value in row] for row in rows]
+        widths = [max(len(row[column]) for row in table) for column in range(len(header))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in table]
+        self.logger.info("Sweep summary:\n" + "\n".join(lines))
+        self.logger.info(f"Sweep summary written to {summary_path}")
@@ -0,0 +1 @@
+from .fake_anthropic_server import FakeAnthropicServer
@@ -0,0 +1,280 @@
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import datetime
+import itertools
+import json
+import threading
+import time
+
+_ERROR_TYPES = {
+    429: "rate_limit_error",
+    500: "api_error",
+    529: "overloaded_error",
+}
+
+
+class FakeAnthropicServer:
+    """
+    This class is a local stand-in for the Anthropic Messages API, used to exercise the conversation managers without the live API.
+    It serves scripted text responses (also as server-sent events when streaming is requested), answers token counting requests with a rough estimate, accepts file uploads and deletions (Files API), and can inject error responses (e.g., 429 or 529 with retry-after headers).
+    All received message requests and uploaded files are recorded.
+
+    Usage:
+        with FakeAnthropicServer(responses=["[9, 80, 20, -8]", "DONE"], faults=[(429, 1)]) as server:
+            manager = AnthropicConversationManager(..., base_url=server.base_url)
+    """
+
+    def __init__(self, responses=None, faults=None, latency=0.0, files_api=True, upload_faults=None):
+        """
+        Initializes the FakeAnthropicServer.
+
+        Args:
+            responses: The responses, either a list (the last response is repeated once the list is exhausted) or a callable taking the request body (dict) and returning the response. A response is a text, or a dict {"text": ..., "tool_use": {"name": ..., "input": {...}}} for a response with an (optional) text and a tool use (or a list of tool uses). The dict can override the "stop_reason", e.g., "max_tokens" for a response cut off in a tool use. Defaults to "DONE".
+            faults: List of (status_code, retry_after) tuples. Each of the next requests to /v1/messages fails with the given status code; retry_after [s] is sent as header if not None.
+            latency (float): Delay before each response [s].
+            files_api (bool): Whether file uploads are accepted. If False, uploads fail with 404 (e.g., to test the fallback to inline images).
+            upload_faults: List of (status_code, retry_after) tuples like faults, for the next file uploads.
+        """
+        self._responses = responses if responses is not None else ["DONE"]
+        self._faults = list(faults or [])
+        self._latency = latency
+        self._files_api = files_api
+        self._upload_faults = list(upload_faults or [])
+        self._file_ids = itertools.count()
+        self._response_index = 0
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count()
+        self.requests = []
+        self.token_count_requests = 0
+        # file id -> dict with filename, mime_type and data of the uploaded file
+        self.files = {}
+        self.request_sizes = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        """
+        The base URL of the running server.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Starts the server on a free local port in a background thread.
+        """
+        fake_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers.get("content-length", 0)))
+                if self.headers.get("content-type", "").startswith("multipart/form-data"):
+                    fake_server._handle_upload(self, data)
+                else:
+                    fake_server._handle(self, json.loads(data or b"{}"), len(data))
+
+            def do_DELETE(self):
+                fake_server._handle_delete(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def inject_faults(self, faults):
+        """
+        Adds faults for the next requests to /v1/messages.
+
+        Args:
+            faults: List of (status_code, retry_after) tuples, see __init__.
+        """
+        with self._lock:
+            self._faults.extend(faults)
+
+    def _handle_upload(self, handler, data):
+        if handler.path.split("?")[0] != "/v1/files" or not self._files_api:
+            self._send_json(handler, 404, {"type": "error", "error": {"type": "not_found_error", "message": handler.path}})
+            return
+        with self._lock:
+            fault = self._upload_faults.pop(0) if self._upload_faults else None
+        if fault is not None:
+            self._send_error(handler, *fault)
+            return
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"content-type: {handler.headers['content-type']}\r\n\r\n".encode() + data
+        )
+        part = next(part for part in message.iter_parts() if part.get_param("name", header="content-disposition") == "file")
+        content = part.get_payload(decode=True)
+        with self._lock:
+            file_id = f"file_fake_{next(self._file_ids)}"
+            self.files[file_id] = {
+                "filename": part.get_filename(),
+                "mime_type": part.get_content_type(),
+                "data": content,
+            }
+        self._send_json(
+            handler,
+            200,
+            {
+                "id": file_id,
+                "type": "file",
+                "filename": part.get_filename(),
+                "mime_type": part.get_content_type(),
+                "size_bytes": len(content),
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "downloadable": False,
+            },
+        )
+
+    def _handle_delete(self, handler):
+        path = handler.path.split("?")[0]
+        file_id = path.removeprefix("/v1/files/")
+        with self._lock:
+            deleted = path.startswith("/v1/files/") and self.files.pop(file_id, None) is not None
+        if deleted:
+            self._send_json(handler, 200, {"id": file_id, "type": "file_deleted"})
+        else:
+            self._send_json(handler, 404, {"type": "error", "error": {"type": "not_found_error", "message": path}})
+
+    def _handle(self, handler, body, size=0):
+        path = handler.path.split("?")[0]
+        if path == "/v1/messages/count_tokens":
+            with self._lock:
+                self.token_count_requests += 1
+            self._send_json(handler, 200, {"input_tokens": self._estimate_input_tokens(body)})
+        elif path == "/v1/messages":
+            with self._lock:
+                fault = self._faults.pop(0) if self._faults else None
+                if fault is None:
+                    self.requests.append(body)
+                    self.request_sizes.append(size)
+                    answer = self._next_answer(body)
+            if self._latency:
+                time.sleep(self._latency)
+            if fault is not None:
+                self._send_error(handler, *fault)
+            elif body.get("stream"):
+                self._send_stream(handler, body, answer)
+            else:
+                self._send_json(handler, 200, self._message(body, answer))
+        else:
+            self._send_json(handler, 404, {"type": "error", "error": {"type": "not_found_error", "message": path}})
+
+    def _next_answer(self, body):
+        if callable(self._responses):
+            return self._responses(body)
+        answer = self._responses[min(self._response_index, len(self._responses) - 1)]
+        self._response_index += 1
+        return answer
+
+    def _estimate_input_tokens(self, body) -> int:
+        # rough estimate: 4 characters per text token, 1000 tokens per image
+        tokens = len(json.dumps(body.get("system", ""))) // 4
+        for message in body.get("messages", []):
+            content = message["content"]
+            if isinstance(content, str):
+                tokens += len(content) // 4
+                continue
+            for block in content:
+                if block.get("type") == "image":
+                    tokens += 1000
+                else:
+                    tokens += len(json.dumps(block)) // 4
+        return tokens
+
+    def _message(self, body, answer) -> dict:
+        if isinstance(answer, str):
+            answer = {"text": answer}
+        content = []
+        if answer.get("text"):
+            content.append({"type": "text", "text": answer["text"]})
+        tool_uses = answer.get("tool_use") or []
+        if isinstance(tool_uses, dict):
+            tool_uses = [tool_uses]
+        for tool_use in tool_uses:
+            content.append(
+                {
+                    "type": "tool_use",
+                    "id": f"toolu_fake_{next(self._message_ids)}",
+                    "name": tool_use["name"],
+                    "input": tool_use["input"],
+                }
+            )
+        return {
+            "id": f"msg_fake_{next(self._message_ids)}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "content": content,
+            "stop_reason": answer.get("stop_reason", "tool_use" if tool_uses else "end_turn"),
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": self._estimate_input_tokens(body),
+                "output_tokens": max(1, len(json.dumps(content)) // 4),
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0,
+            },
+        }
+
+    def _send_json(self, handler, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("content-type", "application/json")
+        handler.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _send_error(self, handler, status, retry_after=None):
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        error = {"type": _ERROR_TYPES.get(status, "api_error"), "message": f"Injected fault {status}"}
+        self._send_json(handler, status, {"type": "error", "error": error}, headers)
+
+    def _send_stream(self, handler, body, answer):
+        message = self._message(body, answer)
+        content = message.pop("content")
+        handler.send_response(200)
+        handler.send_header("content-type", "text/event-stream")
+        handler.send_header("cache-control", "no-cache")
+        handler.end_headers()
+
+        def send_event(event_type, data):
+            data["type"] = event_type
+            handler.wfile.write(f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode())
+            handler.wfile.flush()
+
+        output_tokens = message["usage"]["output_tokens"]
+        send_event("message_start", {"message": {**message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 1}}})
+        for index, block in enumerate(content):
+            # deliver text and tool input in chunks of 40 characters
+            if block["type"] == "text":
+                send_event("content_block_start", {"index": index, "content_block": {"type": "text", "text": ""}})
+                for start in range(0, len(block["text"]), 40):
+                    send_event("content_block_delta", {"index": index, "delta": {"type": "text_delta", "text": block["text"][start : start + 40]}})
+            else:
+                send_event("content_block_start", {"index": index, "content_block": {**block, "input": {}}})
+                partial_json = json.dumps(block["input"])
+                for start in range(0, len(partial_json), 40):
+                    send_event("content_block_delta", {"index": index, "delta": {"type": "input_json_delta", "partial_json": partial_json[start : start + 40]}})
+            send_event("content_block_stop", {"index": index})
+        send_event("message_delta", {"delta": {"stop_reason": message["stop_reason"], "stop_sequence": None}, "usage": {"output_tokens": output_tokens}})
+        send_event("message_stop", {})
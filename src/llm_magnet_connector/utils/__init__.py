@@ -1 +1,4 @@
-from .logger import create_logger
\ No newline at end of file
+from .logger import create_logger, create_queue_handler
+from .async_utils import run_sync
+from .timing import StageTimer, timed
+from .metrics import MetricsRecorder, record_metrics, metrics_active
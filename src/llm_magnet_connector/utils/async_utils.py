@@ -0,0 +1,25 @@
+import asyncio
+import threading
+
+_thread_local = threading.local()
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion on a persistent event loop of the calling thread.
+    Used by the synchronous wrappers around the asyncio-native API. Reusing one loop per thread keeps objects bound to an event loop (e.g., the connection pool of the async Anthropic client) valid across calls.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Raises:
+        RuntimeError: If called from a running event loop. Await the asyncio-native method instead.
+
+    Returns:
+        The result of the coroutine.
+    """
+    loop = getattr(_thread_local, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_local.loop = loop
+    return loop.run_until_complete(coroutine)
@@ -1,53 +1,108 @@
 import logging
+import logging.handlers
+import atexit
+import queue
 import sys
 import os
-import copy
 from datetime import datetime
 
+_OMITTED_IMAGE_DATA = "[OMITTED: image data removed for logging]"
+
+
+def _redact_image_data(value):
+    """
+    Returns the value with the data of all base64 sources (e.g., image blocks) replaced by a placeholder.
+    Only the dicts, lists and tuples on the way are copied; image data and all other values are shared with the original, so the cost does not depend on the size of the images.
+    """
+    if isinstance(value, dict):
+        if value.get("type") == "base64" and "data" in value:
+            return {**value, "data": _OMITTED_IMAGE_DATA}
+        return {key: _redact_image_data(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact_image_data(item) for item in value]
+    if type(value) is tuple:
+        return tuple(_redact_image_data(item) for item in value)
+    return value
+
 
 def _sanitize_anthropic_debug(record):
     """
     Sanitizes the debug messages from the Anthropic client by removing image data from the logs.
-    A deep copy of the record is made to avoid modifying the original record.
+    The original record is not modified; the returned record shares everything but the containers of its arguments with it.
     """
     try:
-        if not record.args or not record.msg:
-            return record
-
-        if record.msg == "Request options: %s":
-            # create a deep copy of the record to avoid modifying the original record
-            record_copy = record.__dict__.copy()
-            record_copy["args"] = copy.deepcopy(record.args)
-
-            messages = record_copy["args"]["json_data"]["messages"]
-            for msg in messages:
-                if isinstance(msg, dict) and "content" in msg:
-                    for content in msg["content"]:
-                        if content.get("type") == "image" and "source" in content:
-                            content["source"][
-                                "data"
-                            ] = "[OMITTED: image data removed for logging]"
-
-            return logging.makeLogRecord(record_copy)
-        else:
-            return record
+        if (
+            record.name.startswith("anthropic")
+            and record.levelno == logging.DEBUG
+            and record.args
+            and not getattr(record, "image_data_redacted", False)
+        ):
+            return logging.makeLogRecord(
+                {**record.__dict__, "args": _redact_image_data(record.args), "image_data_redacted": True}
+            )
+        return record
     except Exception:
         return record
 
 
 class SanitizingFormatter(logging.Formatter):
     """
-    Custom logging formatter that sanitizes Anthropic DEBUG messages by removing image data.
+    Custom logging formatter that sanitizes Anthropic DEBUG messages by removing image data, and optionally truncates long messages (e.g., requests or responses logged at DEBUG level).
     """
 
+    def __init__(self, fmt=None, datefmt=None, max_message_length: int | None = None):
+        """
+        Initializes the SanitizingFormatter.
+
+        Args:
+            fmt (str): The format of the records (see logging.Formatter).
+            datefmt (str): The format of the date (see logging.Formatter).
+            max_message_length (int): Messages longer than this are truncated. If None, messages are not truncated.
+        """
+        super().__init__(fmt, datefmt)
+        self._max_message_length = max_message_length
+
     def format(self, record):
-        if record.name == "anthropic._base_client" and record.levelno == logging.DEBUG:
-            record_sanitized = _sanitize_anthropic_debug(record)
-            return super().format(record_sanitized)
-        return super().format(record)
+        return super().format(_sanitize_anthropic_debug(record))
+
+    def formatMessage(self, record):
+        length = len(record.message)
+        if self._max_message_length is not None and length > self._max_message_length:
+            record.message = (
+                f"{record.message[: self._max_message_length]}... [{length - self._max_message_length} characters truncated]"
+            )
+        return super().formatMessage(record)
 
 
-def create_logger(log_dir="logs", console_level=logging.INFO):
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler leaving the formatting of the records to the handlers of the listener thread.
+    The stdlib QueueHandler formats every record in the logging thread (so it can be pickled); within one process, only the image data is redacted here, so the arguments of the record do not hold on to the images.
+    Objects passed as log arguments must not be modified after logging.
+    """
+
+    def prepare(self, record):
+        return _sanitize_anthropic_debug(record)
+
+
+def create_queue_handler(*handlers: logging.Handler) -> tuple[logging.Handler, logging.handlers.QueueListener]:
+    """
+    Creates a handler that puts the records into a queue, and a started listener passing them to the given handlers in a background thread.
+    Formatting and writing the records thus does not block the logging thread (e.g., the event loop).
+
+    Args:
+        *handlers (logging.Handler): The handlers of the listener. Their levels are respected.
+
+    Returns:
+        The queue handler and the listener. listener.stop() processes the remaining records and stops the thread.
+    """
+    record_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(record_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return _DeferredQueueHandler(record_queue), listener
+
+
+def create_logger(log_dir="logs", console_level=logging.INFO, asynchronous=True, max_message_length=20_000):
     """
     Creates a logger that logs messages to a timestamped file and optionally to the console.
     In Anthropic DEBUG messages, all image blocks are replaced by placeholders.
@@ -55,6 +110,8 @@ def create_logger(log_dir="logs", console_level=logging.INFO):
     Args:
         log_dir (str): Directory to store the log files. Default is 'logs'.
         console_level (int): Logging level for the console. Default is logging.INFO.
+        asynchronous (bool): Whether the records are formatted and written in a background thread (see create_queue_handler). The thread is stopped at exit. Default is True.
+        max_message_length (int): Messages longer than this are truncated (e.g., requests logged by the Anthropic client at DEBUG level). If None, messages are not truncated. Default is 20000.
 
     Returns:
         logging.Logger: Configured logger instance.
@@ -73,20 +130,28 @@ def create_logger(log_dir="logs", console_level=logging.INFO):
 
     # Formatter
     formatter = SanitizingFormatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        max_message_length=max_message_length,
     )
 
     # File handler (logs everything)
     file_handler = logging.FileHandler(log_filename)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(console_level)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+
+    if asynchronous:
+        queue_handler, listener = create_queue_handler(file_handler, console_handler)
+        logger.addHandler(queue_handler)
+        # write the remaining records at exit
+        atexit.register(listener.stop)
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
 
     return logger
 
@@ -0,0 +1,147 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import contextvars
+import json
+import os
+import threading
+import time
+
+# the MetricsRecorders that record_metrics() records to in the current context (propagates to asyncio tasks and to_thread workers)
+_current_metrics_recorders = contextvars.ContextVar("current_metrics_recorders", default=())
+
+_PROMETHEUS_PREFIX = "llm_magnet_connector"
+
+
+class MetricsRecorder:
+    """
+    This class collects structured metrics records, e.g., one per API call ("api_call") and one per iteration ("iteration").
+    Code emits records with record_metrics(); they are recorded by the MetricsRecorders activated in the current context.
+    Each record is appended as one JSON line to the JSONL file. Optionally, aggregates (counters and sums per kind, endpoint and stage) are written to a Prometheus textfile (e.g., for the textfile collector of the node exporter), replaced atomically after every iteration.
+    """
+
+    def __init__(self, jsonl_path: str | None = None, prometheus_path: str | None = None, labels: dict | None = None):
+        """
+        Initializes the MetricsRecorder.
+
+        Args:
+            jsonl_path (str): The JSONL file the records are appended to. If None, the records are not written.
+            prometheus_path (str): The Prometheus textfile. If None, no textfile is written.
+            labels (dict): Labels added to every record and Prometheus series (e.g., {"sweep": "2025-06"}).
+        """
+        self._jsonl_path = jsonl_path
+        self._prometheus_path = prometheus_path
+        self._labels = dict(labels or {})
+        self._lock = threading.Lock()
+        self._file = None
+        if jsonl_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+            self._file = open(jsonl_path, "a")
+        # (name, labels) -> value of the Prometheus series
+        self._series = defaultdict(float)
+        self._gauges = {}
+        self.records = 0
+
+    @contextmanager
+    def activate(self):
+        """
+        Context manager activating this recorder for the current context, i.e., record_metrics() records to this recorder (in addition to the recorders activated before).
+        """
+        token = _current_metrics_recorders.set(_current_metrics_recorders.get() + (self,))
+        try:
+            yield self
+        finally:
+            _current_metrics_recorders.reset(token)
+
+    def record(self, kind: str, **fields):
+        """
+        Records one metrics record.
+
+        Args:
+            kind (str): The kind of the record, e.g., "api_call" or "iteration".
+            **fields: The JSON-serializable values of the record.
+        """
+        record = {"kind": kind, "time": time.time(), **self._labels, **fields}
+        with self._lock:
+            self.records += 1
+            if self._file is not None:
+                self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+            if self._prometheus_path is not None:
+                self._aggregate(kind, fields)
+                if kind == "iteration":
+                    self._write_prometheus()
+
+    def _aggregate(self, kind: str, fields: dict):
+        """
+        Adds a record to the Prometheus series: a counter per kind (and endpoint), sums of the durations, counters of tokens and bytes, and gauges of the context size.
+        """
+        labels = {"endpoint": fields["endpoint"]} if "endpoint" in fields else {}
+        self._add(f"{kind}s_total", labels, 1)
+        for field, value in fields.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if field.startswith("context_"):
+                # the size of the context is a state (per run), not a count
+                run = (("run", fields["run"]),) if "run" in fields else ()
+                self._gauges[(f"{kind}_{field}", run)] = value
+            elif field.endswith("_time") or field == "latency":
+                self._add(f"{kind}_{field}_seconds_total", labels, value)
+            elif field == "cost":
+                self._add(f"{kind}_cost_dollars_total", labels, value)
+            elif field.endswith(("_tokens", "_bytes")) or field in ("evictions", "reductions"):
+                self._add(f"{kind}_{field}_total", labels, value)
+        for stage, duration in fields.get("stages", {}).items():
+            self._add(f"{kind}_stage_seconds_total", {"stage": stage}, duration)
+
+    def _add(self, name: str, labels: dict, value: float):
+        self._series[(name, tuple(sorted(labels.items())))] += value
+
+    def _write_prometheus(self):
+        """
+        Writes the Prometheus series to the textfile, replacing it atomically.
+        """
+        lines = []
+        for kind, series in (("counter", self._series), ("gauge", self._gauges)):
+            names = sorted({name for name, _ in series})
+            for name in names:
+                lines.append(f"# TYPE {_PROMETHEUS_PREFIX}_{name} {kind}")
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name != name:
+                        continue
+                    all_labels = {**self._labels, **dict(labels)}
+                    label_text = ",".join(f'{key}="{value_}"' for key, value_ in all_labels.items())
+                    lines.append(f"{_PROMETHEUS_PREFIX}_{name}{{{label_text}}} {float(value)!r}")
+        temporary_path = self._prometheus_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, self._prometheus_path)
+
+    def close(self):
+        """
+        Writes the Prometheus textfile (if set) and closes the JSONL file.
+        """
+        with self._lock:
+            if self._prometheus_path is not None:
+                self._write_prometheus()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def record_metrics(kind: str, **fields):
+    """
+    Emits a metrics record to the active MetricsRecorders, if any (see MetricsRecorder.record).
+
+    Args:
+        kind (str): The kind of the record, e.g., "api_call" or "iteration".
+        **fields: The JSON-serializable values of the record.
+    """
+    for recorder in _current_metrics_recorders.get():
+        recorder.record(kind, **fields)
+
+
+def metrics_active() -> bool:
+    """
+    Returns whether a MetricsRecorder is active in the current context, e.g., to skip collecting values only needed for records.
+    """
+    return bool(_current_metrics_recorders.get())
@@ -0,0 +1,77 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import contextvars
+import time
+
+# the StageTimers that timed() records to in the current context (propagates to asyncio tasks and to_thread workers)
+_current_stage_timers = contextvars.ContextVar("current_stage_timers", default=())
+
+
+class StageTimer:
+    """
+    This class accumulates the time spent in named stages of the pipeline (e.g., "image_encoding").
+    Code marks its stages with timed(); the durations are recorded by all StageTimers activated in the current context (e.g., one for a benchmark and one per run).
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, stage: str, duration: float):
+        """
+        Records the duration of one execution of a stage.
+
+        Args:
+            stage (str): The name of the stage.
+            duration (float): The duration [s].
+        """
+        self.totals[stage] += duration
+        self.counts[stage] += 1
+
+    @contextmanager
+    def activate(self):
+        """
+        Context manager activating this timer for the current context, i.e., timed() records to this timer (in addition to the timers activated before).
+        """
+        token = _current_stage_timers.set(_current_stage_timers.get() + (self,))
+        try:
+            yield self
+        finally:
+            _current_stage_timers.reset(token)
+
+    def summary(self) -> dict:
+        """
+        Returns the recorded stages.
+
+        Returns:
+            A dict mapping each stage to its total duration [s], number of executions and mean duration [s].
+        """
+        return {
+            stage: {
+                "total": total,
+                "count": self.counts[stage],
+                "mean": total / self.counts[stage],
+            }
+            for stage, total in sorted(self.totals.items())
+        }
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Context manager marking a stage. The duration is recorded by the active StageTimers, if any.
+
+    Args:
+        stage (str): The name of the stage.
+    """
+    timers = _current_stage_timers.get()
+    if not timers:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        for timer in timers:
+            timer.add(stage, duration)
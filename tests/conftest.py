@@ -0,0 +1,22 @@
+import logging
+
+import pytest
+
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    # requests only go to the local fake server
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+
+
+@pytest.fixture
+def logger():
+    return logging.getLogger("tests")
+
+
+@pytest.fixture
+def server():
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"]) as server:
+        yield server
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from llm_magnet_connector.image_generator._annotate_imgs import (
+    _TEXT_COLOR,
+    _white_pixel_counts,
+    aannotate_images,
+    annotate_images,
+)
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets")
+SCENARIOS = ["Scenario1", "Scenario2", "Initial_prompt"]
+
+
+def copy_images(scenario, directory):
+    """
+    Copies the images of an asset directory, with lowercase extensions (only *.png files are annotated).
+    """
+    os.makedirs(directory)
+    for file_name in os.listdir(os.path.join(ASSETS_DIR, scenario)):
+        name, extension = os.path.splitext(file_name)
+        if extension.lower() == ".png":
+            shutil.copyfile(os.path.join(ASSETS_DIR, scenario, file_name), os.path.join(directory, f"{name}.png"))
+    return directory
+
+
+def read_pixels(directory):
+    pixels = {}
+    for file_name in sorted(os.listdir(directory)):
+        with Image.open(os.path.join(directory, file_name)) as image:
+            pixels[file_name] = np.asarray(image)
+    return pixels
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_parallel_annotation_matches_sequential(tmp_path, scenario):
+    input_dir = copy_images(scenario, str(tmp_path / "input"))
+    annotate_images(input_dir, str(tmp_path / "sequential"), max_workers=1)
+    annotate_images(input_dir, str(tmp_path / "default"))
+    annotate_images(input_dir, str(tmp_path / "parallel"), max_workers=4)
+    asyncio.run(aannotate_images(input_dir, str(tmp_path / "async")))
+
+    sequential = read_pixels(tmp_path / "sequential")
+    assert sorted(sequential) == sorted(os.listdir(input_dir))
+    assert len(sequential) >= 4
+    for variant in ["default", "parallel", "async"]:
+        annotated = read_pixels(tmp_path / variant)
+        assert sorted(annotated) == sorted(sequential)
+        for file_name, pixels in sequential.items():
+            np.testing.assert_array_equal(annotated[file_name], pixels, err_msg=f"{variant}: {file_name}")
+
+    # every image is labelled in red
+    for pixels in sequential.values():
+        assert np.all(pixels[..., :3] == _TEXT_COLOR, axis=-1).any()
+
+
+def test_white_pixel_counts_match_direct_counting():
+    generator = np.random.default_rng(0)
+    pixels = np.where(generator.random((120, 90, 1)) < 0.7, 255, 0).astype(np.uint8).repeat(3, axis=2)
+    pixels[5, 5] = (255, 255, 254)
+    image = Image.fromarray(pixels)
+    boxes = {
+        "top_left": (0, 0, 30, 20),
+        "bottom_right": (60, 100, 90, 120),
+        "middle": (10, 50, 70, 61),
+        # parts outside the image are not counted
+        "outside": (-10, -10, 20, 15),
+    }
+    white = np.all(pixels == 255, axis=-1)
+    expected = {
+        name: int(white[max(top, 0) : bottom, max(left, 0) : right].sum())
+        for name, (left, top, right, bottom) in boxes.items()
+    }
+    assert _white_pixel_counts(image, boxes) == expected
+    assert _white_pixel_counts(image.convert("L"), boxes)["middle"] == expected["middle"]
@@ -0,0 +1,155 @@
+import pytest
+
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    BadnessCriteria,
+    OptimizerParameters,
+    RequestScheduler,
+)
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+CRITERIA = ["unrealizable_kinks", "overlapping", "unreasonable_length", "ends_not_smooth"]
+BAD = {
+    "unrealizable_kinks": True,
+    "overlapping": False,
+    "unreasonable_length": False,
+    "ends_not_smooth": True,
+    "optimizer_parameters": {"order": 9, "ell": 85, "rbendmin": 20, "t1": -8},
+}
+GOOD = dict.fromkeys(CRITERIA, False)
+# "bad" without new optimizer parameters
+INVALID = {**dict.fromkeys(CRITERIA, False), "overlapping": True}
+
+
+def submit(assessment):
+    return {"name": "submit_assessment", "input": assessment}
+
+
+def create_manager(logger, server, **options):
+    return AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=RequestScheduler(logger, max_retries=0),
+        base_url=server.base_url,
+        **options,
+    )
+
+
+def last_user_content(request):
+    return request["messages"][-1]["content"]
+
+
+def test_valid_assessment(logger):
+    with FakeAnthropicServer(responses=[{"text": "Analysis.", "tool_use": submit(BAD)}, {"tool_use": submit(GOOD)}]) as server:
+        manager = create_manager(logger, server)
+        response = manager.prompt("Analyse the curve.", None)
+        good_response = manager.prompt("Analyse the next curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 85, 20, -8)
+    assert response.badnessCriteria == BadnessCriteria(True, False, False, True)
+    assert good_response.optimizer_parameters is None
+    assert good_response.badnessCriteria == BadnessCriteria(False, False, False, False)
+    # the tool use is closed with a tool result before the next query
+    messages = server.requests[-1]["messages"]
+    assert messages[2]["content"][0]["type"] == "tool_result"
+    assert messages[2]["content"][0].get("is_error") is None
+    assert len(server.requests) == 2
+
+
+def test_invalid_assessment_is_repaired(logger):
+    with FakeAnthropicServer(responses=[{"tool_use": submit(INVALID)}, {"tool_use": submit(BAD)}]) as server:
+        response = create_manager(logger, server).prompt("Analyse the curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 85, 20, -8)
+    assert len(server.requests) == 2
+    (tool_result,) = last_user_content(server.requests[1])
+    assert tool_result["type"] == "tool_result"
+    assert tool_result["is_error"] is True
+    assert "no optimizer_parameters were given" in tool_result["content"]
+    assert "submit_assessment" in tool_result["content"]
+
+
+@pytest.mark.parametrize(
+    "parameters",
+    [{"order": 0, "ell": 85, "rbendmin": 20, "t1": -8}, {"order": 9, "ell": "long", "rbendmin": 20, "t1": -8}, {"ell": 85}],
+)
+def test_invalid_parameters_are_repaired(logger, parameters):
+    with FakeAnthropicServer(responses=[{"tool_use": submit({**BAD, "optimizer_parameters": parameters})}, {"tool_use": submit(BAD)}]) as server:
+        response = create_manager(logger, server).prompt("Analyse the curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 85, 20, -8)
+    assert last_user_content(server.requests[1])[0]["is_error"] is True
+
+
+def test_exhausted_repairs_raise(logger):
+    with FakeAnthropicServer(responses=[{"tool_use": submit(INVALID)}]) as server:
+        with pytest.raises(ValueError, match="no optimizer_parameters were given"):
+            create_manager(logger, server).prompt("Analyse the curve.", None)
+
+    # one repair request is sent
+    assert len(server.requests) == 2
+
+
+def test_unknown_tool_gets_an_error_result(logger):
+    answers = [
+        {"tool_use": [{"name": "think", "input": {"thought": "Hmm."}}, {"name": "measure", "input": {}}]},
+        {"tool_use": submit(BAD)},
+    ]
+    with FakeAnthropicServer(responses=answers) as server:
+        response = create_manager(logger, server).prompt("Analyse the curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 85, 20, -8)
+    think_result, unknown_result = last_user_content(server.requests[1])
+    assert think_result.get("is_error") is None
+    assert unknown_result["is_error"] is True
+    assert unknown_result["content"] == "Unknown tool name: measure"
+
+
+def test_assessment_takes_precedence_over_other_tools(logger):
+    answers = [{"tool_use": [{"name": "think", "input": {"thought": "Hmm."}}, submit(BAD)]}, "[9, 90, 20, -8]"]
+    with FakeAnthropicServer(responses=answers) as server:
+        manager = create_manager(logger, server)
+        response = manager.prompt("Analyse the curve.", None)
+        manager.prompt("Analyse the next curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 85, 20, -8)
+    # both tool uses were answered together
+    tool_results = server.requests[1]["messages"][2]["content"]
+    assert [result["type"] for result in tool_results] == ["tool_result", "tool_result"]
+
+
+def test_text_fallback(logger):
+    answers = ["The new optimizer parameters are [9, 90, 20, -8].", "The curve is good. DONE"]
+    with FakeAnthropicServer(responses=answers) as server:
+        manager = create_manager(logger, server)
+        response = manager.prompt("Analyse the curve.", None)
+        done_response = manager.prompt("Analyse the next curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 90, 20, -8)
+    assert response.badnessCriteria is None
+    assert done_response.optimizer_parameters is None
+    assert len(server.requests) == 2
+
+
+def test_unparseable_text_is_repaired(logger):
+    with FakeAnthropicServer(responses=["I am not sure.", "[9, 90, 20, -8]"]) as server:
+        response = create_manager(logger, server, assessment_tool=False).prompt("Analyse the curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 90, 20, -8)
+    (repair,) = last_user_content(server.requests[1])
+    assert repair["type"] == "text"
+    assert "could not be processed" in repair["text"]
+
+
+def test_tool_use_cut_off_by_max_tokens(logger):
+    answers = [{"tool_use": submit({"overlapping": True}), "stop_reason": "max_tokens"}, {"tool_use": submit(BAD)}]
+    with FakeAnthropicServer(responses=answers) as server:
+        response = create_manager(logger, server).prompt("Analyse the curve.", None)
+
+    assert response.optimizer_parameters == OptimizerParameters(9, 85, 20, -8)
+    tool_result, repair = last_user_content(server.requests[1])
+    assert tool_result["type"] == "tool_result"
+    assert tool_result["is_error"] is True
+    assert repair["type"] == "text"
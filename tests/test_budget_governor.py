@@ -0,0 +1,185 @@
+import pytest
+
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    BudgetExceededError,
+    BudgetGovernor,
+    ModelTier,
+    RequestScheduler,
+)
+from llm_magnet_connector.llm_interface.anthropic_conversation_manager import _MIN_THINKING_BUDGET
+
+# cost of one output token at 15$ per 1M tokens
+OUTPUT_COST = 15 / 1e6
+
+FALLBACK_MODEL = ModelTier("claude-3-5-haiku-latest", 0.8, 4, output_token_limit=4096, thinking=False)
+
+
+def create_manager(logger, server, governor, **kwargs):
+    return AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=RequestScheduler(logger, max_retries=0),
+        base_url=server.base_url,
+        assessment_tool=False,
+        thinking=True,
+        budget_governor=governor,
+        **kwargs,
+    )
+
+
+def test_reserve_caps_the_output_tokens():
+    governor = BudgetGovernor(run_budget=1.0, total_budget=10.0)
+    decision = governor.reserve(0.25, 0.5, 15, 64000, 1000)
+
+    # 0.25$ are left for 16666 output tokens
+    assert decision.max_output_tokens == 16666
+    assert decision.predicted_cost == pytest.approx(0.5 + 1000 * OUTPUT_COST)
+    assert decision.reserved_cost == pytest.approx(0.5 + 16666 * OUTPUT_COST)
+    assert decision.run_remaining == pytest.approx(0.75)
+    assert decision.total_remaining == pytest.approx(10.0)
+
+    # the reservation counts against the total budget until it is settled
+    second = governor.reserve(0.0, 0.5, 15, 64000, 1000)
+    assert second.total_remaining == pytest.approx(10.0 - decision.reserved_cost)
+    governor.settle(decision, 0.6)
+    governor.settle(second, 0.0)
+    assert governor.spent == pytest.approx(0.6)
+    assert governor.reserve(0.0, 0.0, 15, 64000, 0).total_remaining == pytest.approx(9.4)
+
+
+def test_reserve_without_budgets_keeps_the_output_tokens():
+    decision = BudgetGovernor().reserve(100.0, 0.5, 15, 64000, 1000)
+    assert decision.max_output_tokens == 64000
+    assert decision.run_remaining is None and decision.total_remaining is None
+
+
+def test_exceeding_the_run_budget():
+    governor = BudgetGovernor(run_budget=1.0, total_budget=10.0)
+    with pytest.raises(BudgetExceededError, match="run budget"):
+        governor.reserve(0.9, 0.05, 15, 64000, 10000)
+    # other runs can continue
+    assert not governor.exhausted()
+    assert governor.reserve(0.0, 0.05, 15, 64000, 10000).max_output_tokens == 63333
+
+
+def test_exceeding_the_total_budget():
+    governor = BudgetGovernor(total_budget=1.0)
+    governor.charge(0.9)
+    assert not governor.exhausted()
+    with pytest.raises(BudgetExceededError, match="total budget"):
+        governor.reserve(0.0, 0.05, 15, 64000, 10000)
+    assert governor.exhausted()
+
+    governor = BudgetGovernor(total_budget=1.0)
+    governor.charge(1.0)
+    assert governor.exhausted()
+
+
+@pytest.mark.parametrize(
+    "pressure, level",
+    [(0.0, 0), (0.49, 0), (0.5, 1), (0.66, 1), (0.67, 2), (0.83, 2), (0.84, 3), (1.5, 3)],
+)
+def test_adaptation_levels(pressure, level):
+    # with adapt_threshold 0.5, the levels start at 1/2, 2/3 and 5/6 of the budget
+    governor = BudgetGovernor(run_budget=10.0, adapt_threshold=0.5)
+    assert governor.adaptation_level(pressure * 5, pressure * 5) == level
+
+    governor = BudgetGovernor(total_budget=10.0, adapt_threshold=0.5)
+    governor.charge(pressure * 5)
+    assert governor.adaptation_level(0.0, pressure * 5) == level
+
+
+def test_adaptation_level_counts_reservations():
+    governor = BudgetGovernor(total_budget=1.0)
+    assert governor.adaptation_level(0.0, 0.1) == 0
+    governor.reserve(0.0, 0.5, 15, 0, 0)
+    assert governor.adaptation_level(0.0, 0.1) == 1
+
+
+def test_budget_levels_adapt_the_conversation(logger, server):
+    governor = BudgetGovernor(run_budget=1.0, min_context_window_limit=20_000, fallback_model=FALLBACK_MODEL)
+    manager = create_manager(logger, server, governor, context_window_limit=100_000)
+
+    assert manager._apply_budget_level(1) == ["context window limit 100000 -> 50000 tokens"]
+    assert manager._apply_budget_level(1) == []
+    assert manager._apply_budget_level(2) == ["thinking budget 2000 -> 1024 tokens"]
+    assert manager._thinking == {"type": "enabled", "budget_tokens": _MIN_THINKING_BUDGET}
+    assert manager._apply_budget_level(3) == ["model claude-3-7-sonnet-latest -> claude-3-5-haiku-latest"]
+    assert manager._model == "claude-3-5-haiku-latest"
+    assert (manager.cost_1M_input_tokens, manager.cost_1M_output_tokens) == (0.8, 4)
+    assert manager.cost_1M_cache_write_tokens == pytest.approx(1.0)
+    assert manager.cost_1M_cache_read_tokens == pytest.approx(0.08)
+    assert manager._thinking == {"type": "disabled"}
+    assert manager._max_tokens == 4096
+    # adaptations are never undone
+    assert manager._apply_budget_level(0) == []
+    assert manager._model == "claude-3-5-haiku-latest"
+
+
+def test_context_window_is_not_reduced_below_the_minimum(logger, server):
+    governor = BudgetGovernor(run_budget=1.0, min_context_window_limit=40_000)
+    manager = create_manager(logger, server, governor, context_window_limit=50_000)
+    assert manager._apply_budget_level(1) == ["context window limit 50000 -> 40000 tokens"]
+    assert manager._apply_budget_level(3) == ["thinking budget 2000 -> 1024 tokens"]
+    assert manager._context_window_limit == 40_000
+
+
+def test_adapted_prompt(logger, server):
+    governor = BudgetGovernor(total_budget=1.0, fallback_model=FALLBACK_MODEL)
+    governor.charge(0.9)
+    manager = create_manager(logger, server, governor)
+    manager.prompt("Analyse the curve.", None)
+
+    [request] = server.requests
+    assert request["model"] == "claude-3-5-haiku-latest"
+    assert request["thinking"] == {"type": "disabled"}
+    assert request["max_tokens"] <= 4096
+    assert governor.spent == pytest.approx(0.9 + manager.usage_cost)
+
+
+def reserve_output_tokens(manager, output_tokens):
+    """
+    Reserves a request with a budget covering the predicted input cost and the given number of output tokens.
+    """
+    input_cost = manager._predict_input_cost(manager._token_accountant.estimate())
+    manager._budget_governor.run_budget = manager.usage_cost + input_cost + (output_tokens + 0.5) * OUTPUT_COST
+    request = {"max_tokens": manager._max_tokens, "thinking": manager._thinking}
+    return request, manager._reserve_budget(request)
+
+
+def test_reserve_caps_max_tokens_and_thinking_budget(logger, server):
+    manager = create_manager(logger, server, BudgetGovernor())
+    # the expected output tokens of the next requests are those of the first one
+    manager.prompt("Analyse the curve.", None)
+
+    # the thinking budget (2000 tokens) fits below the capped output token limit
+    request, decision = reserve_output_tokens(manager, 5000)
+    assert decision.max_output_tokens == 5000
+    assert request == {"max_tokens": 5000, "thinking": {"type": "enabled", "budget_tokens": 2000}}
+    manager._budget_governor.settle(decision, 0.0)
+
+    # the thinking budget must stay below the output token limit
+    request, decision = reserve_output_tokens(manager, 2000)
+    assert request == {"max_tokens": 2000, "thinking": {"type": "enabled", "budget_tokens": _MIN_THINKING_BUDGET}}
+    manager._budget_governor.settle(decision, 0.0)
+
+    request, decision = reserve_output_tokens(manager, _MIN_THINKING_BUDGET + 1)
+    assert request["thinking"]["budget_tokens"] == _MIN_THINKING_BUDGET
+    manager._budget_governor.settle(decision, 0.0)
+
+    # the reservation is released if the minimum thinking budget does not fit
+    with pytest.raises(BudgetExceededError, match="minimum thinking budget"):
+        reserve_output_tokens(manager, _MIN_THINKING_BUDGET)
+    assert manager._budget_governor._reserved == pytest.approx(0.0)
+
+
+def test_exceeded_budget_refuses_the_prompt(logger, server):
+    governor = BudgetGovernor(total_budget=0.001)
+    manager = create_manager(logger, server, governor)
+    with pytest.raises(BudgetExceededError):
+        manager.prompt("Analyse the curve.", None)
+    assert server.requests == []
+    assert governor.exhausted()
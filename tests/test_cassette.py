@@ -0,0 +1,99 @@
+import json
+import os
+import time
+
+import pytest
+
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    Cassette,
+    ReplayConversationManager,
+    RequestScheduler,
+)
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+SCENARIO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets", "Scenario2")
+PROMPTS = [("Analyse the curve.", SCENARIO_DIR), ("Analyse the next curve.", None), ("And this one?", None)]
+ANSWERS = ["[9, 81, 20, -8]", "[9, 82, 20, -8]", "DONE"]
+# token_count_margin > 1: every context check counts the tokens with the API
+OPTIONS = dict(
+    system_prompt="system",
+    assessment_tool=False,
+    token_count_margin=10,
+)
+
+
+def prompt_all(manager, prompts=PROMPTS):
+    return [str(manager.prompt(prompt, images_dir)) for prompt, images_dir in prompts]
+
+
+def record(logger, path, **options):
+    with FakeAnthropicServer(responses=ANSWERS) as server:
+        manager = AnthropicConversationManager(
+            logger,
+            cost_1M_input_tokens=3,
+            cost_1M_output_tokens=15,
+            scheduler=RequestScheduler(logger, max_retries=0),
+            base_url=server.base_url,
+            cassette=Cassette(path),
+            **{**OPTIONS, **options},
+        )
+        responses = prompt_all(manager)
+    return manager, responses, server
+
+
+def test_record_and_replay(logger, tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    recorded_manager, recorded_responses, server = record(logger, path)
+
+    with open(path) as file:
+        endpoints = [json.loads(line)["endpoint"] for line in file]
+    assert endpoints.count("messages") == len(server.requests) == 3
+    assert endpoints.count("count_tokens") == server.token_count_requests > 0
+    # image data is only stored as hash
+    assert os.path.getsize(path) < 50_000
+
+    # the server is stopped, all responses and token counts come from the cassette
+    manager = ReplayConversationManager(logger, path, 3, 15, **OPTIONS)
+    start_time = time.perf_counter()
+    responses = prompt_all(manager)
+
+    assert time.perf_counter() - start_time < 2
+    assert responses == recorded_responses
+    assert manager.context_size() == recorded_manager.context_size()
+    assert manager.usage_input_tokens == recorded_manager.usage_input_tokens
+    assert manager.model_time == 0
+
+
+def test_replay_trims_the_context_like_the_recording(logger, tmp_path):
+    # the counted tokens of the fake server decide when the context is trimmed
+    path = str(tmp_path / "cassette.jsonl")
+    recorded_manager, recorded_responses, _ = record(logger, path, context_window_limit=1200)
+    assert recorded_manager.evicted_elements > 0
+
+    manager = ReplayConversationManager(logger, path, 3, 15, context_window_limit=1200, **OPTIONS)
+
+    assert prompt_all(manager) == recorded_responses
+    assert manager.evicted_elements == recorded_manager.evicted_elements
+
+
+def test_mismatched_request_raises(logger, tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    record(logger, path)
+    manager = ReplayConversationManager(logger, path, 3, 15, **OPTIONS)
+
+    with pytest.raises(KeyError, match="No response recorded for request"):
+        prompt_all(manager, [("A different prompt.", SCENARIO_DIR)])
+
+
+def test_missing_token_count_raises(logger, tmp_path):
+    # recorded without token counting requests
+    path = str(tmp_path / "cassette.jsonl")
+    record(logger, path, token_count_margin=0)
+    with open(path) as file:
+        assert all(json.loads(line)["endpoint"] == "messages" for line in file)
+
+    manager = ReplayConversationManager(logger, path, 3, 15, **OPTIONS)
+
+    with pytest.raises(KeyError, match="No response recorded for request"):
+        prompt_all(manager)
@@ -0,0 +1,132 @@
+import json
+import os
+
+import pytest
+
+from llm_magnet_connector.benchmark.iteration_benchmark import _FakeConversationManager, _FakeCurveImageGenerator
+from llm_magnet_connector.image_generator import ResponseToImage
+from llm_magnet_connector.llm_interface import OptimizerParameters, get_initial_prompt
+from llm_magnet_connector.llm_interface.cassette import request_fingerprint
+from llm_magnet_connector.orchestrator import MainOrchestrator
+
+SCENARIO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets", "Scenario2")
+ITERATIONS = 6
+
+
+class _CrashingConversationManager(_FakeConversationManager):
+    """
+    Fake conversation manager whose answers depend only on the prompt count (so that a resumed run answers like an uninterrupted one), crashing at a given prompt.
+    """
+
+    def __init__(self, logger, crash_at=None):
+        super().__init__(logger, 0, system_prompt="system", max_prompts=100, context_window_limit=15_000, context_compaction=True)
+        self.crash_at = crash_at
+        self.sent_requests = []
+
+    async def _request_message(self, request: dict, on_content_block=None):
+        if self._prompt_count == self.crash_at:
+            raise RuntimeError("crash")
+        self._answers = self._prompt_count - 1
+        self.sent_requests.append(request_fingerprint(request))
+        return await super()._request_message(request, on_content_block)
+
+
+def create_run(logger, directory, crash_at=None, in_memory=False):
+    manager = _CrashingConversationManager(logger, crash_at)
+    image_generator = ResponseToImage(
+        logger,
+        os.path.join(directory, "images"),
+        curve_generator=_FakeCurveImageGenerator(SCENARIO_DIR, 0),
+        in_memory=in_memory,
+    )
+    orchestrator = MainOrchestrator(
+        manager, image_generator, ITERATIONS, logger, checkpoint_dir=os.path.join(directory, "checkpoint")
+    )
+    return manager, image_generator, orchestrator
+
+
+def initial_prompt():
+    return get_initial_prompt(OptimizerParameters(9, 80, 20, -8), assessment_tool=False)
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_resume_continues_the_run(logger, tmp_path, in_memory):
+    manager, full_image_generator, orchestrator = create_run(logger, str(tmp_path / "full"), in_memory=in_memory)
+    full_result = orchestrator.run(initial_prompt(), SCENARIO_DIR)
+
+    directory = str(tmp_path / "interrupted")
+    interrupted_manager, _, orchestrator = create_run(logger, directory, crash_at=4, in_memory=in_memory)
+    with pytest.raises(RuntimeError, match="crash"):
+        orchestrator.run(initial_prompt(), SCENARIO_DIR)
+    assert len(interrupted_manager.sent_requests) == 3
+
+    # the checkpoint is written atomically, no temporary files are left
+    checkpoint_dir = os.path.join(directory, "checkpoint")
+    with open(os.path.join(checkpoint_dir, "checkpoint.json")) as file:
+        state = json.load(file)
+    assert state["iteration"] == 2
+    assert state["llm_manager"]["prompt_count"] == 3
+    assert not [file_name for file_name in os.listdir(checkpoint_dir) if file_name.endswith(".tmp")]
+    assert os.listdir(os.path.join(checkpoint_dir, "files"))
+
+    resumed_manager, image_generator, orchestrator = create_run(logger, directory, in_memory=in_memory)
+    assert orchestrator.has_checkpoint()
+    result = orchestrator.resume()
+
+    # the resumed run sends the requests of the uninterrupted run, i.e., the same context
+    assert interrupted_manager.sent_requests + resumed_manager.sent_requests == manager.sent_requests
+    assert resumed_manager._prompt_count == manager._prompt_count
+    assert resumed_manager._context_to_message() == manager._context_to_message()
+    assert result.iterations == full_result.iterations == ITERATIONS
+    # the images of the last answer are generated as well
+    assert image_generator.image_index == full_image_generator.image_index == ITERATIONS + 1
+    assert result.input_tokens == full_result.input_tokens
+    assert resumed_manager.usage_requests == manager.usage_requests
+
+
+def test_resume_after_a_partly_written_iteration(logger, tmp_path):
+    directory = str(tmp_path)
+    _, image_generator, orchestrator = create_run(logger, directory, crash_at=4)
+    with pytest.raises(RuntimeError, match="crash"):
+        orchestrator.run(initial_prompt(), SCENARIO_DIR)
+    images_dir = os.path.join(directory, "images")
+    checkpoint_index = json.load(open(os.path.join(directory, "checkpoint", "checkpoint.json")))["image_generator"]["image_index"]
+    # the images generated after the checkpoint are complete and marked as such
+    assert image_generator.image_index == checkpoint_index + 1
+    assert os.path.exists(os.path.join(images_dir, f".{image_generator.image_index}.complete"))
+
+    # simulate a crash while writing the images after the checkpoint
+    partial_index = checkpoint_index + 1
+    partial_dir = os.path.join(images_dir, str(partial_index))
+    os.remove(os.path.join(images_dir, f".{partial_index}.complete"))
+    image_path = os.path.join(partial_dir, sorted(os.listdir(partial_dir))[0])
+    complete_size = os.path.getsize(image_path)
+    with open(image_path, "r+b") as file:
+        file.truncate(complete_size // 2)
+
+    _, image_generator, orchestrator = create_run(logger, directory)
+    orchestrator.resume()
+
+    # the partly written images are generated again
+    assert os.path.getsize(image_path) == complete_size
+    assert os.path.exists(os.path.join(images_dir, f".{partial_index}.complete"))
+    assert image_generator.image_index == ITERATIONS + 1
+
+
+def test_resume_reuses_completed_images(logger, tmp_path, caplog):
+    directory = str(tmp_path)
+    _, image_generator, orchestrator = create_run(logger, directory, crash_at=4)
+    with pytest.raises(RuntimeError, match="crash"):
+        orchestrator.run(initial_prompt(), SCENARIO_DIR)
+    reused_index = image_generator.image_index
+    reused_dir = os.path.join(directory, "images", str(reused_index))
+    modified_times = {file_name: os.stat(os.path.join(reused_dir, file_name)).st_mtime_ns for file_name in os.listdir(reused_dir)}
+
+    _, _, orchestrator = create_run(logger, directory)
+    with caplog.at_level("INFO", logger=logger.name):
+        orchestrator.resume()
+
+    assert any(f"Reusing the images in {reused_dir}" in record.message for record in caplog.records)
+    assert {
+        file_name: os.stat(os.path.join(reused_dir, file_name)).st_mtime_ns for file_name in os.listdir(reused_dir)
+    } == modified_times
@@ -0,0 +1,80 @@
+from llm_magnet_connector.llm_interface import AnthropicConversationManager, RequestScheduler
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+SUMMARY_START = "The following iterations were removed from our conversation"
+# ~250 tokens per query
+PADDING = " Please consider all previous curves." * 35
+
+
+def create_manager(logger, server, context_window_limit):
+    return AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=RequestScheduler(logger, max_retries=0),
+        base_url=server.base_url,
+        assessment_tool=False,
+        think_tool=False,
+        context_window_limit=context_window_limit,
+        context_compaction=True,
+        # decide with the local estimate only
+        token_count_margin=0,
+    )
+
+
+def texts(message):
+    return [block["text"] for block in message["content"] if block["type"] == "text"]
+
+
+def summaries(request):
+    return [
+        text
+        for message in request["messages"]
+        if message["role"] == "user"
+        for text in texts(message)
+        if text.startswith(SUMMARY_START)
+    ]
+
+
+def test_summary_replaces_removed_iterations(logger):
+    answers = lambda body: f"[9, {80 + len(body['messages']) // 2}, 20, -8]"
+    with FakeAnthropicServer(responses=answers) as server:
+        manager = create_manager(logger, server, context_window_limit=1200)
+        manager.prompt("Initial prompt." + PADDING, None)
+        prompts = [f"Query {index}." + PADDING for index in range(1, 9)]
+        first_compaction = None
+        for prompt in prompts:
+            manager.prompt(prompt, None)
+            if first_compaction is None and summaries(server.requests[-1]):
+                first_compaction = len(server.requests) - 1
+
+    assert first_compaction is not None
+    assert manager.evicted_elements > 1
+
+    for index in range(first_compaction, len(server.requests)):
+        messages = server.requests[index]["messages"]
+        # the first interaction is kept, followed by the summary and its acknowledgement
+        assert texts(messages[0])[0].startswith("Initial prompt.")
+        assert texts(messages[2])[0].startswith(SUMMARY_START)
+        assert messages[3]["role"] == "assistant"
+        # the summary is updated instead of duplicated
+        assert len(summaries(server.requests[index])) == 1
+        # the removed queries are only part of the summary, the newest query is always sent
+        sent_queries = [text.split(".")[0] for message in messages[4:] for text in texts(message) if text.startswith("Query")]
+        assert "Query 1" not in sent_queries
+        assert sent_queries[-1] == f"Query {index}"
+
+    first_summary = summaries(server.requests[first_compaction])[0]
+    last_summary = summaries(server.requests[-1])[0]
+    assert last_summary != first_summary
+    assert last_summary.count("- Iteration") == len(manager._compacted_records) > first_summary.count("- Iteration")
+    # the selected optimizer parameters of the removed iterations are kept
+    assert "Selected optimizer parameters: [9, 81.0, 20.0, -8.0]" in last_summary
+    assert "Iteration 1:" in last_summary
+    # the token estimates and iteration records follow the context
+    assert len(manager._iteration_records) == len(manager._context)
+    assert manager._iteration_records[1] is None
+    assert manager._token_accountant.raw_total() - manager._token_accountant.overhead_tokens == sum(
+        sum(manager._estimate_message_tokens(message) for message in element) for element in manager._context
+    )
@@ -0,0 +1,155 @@
+import os
+
+import pytest
+
+from llm_magnet_connector.benchmark.iteration_benchmark import _FakeCurveImageGenerator
+from llm_magnet_connector.image_generator import EvaluationCache, ResponseToImage
+from llm_magnet_connector.image_generator.evaluation_cache import normalize_parameters
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    BadnessCriteria,
+    LLMResponse,
+    OptimizerParameters,
+    RequestScheduler,
+    get_initial_prompt,
+)
+from llm_magnet_connector.orchestrator import MainOrchestrator
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+SCENARIO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets", "Scenario2")
+
+
+class _CountingCurveGenerator(_FakeCurveImageGenerator):
+    """
+    Fake curve generator counting the generated curves.
+    """
+
+    def __init__(self):
+        super().__init__(SCENARIO_DIR, 0)
+        self.generated = []
+
+    async def agenerate_images(self, dir, optimizer_params: OptimizerParameters, index: int):
+        self.generated.append(index)
+        await super().agenerate_images(dir, optimizer_params, index)
+
+
+def create_images(directory, index):
+    os.makedirs(directory, exist_ok=True)
+    for suffix in "abc":
+        with open(os.path.join(directory, f"{index}{suffix}.png"), "wb") as file:
+            file.write(f"image {suffix}".encode())
+
+
+def read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def test_equal_parameters_have_one_key():
+    assert normalize_parameters(OptimizerParameters(9, 80, 20, -8)) == (9, 80.0, 20.0, -8.0)
+    assert normalize_parameters(OptimizerParameters(9.0, 80.0, 20.0, -8.0)) == (9, 80.0, 20.0, -8.0)
+    assert normalize_parameters(OptimizerParameters(9, 80.0000001, 20, -8)) == (9, 80.0, 20.0, -8.0)
+    assert str(normalize_parameters(OptimizerParameters(9, 80, 20, -0.0))[3]) == "0.0"
+    assert normalize_parameters(OptimizerParameters(9, 80.5, 20, -8)) != (9, 80.0, 20.0, -8.0)
+
+
+def test_restore_relabels_the_images(tmp_path):
+    cache = EvaluationCache(str(tmp_path / "cache"))
+    create_images(str(tmp_path / "3"), 3)
+    cache.store("scenario", OptimizerParameters(9, 80, 20, -8), str(tmp_path / "3"), 3)
+    # the images are stored without index
+    [entry_dir] = [entry.path for entry in os.scandir(tmp_path / "cache") if entry.is_dir()]
+    assert sorted(os.listdir(entry_dir)) == ["a.png", "b.png", "c.png"]
+
+    target = tmp_path / "7"
+    target.mkdir()
+    # equal parameters given as floats hit the same entry, also in a new instance
+    cache = EvaluationCache(str(tmp_path / "cache"))
+    assert cache.restore("scenario", OptimizerParameters(9.0, 80.0, 20.0, -8.0), str(target), 7)
+    assert sorted(os.listdir(target)) == ["7a.png", "7b.png", "7c.png"]
+    for suffix in "abc":
+        assert read(target / f"7{suffix}.png") == f"image {suffix}".encode()
+
+    assert not cache.restore("other scenario", OptimizerParameters(9, 80, 20, -8), str(target), 8)
+    assert not cache.restore("scenario", OptimizerParameters(9, 81, 20, -8), str(target), 8)
+    assert sorted(os.listdir(target)) == ["7a.png", "7b.png", "7c.png"]
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": pytest.approx(1 / 3), "entries": 1}
+
+
+def test_images_in_memory(tmp_path):
+    cache = EvaluationCache(str(tmp_path))
+    assert cache.load("scenario", OptimizerParameters(9, 80, 20, -8)) is None
+    cache.store_images("scenario", OptimizerParameters(9, 80, 20, -8), {"a": b"a", "b": b"b"})
+    assert cache.load("scenario", OptimizerParameters(9.0, 80.0, 20.0, -8.0)) == {"a": b"a", "b": b"b"}
+
+    # an entry with removed images is a miss
+    key_dir = next(entry.path for entry in os.scandir(tmp_path) if entry.is_dir())
+    os.remove(os.path.join(key_dir, "b.png"))
+    assert cache.load("scenario", OptimizerParameters(9, 80, 20, -8)) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_repeated_parameters_are_taken_from_the_cache(logger, tmp_path, in_memory):
+    cache = EvaluationCache(str(tmp_path / "cache"))
+    response = LLMResponse(OptimizerParameters(9, 80, 20, -8), BadnessCriteria(False, False, True, False))
+
+    generator = _CountingCurveGenerator()
+    image_generator = ResponseToImage(
+        logger, str(tmp_path / "first"), curve_generator=generator, scenario=SCENARIO_DIR, evaluation_cache=cache, in_memory=in_memory
+    )
+    image_generator.response_to_image(response)
+    # images generated in memory are added to the cache once saved
+    image_generator.flush()
+    image_generator.response_to_image(LLMResponse(OptimizerParameters(9.0, 80.0, 20.0, -8.0), BadnessCriteria(False, False, True, False)))
+    image_generator.flush()
+    assert generator.generated == [1]
+    assert image_generator.evaluation_cache_hits == 1
+    assert image_generator.repeated_index == 1
+
+    # a later run of the same scenario does not generate the curve again
+    generator = _CountingCurveGenerator()
+    image_generator = ResponseToImage(
+        logger, str(tmp_path / "second"), curve_generator=generator, scenario=SCENARIO_DIR, evaluation_cache=cache, in_memory=in_memory
+    )
+    image_generator.response_to_image(response)
+    image_generator.flush()
+    assert generator.generated == []
+    assert image_generator.evaluation_cache_hits == 1
+    assert image_generator.repeated_index is None
+    assert sorted(file_name for file_name in os.listdir(tmp_path / "second" / "1") if file_name.endswith(".png")) == [
+        "1a.png",
+        "1b.png",
+        "1c.png",
+    ]
+
+
+def test_reprompt_notes_repeated_parameters(logger, tmp_path):
+    cache = EvaluationCache(str(tmp_path / "cache"))
+    generator = _CountingCurveGenerator()
+    with FakeAnthropicServer(responses=["[9, 80, 20, -8]", "[9, 80.0, 20.0, -8.0]", "[9, 81, 20, -8]"]) as server:
+        manager = AnthropicConversationManager(
+            logger,
+            cost_1M_input_tokens=3,
+            cost_1M_output_tokens=15,
+            system_prompt="system",
+            scheduler=RequestScheduler(logger, max_retries=0),
+            base_url=server.base_url,
+            assessment_tool=False,
+        )
+        image_generator = ResponseToImage(
+            logger, str(tmp_path / "images"), curve_generator=generator, scenario=SCENARIO_DIR, evaluation_cache=cache
+        )
+        result = MainOrchestrator(manager, image_generator, 2, logger).run(
+            get_initial_prompt(OptimizerParameters(9, 80, 20, -8), assessment_tool=False), SCENARIO_DIR
+        )
+
+    def reprompt(request):
+        return next(block["text"] for block in request["messages"][-1]["content"] if block["type"] == "text" and "pictures marked" in block["text"])
+
+    assert "already selected before" not in reprompt(server.requests[1])
+    assert 'were already selected before. The curve is identical to the one in the pictures marked "1a", "1b", and "1c"' in reprompt(
+        server.requests[2]
+    )
+    assert result.evaluation_cache_hits == 1
+    assert generator.generated == [1, 3]
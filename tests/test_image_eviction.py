@@ -0,0 +1,135 @@
+import base64
+import io
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+from llm_magnet_connector.llm_interface import AnthropicConversationManager, ImageEvictionPolicy, RequestScheduler
+from llm_magnet_connector.llm_interface.image_eviction import downscale_image_block
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+IMAGE_SIZE = 800
+
+
+def create_images(directory, index):
+    """
+    Creates the three images of an iteration ({index}a.png, {index}b.png, {index}c.png).
+    """
+    images_dir = os.path.join(directory, str(index))
+    os.makedirs(images_dir)
+    generator = np.random.default_rng(index)
+    for suffix in "abc":
+        pixels = generator.integers(0, 255, (IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(images_dir, f"{index}{suffix}.png"))
+    return images_dir
+
+
+def image_details(request):
+    """
+    Returns the detail of the images of each iteration in a request, by iteration: "full", "reduced" or "omitted".
+    """
+    details = {}
+    for message in request["messages"]:
+        if message["role"] != "user":
+            continue
+        content = message["content"]
+        iteration = None
+        for block in content:
+            if block["type"] == "text" and block["text"].startswith("Image "):
+                iteration = int(block["text"][len("Image ") : -2])
+            elif block["type"] == "text" and block["text"].startswith("Images "):
+                details[int(block["text"].split(" of iteration ")[1].split(" ")[0])] = "omitted"
+            elif block["type"] == "image":
+                with Image.open(io.BytesIO(base64.b64decode(block["source"]["data"]))) as image:
+                    details[iteration] = "full" if image.width == IMAGE_SIZE else "reduced"
+    return details
+
+
+def test_images_are_downscaled_then_omitted_oldest_first(logger, tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger=logger.name)
+    # about 2600 tokens of images per iteration, about 650 when downscaled
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"]) as server:
+        manager = AnthropicConversationManager(
+            logger,
+            cost_1M_input_tokens=3,
+            cost_1M_output_tokens=15,
+            system_prompt="system",
+            scheduler=RequestScheduler(logger, max_retries=0),
+            base_url=server.base_url,
+            assessment_tool=False,
+            context_window_limit=9000,
+            token_count_margin=0,
+            image_eviction=ImageEvictionPolicy(protected_iterations=1, downscale_factor=0.5, min_long_edge=100),
+        )
+        for index in range(8):
+            manager.prompt(f"Analyse curve {index}.", create_images(str(tmp_path), index))
+
+    history = [image_details(request) for request in server.requests]
+    order = {"full": 2, "reduced": 1, "omitted": 0}
+    for request_index, details in enumerate(history):
+        # the initial prompt and the newest iteration are never reduced
+        assert sorted(details) == list(range(request_index + 1))
+        assert details[0] == "full"
+        assert details[request_index] == "full"
+        # older iterations are reduced at least as far as newer ones
+        assert [order[details[iteration]] for iteration in range(1, request_index + 1)] == sorted(
+            order[details[iteration]] for iteration in range(1, request_index + 1)
+        )
+    assert "reduced" in history[-1].values()
+    assert "omitted" in history[-1].values()
+
+    # each iteration is downscaled before its images are omitted, oldest first
+    steps = [
+        tuple(record.getMessage().split(" (")[0].rsplit(" ", 1))
+        for record in caplog.records
+        if record.getMessage().startswith(("Downscaled the images of", "Omitted the images of"))
+    ]
+    downscaled = [int(iteration) for action, iteration in steps if action.startswith("Downscaled")]
+    omitted = [int(iteration) for action, iteration in steps if action.startswith("Omitted")]
+    assert downscaled == sorted(downscaled) and omitted == sorted(omitted)
+    for iteration in omitted:
+        assert steps.index(("Downscaled the images of iteration", str(iteration))) < steps.index(
+            ("Omitted the images of iteration", str(iteration))
+        )
+    assert 0 not in downscaled and 7 not in downscaled
+
+
+def test_newest_iterations_are_protected(logger, tmp_path):
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"]) as server:
+        manager = AnthropicConversationManager(
+            logger,
+            cost_1M_input_tokens=3,
+            cost_1M_output_tokens=15,
+            system_prompt="system",
+            scheduler=RequestScheduler(logger, max_retries=0),
+            base_url=server.base_url,
+            assessment_tool=False,
+            context_window_limit=12000,
+            token_count_margin=0,
+            image_eviction=ImageEvictionPolicy(protected_iterations=2, downscale_factor=None),
+        )
+        for index in range(6):
+            manager.prompt(f"Analyse curve {index}.", create_images(str(tmp_path), index))
+
+    for request_index, details in enumerate(map(image_details, server.requests)):
+        assert sorted(details) == list(range(request_index + 1))
+        # the two newest iterations keep their images
+        assert details[request_index] == "full"
+        assert details[max(request_index - 1, 0)] == "full"
+        # without downscaling, images are omitted right away
+        assert "reduced" not in details.values()
+    assert "omitted" in image_details(server.requests[-1]).values()
+
+
+def test_downscale_respects_min_long_edge():
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 400), "white").save(buffer, format="PNG")
+    block = {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": base64.b64encode(buffer.getvalue()).decode()}}
+
+    downscaled = downscale_image_block(block, 0.25, 300)
+    with Image.open(io.BytesIO(base64.b64decode(downscaled["source"]["data"]))) as image:
+        assert image.size == (300, 150)
+    # already at the minimum size
+    assert downscale_image_block(downscaled, 0.25, 300) is None
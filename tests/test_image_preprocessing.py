@@ -0,0 +1,58 @@
+import io
+import logging
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from llm_magnet_connector.image_generator._annotate_imgs import annotate_image
+from llm_magnet_connector.llm_interface import ImagePreprocessingConfig
+from llm_magnet_connector.llm_interface.image_preprocessing import ImagePreprocessor
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets")
+IMAGES = [
+    os.path.join(scenario, file_name)
+    for scenario in ["Scenario1", "Scenario2"]
+    for file_name in sorted(os.listdir(os.path.join(ASSETS_DIR, scenario)))
+    if file_name.startswith("0")
+]
+
+
+def annotated_image(path):
+    with Image.open(os.path.join(ASSETS_DIR, path)) as image:
+        image.load()
+        annotated = annotate_image(image, os.path.splitext(os.path.basename(path))[0])
+    buffer = io.BytesIO()
+    annotated.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def preprocess(data, config):
+    processed, mime_type = ImagePreprocessor(logging.getLogger("tests"), config).process_data(data, "image/png", "image")
+    assert mime_type == "image/png"
+    with Image.open(io.BytesIO(processed)) as image:
+        return np.asarray(image.convert("RGB"), dtype=np.int16)
+
+
+def red_mask(pixels):
+    # strongly red pixels, i.e., the label (see ImagePreprocessor._to_grayscale_keep_red)
+    return (pixels[..., 0] - np.maximum(pixels[..., 1], pixels[..., 2])) > 80
+
+
+@pytest.mark.parametrize("grayscale", [False, True], ids=["color", "grayscale"])
+@pytest.mark.parametrize("path", IMAGES)
+def test_quantization_keeps_the_red_label(path, grayscale):
+    data = annotated_image(path)
+    reference = preprocess(data, ImagePreprocessingConfig(colors=None, grayscale=grayscale))
+    quantized = preprocess(data, ImagePreprocessingConfig(colors=64, grayscale=grayscale))
+    assert quantized.shape == reference.shape
+
+    label = red_mask(reference)
+    assert label.sum() > 100
+    kept = red_mask(quantized)
+    # pure red is always part of the palette, only anti-aliased edge pixels of the label may turn gray
+    assert (label & kept).sum() >= 0.9 * label.sum()
+    assert np.all(quantized[np.all(reference == (255, 0, 0), axis=-1)] == (255, 0, 0))
+    # no other parts of the image turn red
+    assert (kept & ~label).sum() <= 0.05 * label.sum()
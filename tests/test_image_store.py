@@ -0,0 +1,183 @@
+import base64
+import logging
+import os
+
+import anthropic
+import pytest
+
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    FilesApiImageStore,
+    RequestScheduler,
+)
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+SCENARIO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets", "Scenario1")
+SCENARIO_IMAGE_BYTES = sum(
+    os.path.getsize(os.path.join(SCENARIO_DIR, file_name)) for file_name in os.listdir(SCENARIO_DIR)
+)
+
+
+def create_manager(logger, server, image_store):
+    return AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=RequestScheduler(logger, max_retries=0),
+        base_url=server.base_url,
+        image_store=image_store,
+        assessment_tool=False,
+    )
+
+
+def create_image_store(logger, server):
+    return FilesApiImageStore(logger, base_url=server.base_url, scheduler=RequestScheduler(logger, max_retries=0))
+
+
+def image_sources(request):
+    """
+    Returns the sources of all image blocks of a request.
+    """
+    return [
+        block["source"]
+        for message in request["messages"]
+        if isinstance(message["content"], list)
+        for block in message["content"]
+        if block["type"] == "image"
+    ]
+
+
+def test_images_are_uploaded_once(logger, server):
+    image_store = create_image_store(logger, server)
+    manager = create_manager(logger, server, image_store)
+
+    for _ in range(3):
+        manager.prompt("Analyse the curve.", SCENARIO_DIR)
+
+    # 4 distinct images, uploaded with the first prompt and referenced by every request afterwards
+    assert len(server.files) == 4
+    assert image_store.uploaded_bytes == SCENARIO_IMAGE_BYTES
+    assert sorted(file["data"] for file in server.files.values()) == sorted(
+        open(os.path.join(SCENARIO_DIR, file_name), "rb").read() for file_name in os.listdir(SCENARIO_DIR)
+    )
+    for request in server.requests:
+        sources = image_sources(request)
+        assert sources
+        assert all(source["type"] == "file" and source["file_id"] in server.files for source in sources)
+    assert len(image_sources(server.requests[-1])) == 12
+    assert manager.sent_image_bytes == 0
+
+
+def test_uploads_are_shared_by_conversations(logger, server):
+    image_store = create_image_store(logger, server)
+
+    for _ in range(2):
+        create_manager(logger, server, image_store).prompt("Analyse the curve.", SCENARIO_DIR)
+
+    assert len(server.files) == 4
+    assert image_sources(server.requests[0]) == image_sources(server.requests[1])
+
+
+def test_falls_back_to_inline_images(logger, caplog):
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"], files_api=False) as server:
+        image_store = create_image_store(logger, server)
+        manager = create_manager(logger, server, image_store)
+
+        with caplog.at_level(logging.WARNING, logger=logger.name):
+            for _ in range(2):
+                manager.prompt("Analyse the curve.", SCENARIO_DIR)
+
+    assert server.files == {}
+    assert image_store.uploaded_bytes == 0
+    assert image_store.betas == []
+    # the fallback is reported once, not for every image
+    assert sum("Falling back to inline images" in record.message for record in caplog.records) == 1
+    for request in server.requests:
+        sources = image_sources(request)
+        assert sources
+        assert all(source["type"] == "base64" for source in sources)
+    assert {base64.b64decode(source["data"]) for source in image_sources(server.requests[0])} == {
+        open(os.path.join(SCENARIO_DIR, file_name), "rb").read() for file_name in os.listdir(SCENARIO_DIR)
+    }
+
+
+@pytest.mark.parametrize("files_api", [True, False])
+def test_payload_size_per_iteration(logger, files_api):
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"], files_api=files_api) as server:
+        manager = create_manager(logger, server, create_image_store(logger, server))
+
+        for _ in range(3):
+            manager.prompt("Analyse the curve.", SCENARIO_DIR)
+
+    payload_sizes = [timing["payload_bytes"] for timing in manager.prompt_timings]
+    # the reported payload approximates the request body received by the server (without the tool definitions)
+    for payload_bytes, request_bytes in zip(payload_sizes, server.request_sizes, strict=True):
+        assert payload_bytes == pytest.approx(request_bytes, rel=0.05, abs=2000)
+
+    growth = [later - earlier for earlier, later in zip(payload_sizes, payload_sizes[1:])]
+    inline_image_bytes = len(base64.b64encode(b"\0" * SCENARIO_IMAGE_BYTES))
+    if files_api:
+        # only the file references of the new images are added per iteration
+        assert all(bytes_added < 2000 for bytes_added in growth)
+        assert manager.sent_image_bytes == 0
+    else:
+        # the images of every iteration are re-sent with all later requests
+        assert all(bytes_added >= inline_image_bytes for bytes_added in growth)
+        assert manager.sent_image_bytes == pytest.approx(6 * inline_image_bytes, rel=0.01)
+
+
+@pytest.mark.parametrize("status_code", [400, 403, 415])
+def test_falls_back_on_non_retryable_upload_errors(logger, status_code):
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"], upload_faults=[(status_code, None)]) as server:
+        image_store = create_image_store(logger, server)
+        create_manager(logger, server, image_store).prompt("Analyse the curve.", SCENARIO_DIR)
+
+    # the uploads started before the failure was known may have succeeded, later images are sent inline
+    assert len(server.files) < 4
+    assert any(source["type"] == "base64" for source in image_sources(server.requests[0]))
+
+
+def test_transient_upload_errors_do_not_disable_uploads(logger):
+    faults = [(529, None)] * 4
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"], upload_faults=faults) as server:
+        image_store = create_image_store(logger, server)
+        manager = create_manager(logger, server, image_store)
+
+        with pytest.raises(anthropic.APIStatusError) as exc_info:
+            manager.prompt("Analyse the curve.", SCENARIO_DIR)
+        assert exc_info.value.status_code == 529
+        assert server.requests == []
+
+        # the uploads are tried again with the next prompt
+        manager.prompt("Analyse the curve.", SCENARIO_DIR)
+
+    assert len(server.files) == 4
+    assert all(source["type"] == "file" for source in image_sources(server.requests[0]))
+
+
+def test_transient_upload_errors_are_retried(logger):
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]"], upload_faults=[(529, 0), (429, 0)]) as server:
+        image_store = FilesApiImageStore(
+            logger, base_url=server.base_url, scheduler=RequestScheduler(logger, max_retries=2, initial_backoff=0.01)
+        )
+        create_manager(logger, server, image_store).prompt("Analyse the curve.", SCENARIO_DIR)
+
+    assert len(server.files) == 4
+    assert all(source["type"] == "file" for source in image_sources(server.requests[0]))
+
+
+def test_uploaded_files_are_deleted(logger, server):
+    image_store = create_image_store(logger, server)
+    create_manager(logger, server, image_store).prompt("Analyse the curve.", SCENARIO_DIR)
+    assert len(server.files) == 4
+
+    image_store.delete_files()
+
+    assert server.files == {}
+    assert image_store.betas == []
+
+    # images needed afterwards are uploaded again
+    create_manager(logger, server, image_store).prompt("Analyse the curve.", SCENARIO_DIR)
+    assert len(server.files) == 4
+    assert set(source["file_id"] for source in image_sources(server.requests[-1])) == set(server.files)
@@ -0,0 +1,118 @@
+import asyncio
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from llm_magnet_connector.image_generator import ImageWatcher, is_complete_png
+from llm_magnet_connector.image_generator._generate_curve_images import CurveImageGenerator
+from llm_magnet_connector.llm_interface import OptimizerParameters
+
+# time to give the watcher to (wrongly) accept a file [s]
+SETTLE_TIME = 0.3
+
+
+def png_data():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def write(path, data, mode="wb"):
+    with open(path, mode) as file:
+        file.write(data)
+
+
+@pytest.fixture(params=[True, False], ids=["inotify", "polling"])
+def watcher(request, logger):
+    watcher = ImageWatcher(logger, use_inotify=request.param)
+    if request.param and not watcher.uses_inotify:
+        pytest.skip("inotify is not available")
+    yield watcher
+    watcher.close()
+
+
+def test_is_complete_png(tmp_path):
+    data = png_data()
+    path = str(tmp_path / "0a.png")
+    assert not is_complete_png(path)
+    write(path, data[:-5])
+    assert not is_complete_png(path)
+    write(path, data)
+    assert is_complete_png(path)
+    write(path, b"no png" + data[6:])
+    assert not is_complete_png(path)
+
+
+def test_waits_until_the_images_are_complete(watcher, tmp_path):
+    data = png_data()
+
+    async def scenario():
+        wait = asyncio.create_task(watcher.wait_for_images(str(tmp_path), ["1a.png", "1b.png"], timeout=10))
+        await asyncio.sleep(SETTLE_TIME)
+        assert not wait.done()
+
+        # a truncated file (e.g., still being written) does not count
+        write(tmp_path / "1a.png", data[:-20])
+        write(tmp_path / "1b.png", data)
+        await asyncio.sleep(SETTLE_TIME)
+        assert not wait.done()
+
+        write(tmp_path / "1a.png", data[-20:], mode="ab")
+        await asyncio.wait_for(wait, 5)
+
+    asyncio.run(scenario())
+
+
+def test_moved_images_arrive(watcher, tmp_path):
+    data = png_data()
+    write(tmp_path / "draft.png", data)
+
+    async def scenario():
+        wait = asyncio.create_task(watcher.wait_for_images(str(tmp_path), ["2a.png"], timeout=10))
+        await asyncio.sleep(SETTLE_TIME)
+        assert not wait.done()
+        os.replace(tmp_path / "draft.png", tmp_path / "2a.png")
+        await asyncio.wait_for(wait, 5)
+
+    asyncio.run(scenario())
+
+
+def test_present_images_return_immediately(watcher, tmp_path):
+    write(tmp_path / "3a.png", png_data())
+    asyncio.run(asyncio.wait_for(watcher.wait_for_images(str(tmp_path), ["3a.png"], timeout=10), 1))
+
+
+def test_timeout_names_the_missing_images(watcher, tmp_path):
+    data = png_data()
+    write(tmp_path / "4a.png", data)
+    write(tmp_path / "4b.png", data[:-20])
+    with pytest.raises(TimeoutError, match=r"\['4b.png', '4c.png'\]"):
+        asyncio.run(watcher.wait_for_images(str(tmp_path), ["4a.png", "4b.png", "4c.png"], timeout=SETTLE_TIME))
+
+
+def test_curve_image_generator_reads_complete_images(watcher, logger, tmp_path):
+    data = png_data()
+    generator = CurveImageGenerator(logger, watcher=watcher, timeout=10)
+
+    async def scenario():
+        images = asyncio.create_task(generator.agenerate_image_buffers(str(tmp_path), OptimizerParameters(9, 80, 20, -8), 5))
+        for suffix in "abc":
+            write(tmp_path / f"5{suffix}.png", data[:-20])
+        await asyncio.sleep(SETTLE_TIME)
+        assert not images.done()
+        for suffix in "abc":
+            write(tmp_path / f"5{suffix}.png", data[-20:], mode="ab")
+        return await asyncio.wait_for(images, 5)
+
+    images = asyncio.run(scenario())
+    assert sorted(images) == ["5a", "5b", "5c"]
+    for image in images.values():
+        assert image.size == (64, 64)
+
+
+def test_curve_image_generator_timeout(watcher, logger, tmp_path):
+    generator = CurveImageGenerator(logger, watcher=watcher, timeout=SETTLE_TIME)
+    with pytest.raises(TimeoutError):
+        generator.generate_images(str(tmp_path), OptimizerParameters(9, 80, 20, -8), 6)
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from llm_magnet_connector.benchmark.iteration_benchmark import format_results, run_iteration_benchmark
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "src")
+SCENARIO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets", "Scenario2")
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"in_memory": True, "pipelined": True, "async_logging": True}],
+    ids=["default", "in_memory_pipelined"],
+)
+def test_iteration_benchmark_smoke(options):
+    result = run_iteration_benchmark(2, SCENARIO_DIR, **options)
+
+    assert result["iterations"] == 2
+    assert result["wall_time"] > 0
+    assert result["critical_path"] >= 0
+    for stage in ["llm_request", "image_generation", "annotation"]:
+        assert result["stages"][stage]["count"] >= 2
+        assert result["stages"][stage]["per_iteration"] == pytest.approx(result["stages"][stage]["total"] / 2)
+    table = format_results({"runs": [result]})
+    assert "llm_request" in table and "wall time" in table
+
+
+def test_benchmark_runs_from_any_directory(tmp_path):
+    # the default scenario is found relative to the package, not to the working directory
+    output = tmp_path / "results.json"
+    env = {**os.environ, "PYTHONPATH": os.path.abspath(SRC_DIR)}
+    subprocess.run(
+        [sys.executable, "-m", "llm_magnet_connector.benchmark", "--iterations", "1", "--output", str(output)],
+        cwd=tmp_path,
+        env=env,
+        check=True,
+        capture_output=True,
+        timeout=120,
+    )
+    with open(output) as file:
+        results = json.load(file)
+    assert [run["iterations"] for run in results["runs"]] == [1]
@@ -0,0 +1,124 @@
+import base64
+import io
+import logging
+
+from llm_magnet_connector.llm_interface import AnthropicConversationManager, RequestScheduler
+from llm_magnet_connector.utils import create_queue_handler
+from llm_magnet_connector.utils.logger import SanitizingFormatter, _redact_image_data
+
+IMAGE_DATA = base64.b64encode(b"\x89PNG" + bytes(range(256)) * 40).decode()
+
+
+def create_request():
+    return {
+        "model": "model",
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Image 0a:"},
+                    {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": IMAGE_DATA}},
+                ],
+            }
+        ],
+    }
+
+
+def create_handler(max_message_length=None):
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(SanitizingFormatter("%(name)s - %(message)s", max_message_length=max_message_length))
+    return handler, stream
+
+
+def test_redact_image_data_does_not_modify_the_request():
+    request = create_request()
+
+    redacted = _redact_image_data(request)
+
+    assert IMAGE_DATA not in repr(redacted)
+    assert redacted["messages"][0]["content"][1]["source"]["media_type"] == "image/png"
+    assert request["messages"][0]["content"][1]["source"]["data"] == IMAGE_DATA
+    # values other than the containers are shared with the original
+    assert redacted["messages"][0]["content"][0] is not request["messages"][0]["content"][0]
+    assert redacted["messages"][0]["content"][0]["text"] is request["messages"][0]["content"][0]["text"]
+
+
+def test_image_data_never_reaches_the_handler():
+    handler, stream = create_handler()
+    client_logger = logging.getLogger("anthropic._base_client")
+    level = client_logger.level
+    client_logger.setLevel(logging.DEBUG)
+    client_logger.addHandler(handler)
+    try:
+        client_logger.debug("Request options: %s", create_request())
+    finally:
+        client_logger.removeHandler(handler)
+        client_logger.setLevel(level)
+
+    output = stream.getvalue()
+    assert "Request options" in output
+    assert "image/png" in output
+    assert IMAGE_DATA not in output
+
+
+def test_queue_handler_redacts_before_the_listener():
+    handler, stream = create_handler()
+    records = []
+    handler.emit = lambda record, emit=handler.emit: (records.append(record), emit(record))
+    queue_handler, listener = create_queue_handler(handler)
+    client_logger = logging.getLogger("anthropic._base_client")
+    level = client_logger.level
+    client_logger.setLevel(logging.DEBUG)
+    client_logger.addHandler(queue_handler)
+    request = create_request()
+    try:
+        client_logger.debug("Request options: %s", request)
+    finally:
+        client_logger.removeHandler(queue_handler)
+        client_logger.setLevel(level)
+        listener.stop()
+
+    assert len(records) == 1
+    assert IMAGE_DATA not in repr(records[0].args)
+    assert IMAGE_DATA not in stream.getvalue()
+    assert request["messages"][0]["content"][1]["source"]["data"] == IMAGE_DATA
+
+
+def test_oversized_messages_are_truncated():
+    handler, stream = create_handler(max_message_length=100)
+    logger = logging.getLogger("tests.truncation")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        logger.warning("x" * 5000)
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+
+    output = stream.getvalue()
+    assert "x" * 101 not in output
+    assert "[4900 characters truncated]" in output
+    assert len(output) < 200
+
+
+def test_responses_are_logged_as_summary(logger, server, caplog):
+    manager = AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=RequestScheduler(logger, max_retries=0),
+        base_url=server.base_url,
+        assessment_tool=False,
+    )
+
+    with caplog.at_level(logging.DEBUG, logger=logger.name):
+        manager.prompt("Analyse the curve.", None)
+
+    debug_messages = [record.getMessage() for record in caplog.records if record.levelno == logging.DEBUG]
+    summary = next(message for message in debug_messages if message.startswith("Response msg_fake"))
+    assert "stop reason end_turn" in summary
+    assert "content [text]" in summary
+    assert "input_tokens" in summary
+    assert not any("TextBlock(" in message for message in debug_messages)
@@ -0,0 +1,141 @@
+import time
+
+import anthropic
+import pytest
+
+from llm_magnet_connector.llm_interface import AnthropicConversationManager, RequestScheduler
+from llm_magnet_connector.utils import run_sync
+
+
+def create_manager(logger, server, scheduler):
+    return AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=scheduler,
+        base_url=server.base_url,
+        assessment_tool=False,
+    )
+
+
+def send_message(manager):
+    """
+    Sends one request through AnthropicConversationManager._send_message and returns the response and the duration [s].
+    """
+    start_time = time.perf_counter()
+    response = run_sync(manager._send_message([{"role": "user", "content": [{"type": "text", "text": "hi"}]}]))
+    return response, time.perf_counter() - start_time
+
+
+@pytest.mark.parametrize("status_code", [429, 529])
+def test_retry_after_is_honored(logger, server, status_code):
+    # without the retry-after header, the backoff would be far longer than the test
+    scheduler = RequestScheduler(logger, max_retries=2, initial_backoff=30, max_backoff=30)
+    server.inject_faults([(status_code, 0.5)])
+
+    response, duration = send_message(create_manager(logger, server, scheduler))
+
+    assert response.content[0].text == "[9, 81, 20, -8]"
+    assert 0.5 <= duration < 5
+    assert len(server.requests) == 1
+    assert scheduler.metrics()["retries"] == 1
+
+
+def test_backoff_without_retry_after(logger, server):
+    scheduler = RequestScheduler(logger, max_retries=3, initial_backoff=0.05)
+    server.inject_faults([(529, None), (529, None)])
+
+    response, _ = send_message(create_manager(logger, server, scheduler))
+
+    assert response.content[0].text == "[9, 81, 20, -8]"
+    assert scheduler.metrics()["retries"] == 2
+
+
+def test_gives_up_after_max_retries(logger, server):
+    scheduler = RequestScheduler(logger, max_retries=2, initial_backoff=0.01)
+    server.inject_faults([(529, 0)] * 4)
+
+    with pytest.raises(anthropic.APIStatusError) as exc_info:
+        send_message(create_manager(logger, server, scheduler))
+
+    assert exc_info.value.status_code == 529
+    # the first attempt and two retries failed, the remaining fault was not requested
+    assert scheduler.metrics()["retries"] == 2
+    assert server.requests == []
+    assert len(server._faults) == 1
+
+
+def test_non_retryable_error_is_not_retried(logger, server):
+    scheduler = RequestScheduler(logger, max_retries=2, initial_backoff=0.01)
+    server.inject_faults([(400, None)])
+
+    with pytest.raises(anthropic.BadRequestError):
+        send_message(create_manager(logger, server, scheduler))
+
+    assert scheduler.metrics()["retries"] == 0
+
+
+def submit(scheduler, input_tokens=0, output_tokens=0, usage=None):
+    """
+    Submits a request that returns immediately and returns the time it waited for the budgets [s].
+    """
+
+    async def request():
+        return None
+
+    start_time = time.perf_counter()
+    run_sync(scheduler.submit(request, input_tokens=input_tokens, output_tokens=output_tokens, usage=usage))
+    return time.perf_counter() - start_time
+
+
+def test_input_token_bucket_throttles():
+    # 6000 tokens per minute are refilled at 100 tokens per second
+    scheduler = RequestScheduler(input_tokens_per_minute=6000)
+
+    assert submit(scheduler, input_tokens=6000) < 0.2
+    assert submit(scheduler, input_tokens=50) >= 0.4
+
+    metrics = scheduler.metrics()
+    assert metrics["requests"] == 2
+    assert metrics["max_wait_time"] == pytest.approx(0.5, abs=0.1)
+    assert metrics["max_queue_depth"] == 1
+
+
+def test_output_token_bucket_throttles():
+    scheduler = RequestScheduler(output_tokens_per_minute=6000)
+
+    assert submit(scheduler, output_tokens=6000) < 0.2
+    assert submit(scheduler, output_tokens=50) >= 0.4
+
+
+def test_request_bucket_throttles():
+    # one request per second
+    scheduler = RequestScheduler(requests_per_minute=60)
+    scheduler._request_bucket._level = 0
+
+    assert submit(scheduler) >= 0.8
+
+
+def test_unused_reservation_is_refunded():
+    scheduler = RequestScheduler(input_tokens_per_minute=6000)
+
+    # the request reserves the whole bucket, but only uses 100 tokens
+    submit(scheduler, input_tokens=6000, usage=lambda result: (100, 0))
+
+    assert submit(scheduler, input_tokens=1000) < 0.2
+
+
+def test_token_buckets_throttle_messages(logger, server):
+    scheduler = RequestScheduler(logger, input_tokens_per_minute=6000)
+    manager = create_manager(logger, server, scheduler)
+    send_message(manager)
+    # drain the bucket, the next request waits for its estimated input tokens (refilled at 100 tokens per second)
+    scheduler._input_bucket._level = 0
+    expected_wait = manager._token_accountant.estimate() / 100
+    assert expected_wait > 0.5
+
+    _, duration = send_message(manager)
+
+    assert duration >= 0.9 * expected_wait
+    assert scheduler.metrics()["max_queue_depth"] == 1
@@ -0,0 +1,144 @@
+import functools
+import logging
+import os
+import shutil
+
+import anthropic
+
+from llm_magnet_connector.benchmark.iteration_benchmark import _FakeCurveImageGenerator
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    OptimizerParameters,
+    RequestScheduler,
+    ResponseCache,
+    get_initial_prompt,
+    prompts,
+)
+from llm_magnet_connector.orchestrator import ScenarioSweep
+
+SCENARIO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets", "Scenario2")
+
+
+def create_manager(logger, server, response_cache):
+    return AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=RequestScheduler(logger, max_retries=0),
+        base_url=server.base_url,
+        assessment_tool=False,
+        response_cache=response_cache,
+    )
+
+
+def message(text):
+    return anthropic.types.Message.model_validate(
+        {
+            "id": f"msg_{text}",
+            "type": "message",
+            "role": "assistant",
+            "model": "fake",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 10, "output_tokens": 5},
+        }
+    )
+
+
+def request(text):
+    return {"model": "fake", "messages": [{"role": "user", "content": text}]}
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put(request("a"), message("a"))
+    entry_size = cache.stats()["size_bytes"]
+    cache = ResponseCache(str(tmp_path / "limited"), max_bytes=2 * entry_size + entry_size // 2)
+
+    cache.put(request("a"), message("a"))
+    cache.put(request("b"), message("b"))
+    # "a" becomes the most recently used response
+    assert cache.get(request("a")).content[0].text == "a"
+    cache.put(request("c"), message("c"))
+
+    assert cache.get(request("b")) is None
+    assert cache.get(request("a")).content[0].text == "a"
+    assert cache.get(request("c")).content[0].text == "c"
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
+    assert stats["size_bytes"] <= cache.max_bytes
+    assert len(os.listdir(cache.directory)) == 2
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+
+    # the recency is kept across instances
+    reopened = ResponseCache(cache.directory, max_bytes=cache.max_bytes)
+    reopened.get(request("a"))
+    reopened.put(request("d"), message("d"))
+    assert reopened.get(request("c")) is None
+    assert reopened.get(request("a")) is not None
+
+
+def test_changed_prompts_invalidate_responses(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    cache.put(request("a"), message("a"))
+    assert ResponseCache(cache.directory).get(request("a")) is not None
+
+    changed_prompts = tmp_path / "prompts.py"
+    shutil.copyfile(prompts.__file__, changed_prompts)
+    with open(changed_prompts, "a") as file:
+        file.write("\n# changed prompt\n")
+    monkeypatch.setattr(prompts, "__file__", str(changed_prompts))
+
+    assert ResponseCache(cache.directory).get(request("a")) is None
+
+
+def test_bypassing_the_response_cache(logger, server, tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    create_manager(logger, server, cache).prompt("Analyse the curve.", SCENARIO_DIR)
+    assert len(server.requests) == 1
+
+    manager = create_manager(logger, server, cache)
+    response = manager.prompt("Analyse the curve.", SCENARIO_DIR)
+    assert response.optimizer_parameters == OptimizerParameters(9, 81, 20, -8)
+    assert len(server.requests) == 1
+    assert manager.response_cache_hits == 1
+
+    manager = create_manager(logger, server, cache)
+    manager.prompt("Analyse the curve.", SCENARIO_DIR, use_response_cache=False)
+    assert len(server.requests) == 2
+    assert manager.response_cache_hits == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_sweep_statistics(logger, server, tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger=logger.name)
+    cache = ResponseCache(str(tmp_path / "cache"))
+
+    def run_sweep(output_dir):
+        sweep = ScenarioSweep(
+            logger,
+            lambda run_logger: create_manager(run_logger, server, cache),
+            str(tmp_path / output_dir),
+            max_iterations=2,
+            initial_prompt_factory=functools.partial(get_initial_prompt, assessment_tool=False),
+            curve_generator_factory=lambda run_logger, scenario: _FakeCurveImageGenerator(scenario, 0),
+            response_cache=cache,
+        )
+        return sweep.run(ScenarioSweep.grid([SCENARIO_DIR], [OptimizerParameters(9, 80, 20, -8)]))
+
+    [first] = run_sweep("first")
+    requests = len(server.requests)
+    assert requests > 0
+    assert first.result.response_cache_hits == 0
+
+    caplog.clear()
+    [second] = run_sweep("second")
+    # the repeated run is served from the cache
+    assert len(server.requests) == requests
+    assert second.result.response_cache_hits == requests
+    assert second.result.iterations == first.result.iterations
+    assert f"Response cache: {cache.stats()}" in caplog.messages
+    assert cache.stats()["hits"] == requests
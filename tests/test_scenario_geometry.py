@@ -0,0 +1,62 @@
+import os
+import shutil
+
+from llm_magnet_connector.image_generator import ConnectorGeometry, NumpyCurveGenerator, ResponseToImage
+from llm_magnet_connector.llm_interface import (
+    AnthropicConversationManager,
+    OptimizerParameters,
+    RequestScheduler,
+    get_initial_prompt,
+)
+from llm_magnet_connector.orchestrator import MainOrchestrator
+from llm_magnet_connector.testing import FakeAnthropicServer
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets")
+
+
+def create_scenario(directory):
+    """
+    Creates a scenario following the documented layout: the images of the initial prompt and geometry.json in one directory.
+    """
+    scenario_dir = shutil.copytree(os.path.join(ASSETS_DIR, "Scenario2"), os.path.join(directory, "scenario"))
+    ConnectorGeometry(end_point=(50.0, 30.0, 0.0)).save(os.path.join(scenario_dir, "geometry.json"))
+    return scenario_dir
+
+
+def test_geometry_is_read_from_the_scenario(logger, tmp_path):
+    scenario_dir = create_scenario(tmp_path)
+
+    generator = NumpyCurveGenerator.from_scenario(logger, scenario_dir)
+
+    assert tuple(generator.geometry.end_point) == (50.0, 30.0, 0.0)
+
+
+def test_initial_prompt_skips_the_geometry_file(logger, tmp_path):
+    scenario_dir = create_scenario(tmp_path)
+
+    with FakeAnthropicServer(responses=["[9, 81, 20, -8]", "DONE"]) as server:
+        manager = AnthropicConversationManager(
+            logger,
+            cost_1M_input_tokens=3,
+            cost_1M_output_tokens=15,
+            system_prompt="system",
+            scheduler=RequestScheduler(logger, max_retries=0),
+            base_url=server.base_url,
+            assessment_tool=False,
+        )
+        image_generator = ResponseToImage(
+            logger,
+            str(tmp_path / "run"),
+            curve_generator=NumpyCurveGenerator.from_scenario(logger, scenario_dir, image_size=(240, 240)),
+            scenario=scenario_dir,
+        )
+        result = MainOrchestrator(manager, image_generator, 3, logger).run(
+            get_initial_prompt(OptimizerParameters(9, 80, 20, -8), assessment_tool=False), scenario_dir
+        )
+
+    assert result.terminated
+    assert result.iterations == 1
+    initial_content = server.requests[0]["messages"][0]["content"]
+    image_names = [block["text"] for block in initial_content if block["type"] == "text"][:-1]
+    assert image_names == ["Image 0a:", "Image 0b:", "Image 0c:", "Image Z:"]
+    assert sum(block["type"] == "image" for block in initial_content) == 4
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from llm_magnet_connector.llm_interface import AnthropicConversationManager, RequestScheduler
+from llm_magnet_connector.llm_interface.token_accounting import (
+    ContextTokenAccountant,
+    estimate_image_tokens,
+    estimate_text_tokens,
+)
+
+SCENARIO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "assets", "Scenario2")
+
+
+def test_estimate_text_tokens():
+    # "Optimizer" (3), "parameters" (3), 5 punctuation characters, "9" (1), "80" (1), "1234" (2)
+    assert estimate_text_tokens("Optimizer parameters: [9, 80, 1234]") == 15
+    assert estimate_text_tokens("") == 0
+
+
+def test_estimate_image_tokens():
+    assert estimate_image_tokens(750, 100) == 100
+    # downscaled to a long edge of 1568 px
+    assert estimate_image_tokens(3136, 100) == estimate_image_tokens(1568, 50)
+    # downscaled to ~1.15 megapixels
+    assert estimate_image_tokens(2000, 1500) == pytest.approx(1_150_000 / 750, abs=1)
+
+
+def test_incremental_estimate():
+    accountant = ContextTokenAccountant()
+    accountant.overhead_tokens = 10
+    accountant.add_element(100)
+    accountant.add_element(200)
+    accountant.extend_last(50)
+    assert accountant.estimate() == 360
+    assert accountant.element_tokens(1) == 250
+
+    # e.g., a summary inserted after the first element
+    accountant.insert(1, 30)
+    assert accountant.raw_total() == 390
+    assert accountant.pop(2) == 250
+    assert accountant.pop(0) == 100
+    assert accountant.element_tokens(0) == 30
+    assert accountant.raw_total() == 40
+
+
+def test_calibration_factor():
+    accountant = ContextTokenAccountant(calibration_smoothing=0.5)
+    accountant.add_element(1000)
+    accountant.calibrate(1000, 2000)
+    assert accountant.calibration_factor == pytest.approx(1.5)
+    assert accountant.estimate() == 1500
+    accountant.calibrate(1000, 2000)
+    assert accountant.calibration_factor == pytest.approx(1.75)
+
+    # counts without tokens are ignored
+    accountant.calibrate(0, 2000)
+    accountant.calibrate(1000, 0)
+    assert accountant.calibration_factor == pytest.approx(1.75)
+
+    # the estimate converges to the counted tokens
+    for _ in range(20):
+        accountant.calibrate(1000, 800)
+    assert accountant.estimate() == pytest.approx(800, abs=1)
+
+
+def test_manager_keeps_the_estimate_of_each_element(logger, server):
+    manager = AnthropicConversationManager(
+        logger,
+        cost_1M_input_tokens=3,
+        cost_1M_output_tokens=15,
+        system_prompt="system",
+        scheduler=RequestScheduler(logger, max_retries=0),
+        base_url=server.base_url,
+        assessment_tool=False,
+        token_count_margin=0,
+    )
+    manager.prompt("Analyse the curve.", SCENARIO_DIR)
+    accountant = manager._token_accountant
+
+    # the first request is calibrated with the input tokens reported by the API
+    raw_estimate = accountant.raw_total() - manager._estimate_message_tokens(manager._context[-1][-1])
+    ratio = server._estimate_input_tokens(server.requests[0]) / raw_estimate
+    assert accountant.calibration_factor == pytest.approx(1 + 0.5 * (ratio - 1))
+
+    for _ in range(3):
+        manager.prompt("Analyse the next curve.", SCENARIO_DIR)
+    assert len(manager._context) == 4
+    for index, element in enumerate(manager._context):
+        assert accountant.element_tokens(index) == sum(manager._estimate_message_tokens(message) for message in element)
+    assert accountant.estimate() == round(accountant.raw_total() * accountant.calibration_factor)